@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import multiprocessing
+import resource
+import socket
+import tempfile
+import time
+from typing import Callable
+from typing import Dict
+from typing import Tuple
+
+import click
+
+from catt.http_server import copy_byte_range
+from catt.http_server import send_byte_range
+
+READ_SIZE = 1024 * 1024
+
+
+def drain(address: Tuple[str, int]) -> None:
+    """Receive everything sent over a connection to address, throwing it away."""
+
+    buf = bytearray(READ_SIZE)
+    with socket.create_connection(address) as sock:
+        while sock.recv_into(buf):
+            pass
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def send_with_sendfile(infile, sock, size):
+    send_byte_range(infile, sock, sock.makefile("wb", buffering=0), 0, size - 1)
+
+
+def send_buffered(infile, sock, size):
+    # The fallback of send_byte_range, for when sendfile is unavailable.
+    copy_byte_range(infile, sock.makefile("wb", buffering=0), 0, size - 1)
+
+
+def measure(send: Callable, filename: str, size: int) -> Tuple[float, float]:
+    """Send the file over loopback, and return the wall and (sending) CPU time."""
+
+    context = multiprocessing.get_context("spawn")
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        # The receiving end runs in another process, so that the CPU time
+        # of this one is that of the sending end.
+        receiver = context.Process(target=drain, args=(listener.getsockname(),))
+        receiver.start()
+        sock, _ = listener.accept()
+        with sock, open(filename, "rb") as infile:
+            start_wall, start_cpu = time.perf_counter(), cpu_time()
+            send(infile, sock, size)
+            sock.shutdown(socket.SHUT_WR)
+            receiver.join()
+            return time.perf_counter() - start_wall, cpu_time() - start_cpu
+
+
+def benchmark(filename: str, size: int, runs: int) -> None:
+    paths: Dict[str, Callable] = {
+        "sendfile": send_with_sendfile,
+        "buffered": send_buffered,
+    }
+    best: Dict[str, Tuple[float, float]] = {}
+    # The first pass over the file also fills the page cache, so it isn't counted.
+    measure(send_with_sendfile, filename, size)
+    for run in range(runs):
+        for name, send in paths.items():
+            wall, cpu = measure(send, filename, size)
+            click.echo(
+                "Run {} {}: {:.0f} MB/s, {:.2f} s CPU.".format(
+                    run + 1, name, size / 2**20 / wall, cpu
+                )
+            )
+            if name not in best or wall < best[name][0]:
+                best[name] = (wall, cpu)
+
+    sendfile_wall, sendfile_cpu = best["sendfile"]
+    buffered_wall, buffered_cpu = best["buffered"]
+    click.echo(
+        "Best runs: sendfile {:.0f} MB/s ({:.2f} s CPU), "
+        "buffered {:.0f} MB/s ({:.2f} s CPU).".format(
+            size / 2**20 / sendfile_wall,
+            sendfile_cpu,
+            size / 2**20 / buffered_wall,
+            buffered_cpu,
+        )
+    )
+    click.echo(
+        "sendfile is {:.1f}x as fast, and uses {:.1f}x less CPU.".format(
+            buffered_wall / sendfile_wall, buffered_cpu / max(sendfile_cpu, 1e-3)
+        )
+    )
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--size",
+    default=4,
+    show_default=True,
+    help="Size of the sent file, in GB.",
+)
+@click.option("-r", "--runs", default=3, show_default=True, help="Number of runs.")
+def cli(size, runs):
+    """
+    Benchmark sending a large file over loopback, with sendfile and with the
+    buffered fallback, and the CPU time each of them takes.
+
+    The file is sparse, so the numbers are those of sending, rather than of the disk.
+    """
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as tfile:
+        tfile.truncate(size * 2**30)
+        click.echo("Sending {} GB, {} times each way.".format(size, runs))
+        benchmark(tfile.name, size * 2**30, runs)
+
+
+if __name__ == "__main__":
+    cli()
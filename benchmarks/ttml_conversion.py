@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator
+
+import click
+
+from catt.subs_info import convert_ttml_to_webvtt
+from catt.subs_info import open_subtitles
+
+TTML_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<tt xmlns="http://www.w3.org/ns/ttml" ttp:frameRate="25"'
+    ' xmlns:tts="http://www.w3.org/ns/ttml#styling"'
+    ' xmlns:ttp="http://www.w3.org/ns/ttml#parameter">\n'
+    "<head><styling>"
+    '<style xml:id="italic" tts:fontStyle="italic"/>'
+    '<style xml:id="bold" tts:fontWeight="bold"/>'
+    "</styling><layout>"
+    '<region xml:id="bottom" tts:origin="10% 80%" tts:textAlign="center"/>'
+    '<region xml:id="top" tts:origin="10% 5%" tts:textAlign="center"/>'
+    "</layout></head>\n<body><div>\n"
+)
+TTML_CUE = (
+    '<p begin="{begin}" end="{end}" region="{region}">'
+    'Cue number {number}, <span style="italic">as spoken</span> by'
+    '<br/><span style="bold">SOMEONE</span> &amp; someone else.</p>\n'
+)
+TTML_TAIL = "</div></body></tt>\n"
+
+
+def clock_time(frames: int) -> str:
+    seconds, frames = divmod(frames, 25)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{:02d}:{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds, frames)
+
+
+def make_ttml(size: int) -> Iterator[str]:
+    """Make a broadcast style TTML document of (at least) the given size, in bytes."""
+
+    yield TTML_HEAD
+    length = len(TTML_HEAD)
+    number = 0
+    while length < size:
+        cue = TTML_CUE.format(
+            begin=clock_time(number * 75),
+            end=clock_time(number * 75 + 60),
+            region="top" if number % 10 == 0 else "bottom",
+            number=number,
+        )
+        yield cue
+        length += len(cue)
+        number += 1
+    yield TTML_TAIL
+
+
+def benchmark(filename: str, runs: int) -> None:
+    size = Path(filename).stat().st_size
+    click.echo("Converting {:.1f} MB of TTML, {} times.".format(size / 2**20, runs))
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for run in range(runs):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        with open_subtitles(filename) as subsfile:
+            cues = sum(1 for _ in convert_ttml_to_webvtt(subsfile)) - 1
+        wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+        click.echo(
+            "Run {}: {} cues in {:.2f} s ({:.2f} s CPU), {:.1f} MB/s.".format(
+                run + 1, cues, wall, cpu, size / 2**20 / wall
+            )
+        )
+
+    # Memory use should not depend on the size of the document.
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+    click.echo("Max RSS grew by {:.1f} MB while converting.".format(growth / 1024))
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--size",
+    default=20,
+    show_default=True,
+    help="Size of the TTML document, in MB.",
+)
+@click.option("-r", "--runs", default=3, show_default=True, help="Number of runs.")
+def cli(size, runs):
+    """Benchmark the conversion of a large TTML document to WebVTT."""
+
+    with tempfile.NamedTemporaryFile("w", suffix=".ttml", encoding="utf-8") as tfile:
+        tfile.writelines(make_ttml(size * 1024 * 1024))
+        tfile.flush()
+        benchmark(tfile.name, runs)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+DEFAULT_SUBTITLE_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def evict_least_recently_used(cache_dir: Path, pattern: str, max_size: int) -> None:
+    """
+    Remove the least recently modified files matching pattern from cache_dir,
+    until the files that remain take up no more than max_size bytes.
+    """
+
+    entries = []
+    for path in cache_dir.glob(pattern):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total_size -= size
+
+
+class FileCache:
+    """
+    A persistent cache of JSON-serializable values, with one file per entry.
+
+    Entries expire at a time chosen when they are stored. When the cache grows
+    beyond max_size bytes, the least recently used entries are evicted
+    (the modification time of an entry is updated whenever it is read).
+    The cache is only an optimization, so I/O errors are ignored.
+
+    :param cache_dir: Directory to store entries in.
+    :type cache_dir: Path
+    :param max_size: Maximum total size of the entries in bytes.
+    :type max_size: int
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _entry_path(self, key: str) -> Path:
+        return Path(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._entry_path(key)
+        try:
+            with path.open() as entry_file:
+                entry = json.load(entry_file)
+            if entry["key"] != key:
+                return None
+            if entry["expires"] <= time.time():
+                path.unlink()
+                return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any, expires: float) -> None:
+        """
+        Store a value.
+
+        :param key: Key of the entry.
+        :type key: str
+        :param value: JSON-serializable value.
+        :param expires: Timestamp after which the entry is no longer valid.
+        :type expires: float
+        """
+
+        if expires <= time.time():
+            return
+        try:
+            data = json.dumps({"key": key, "expires": expires, "value": value})
+        except (TypeError, ValueError):
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first, so readers never see a partial entry.
+            with tempfile.NamedTemporaryFile(
+                "w", dir=str(self.cache_dir), suffix=".tmp", delete=False
+            ) as entry_file:
+                entry_file.write(data)
+            os.replace(entry_file.name, str(self._entry_path(key)))
+            self._evict()
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        evict_least_recently_used(self.cache_dir, "*.json", self.max_size)
+
+
+class SubtitleCache:
+    """
+    A persistent, content-addressed cache of converted subtitles, with one file per entry.
+
+    Entries are stored under a digest of the source subtitles and of the way they were
+    converted (see subs_info.conversion_digest), so they never go stale.
+    Eviction works as in FileCache, and I/O errors are ignored here too.
+
+    :param cache_dir: Directory to store entries in.
+    :type cache_dir: Path
+    :param max_size: Maximum total size of the entries in bytes.
+    :type max_size: int
+    """
+
+    def __init__(
+        self, cache_dir: Path, max_size: int = DEFAULT_SUBTITLE_CACHE_SIZE
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _entry_path(self, digest: str) -> Path:
+        return Path(self.cache_dir, digest + ".vtt")
+
+    def get(self, digest: str) -> Optional[Path]:
+        """Return the path of the entry stored under digest, if there is one."""
+
+        path = self._entry_path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, digest: str, pieces: Iterable[str]) -> Iterator[str]:
+        """
+        Pass converted subtitles through, while storing them under digest.
+        The entry only appears once all of the pieces have been passed through.
+        """
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            entry_file = tempfile.NamedTemporaryFile(
+                "w",
+                encoding="utf-8",
+                dir=str(self.cache_dir),
+                suffix=".tmp",
+                delete=False,
+            )
+        except OSError:
+            yield from pieces
+            return
+
+        writing, stored = True, False
+        try:
+            for piece in pieces:
+                if writing:
+                    try:
+                        entry_file.write(piece)
+                    except OSError:
+                        writing = False
+                yield piece
+            if writing:
+                try:
+                    entry_file.close()
+                    os.replace(entry_file.name, str(self._entry_path(digest)))
+                    stored = True
+                except OSError:
+                    pass
+        finally:
+            if not stored:
+                try:
+                    entry_file.close()
+                except OSError:
+                    pass
+                try:
+                    os.unlink(entry_file.name)
+                except OSError:
+                    pass
+        if stored:
+            evict_least_recently_used(self.cache_dir, "*.vtt", self.max_size)
@@ -1,8 +1,6 @@
 # -*- coding: utf-8 -*-
 import configparser
-import random
 import sys
-import time
 
 try:
     from importlib.metadata import version
@@ -10,34 +8,47 @@ except ImportError:
     # We're running a Python < 3.8
     from importlib_metadata import version  # type: ignore
 from pathlib import Path
-from threading import Thread
 from urllib.parse import urlparse
 
 import click
 
 from . import __codename__
+from .cache import SubtitleCache
 from .controllers import CastState
+from .controllers import make_queue_item
+from .controllers import make_subtitle_track
 from .controllers import setup_cast
 from .controllers import StateFileError
 from .controllers import StateMode
+from .daemon import CattDaemon
+from .daemon import run_in_daemon
 from .discovery import cast_ip_exists
+from .discovery import DISCOVERY_TIMEOUT
 from .discovery import get_cast_infos
+from .discovery import get_casts_with_latency
 from .error import CastError
 from .error import CattUserError
 from .error import CliError
-from .http_server import serve_file
-from .subs_info import SubsInfo
+from .error import ExtractionError
+from .error import FormatError
+from .http_server import MediaServer
 from .util import echo_json
 from .util import echo_status
 from .util import echo_warning
+from .util import find_media_files
+from .util import GLOB_CHARS_RE
+from .util import guess_mime
 from .util import hunt_subtitles
 from .util import is_ipaddress
+from .util import SubtitleIndex
+from .util import SUBTITLE_EXTENSIONS
 
 CONFIG_DIR = Path(click.get_app_dir("catt"))
 CONFIG_PATH = Path(CONFIG_DIR, "catt.cfg")
 STATE_PATH = Path(CONFIG_DIR, "state.json")
 
 WAIT_PLAY_TIMEOUT = 30
+MP4_CONTENT_TYPES = ["video/mp4", "audio/mp4"]
 
 PROGRAM_NAME = "catt"
 try:
@@ -87,6 +98,9 @@ STREAM_TYPE = click.Choice(["NONE", "BUFFERED", "LIVE"], case_sensitive=False)
 
 
 def process_url(ctx, param, value: str):
+    if value == "-" and ctx.params.get("follow"):
+        # The media itself is streamed from stdin.
+        return value
     if value == "-":
         stdin_text = click.get_text_stream("stdin")
         if not stdin_text.isatty():
@@ -96,7 +110,9 @@ def process_url(ctx, param, value: str):
     if "://" not in value:
         if ctx.info_name != "cast":
             raise CliError("Local file not allowed as argument to this command")
-        if not Path(value).is_file():
+        if not Path(value).is_file() and not find_media_files(value):
+            if Path(value).is_dir() or GLOB_CHARS_RE.search(value):
+                raise CliError("No audio or video files were found")
             raise CliError("The chosen file does not exist")
     return value
 
@@ -109,17 +125,17 @@ def process_path(ctx, param, value):
 
 
 def process_subtitles(ctx, param, value):
-    if not value:
-        return None
-    pval = urlparse(value).path if "://" in value else value
-    if "://" not in value and not pval.lower().endswith((".srt", ".vtt", ".ttml")):
-        raise CliError(
-            "Invalid subtitle format. Only srt, vtt, and ttml are supported.\n"
-            "(Timing, bold/italics, and positioning are honored; other styling is dropped.)"
-        )
-    if "://" not in value and not Path(value).is_file():
-        raise CliError("Subtitles file [{}] does not exist".format(value))
-    return value
+    for subtitles in value:
+        if "://" in subtitles:
+            continue
+        if not subtitles.lower().endswith(SUBTITLE_EXTENSIONS):
+            raise CliError(
+                "Invalid subtitle format. Only srt, vtt, and ttml (or dfxp) are supported.\n"
+                "(Timing, bold/italics, and positioning are honored; other styling is dropped.)"
+            )
+        if not Path(subtitles).is_file():
+            raise CliError("Subtitles file [{}] does not exist".format(subtitles))
+    return list(value)
 
 
 def process_device(device_desc, aliases):
@@ -145,13 +161,75 @@ def fail_if_no_ip(ipaddr):
         raise CliError("Local IP-address could not be determined")
 
 
-def create_server_thread(filename, address, port, content_type=None, single_req=False):
-    thr = Thread(
-        target=serve_file, args=(filename, address, port, content_type, single_req)
-    )
-    thr.setDaemon(True)
-    thr.start()
-    return thr
+def playlist_queue_items(stream):
+    """Resolve the entries of a playlist into queue items, as they are needed."""
+
+    stream.start_prefetching()
+    number = 0
+    try:
+        while True:
+            try:
+                stream.set_playlist_entry(number)
+                item = make_queue_item(
+                    stream.video_url,
+                    content_type=stream.guessed_content_type,
+                    title=stream.video_title,
+                    thumb=stream.video_thumbnail,
+                )
+            except IndexError:
+                return
+            except (ExtractionError, FormatError) as err:
+                # Unavailable entries are common in playlists, and shouldn't end playback.
+                echo_warning("Skipping playlist entry {}: {}".format(number + 1, err))
+            else:
+                click.echo('Queueing "{}"...'.format(stream.video_title))
+                yield item
+            number += 1
+    finally:
+        stream.stop_prefetching()
+
+
+def subs_timing(offset: float, rate: float):
+    from .subs_info import SubtitleTiming
+
+    return SubtitleTiming(offset, rate)
+
+
+def local_queue_items(server, stream, media_files, find_subtitles=True, timing=None):
+    """
+    Serve local files (and the subtitles next to them) from one server,
+    as queue items, as they are needed.
+    """
+
+    subtitle_index = SubtitleIndex()
+    for media_file in media_files:
+        content_type = guess_mime(media_file)
+        subs_url = None
+        subtitles = subtitle_index.find(media_file) if find_subtitles else None
+        if subtitles:
+            from .subs_info import SUBTITLE_CACHE_DIR
+            from .subs_info import SubsInfo
+
+            subs = SubsInfo(
+                subtitles,
+                stream.local_ip,
+                stream.port,
+                cache=SubtitleCache(SUBTITLE_CACHE_DIR),
+                timing=timing,
+            )
+            subs_url = subs.serve(server)
+        media_url = server.add_file(
+            str(media_file),
+            content_type,
+            faststart=content_type in MP4_CONTENT_TYPES,
+        )
+        click.echo('Queueing "{}"...'.format(media_file.name))
+        yield make_queue_item(
+            media_url + "?loaded_from_catt",
+            content_type=content_type,
+            title=media_file.name,
+            subtitles=subs_url,
+        )
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -159,18 +237,27 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option("-d", "--device", metavar="NAME_OR_IP", help="Select Chromecast device.")
+@click.option(
+    "--discovery-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DISCOVERY_TIMEOUT,
+    show_default=True,
+    metavar="SECS",
+    help="Give up looking for devices on the network after this many seconds.",
+)
 @click.version_option(
     version=VERSION,
     prog_name=PROGRAM_NAME,
     message="%(prog)s v%(version)s, " + __codename__ + ".",
 )
 @click.pass_context
-def cli(ctx, device):
+def cli(ctx, device, discovery_timeout):
     device_from_config = ctx.obj["options"].get("device")
     ctx.obj["selected_device"] = process_device(
         device or device_from_config, ctx.obj["aliases"]
     )
     ctx.obj["selected_device_is_from_cli"] = bool(device)
+    ctx.obj["discovery_timeout"] = discovery_timeout
 
 
 @cli.command(short_help="Send a video to a Chromecast for playing.")
@@ -179,8 +266,10 @@ def cli(ctx, device):
     "-s",
     "--subtitles",
     callback=process_subtitles,
+    multiple=True,
     metavar="SUB",
-    help="Specify a subtitles file.",
+    help="Specify a subtitles file. "
+    "Can be given several times, to add several tracks (the first one is shown).",
 )
 @click.option(
     "-f",
@@ -200,6 +289,22 @@ def cli(ctx, device):
     default=False,
     help="Don't try to load subtitles automatically from the local folder.",
 )
+@click.option(
+    "--subs-offset",
+    type=float,
+    default=0.0,
+    metavar="SECONDS",
+    help="Shift subtitles served by catt by SECONDS (negative to show them earlier). "
+    'Can be changed during playback with "catt subs --offset".',
+)
+@click.option(
+    "--subs-rate",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    metavar="RATE",
+    help="Multiply the timestamps of subtitles served by catt by RATE "
+    "(like 25/23.976 = 1.0427 for subtitles timed for 25 fps, on a 23.976 fps video).",
+)
 @click.option(
     "-n",
     "--no-playlist",
@@ -241,13 +346,26 @@ def cli(ctx, device):
     is_flag=True,
     help="Keep catt process alive until playback has ended. "
     "Only useful when casting remote files, as catt is already running a server when casting local files. "
-    "Currently exits after playback of single media, so not useful with playlists yet.",
+    "Playlists are played in full (as a queue on the device), when they are cast with the default app.",
 )
 @click.option(
     "--stream-type",
     type=STREAM_TYPE,
     help="Treat as a live stream or fixed-length video (for debugging).",
 )
+@click.option(
+    "-F",
+    "--follow",
+    is_flag=True,
+    is_eager=True,
+    help="Keep serving a local file that is still being written to (like a recording in progress). "
+    "Use - as the file to stream media from stdin.",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Show how long discovery, extraction and launching the app took.",
+)
 @click.pass_obj
 def cast(
     settings,
@@ -256,6 +374,8 @@ def cast(
     force_default: bool,
     random_play: bool,
     no_subs: bool,
+    subs_offset: float,
+    subs_rate: float,
     no_playlist: bool,
     ytdl_option,
     seek_to: str,
@@ -263,116 +383,264 @@ def cast(
     volume: int,
     stream_type: str,
     block: bool = False,
+    follow: bool = False,
+    timings: bool = False,
 ):
+    if follow and not stream_type:
+        stream_type = "LIVE"
     controller = "default" if force_default or ytdl_option else None
     playlist_playback = False
-    st_thr = su_thr = subs = None
+    queue_playback = False
+    server = media_url = media_files = None
+    subtitle_tracks: list = []
+    if "://" not in video_url and video_url != "-" and not Path(video_url).is_file():
+        # A directory, or a glob pattern, which is played as a queue.
+        if follow:
+            raise CliError("Only a single file can be followed")
+        if subtitles:
+            raise CliError(
+                "Subtitles can't be specified when casting several files "
+                "(they are found next to each file)"
+            )
+        media_files = find_media_files(video_url)
+    stage_timings: dict = {}
     cst, stream = setup_cast(
         settings["selected_device"],
-        video_url=video_url,
+        discovery_timeout=settings["discovery_timeout"],
+        video_url=str(media_files[0]) if media_files else video_url,
         prep="app",
         controller=controller,
         ytdl_options=ytdl_option,
         stream_type=stream_type,
+        timings=stage_timings,
     )
-    media_is_image = stream.guessed_content_category == "image"
-    local_or_remote = "local" if stream.is_local_file else "remote"
-
-    if stream.is_local_file:
-        fail_if_no_ip(stream.local_ip)
-        st_thr = create_server_thread(
-            video_url,
-            stream.local_ip,
-            stream.port,
-            stream.guessed_content_type,
-            single_req=media_is_image,
+    if timings:
+        click.echo(
+            "Timings: "
+            + ", ".join(
+                "{} {:.2f}s".format(stage.replace("_", " "), seconds)
+                for stage, seconds in stage_timings.items()
+            ),
+            err=True,
         )
-    elif stream.is_playlist and not (no_playlist and stream.video_id):
-        if stream.playlist_length == 0:
-            cst.kill(idle_only=True)
-            raise CliError("Playlist is empty")
-        if not random_play and cst.playlist_capability and stream.playlist_all_ids:
-            playlist_playback = True
-        else:
-            if random_play:
-                entry = random.randrange(0, stream.playlist_length)
+    try:
+        if media_files:
+            fail_if_no_ip(stream.local_ip)
+            click.echo(
+                "Casting {} local files from {}...".format(len(media_files), video_url)
+            )
+            if volume is not None:
+                cst.volume(volume / 100.0)
+            server = MediaServer(stream.local_ip, stream.port)
+            server.start()
+            cst.play_queue(
+                local_queue_items(
+                    server,
+                    stream,
+                    media_files,
+                    find_subtitles=not no_subs,
+                    timing=subs_timing(subs_offset, subs_rate),
+                )
+            )
+            return
+
+        media_is_image = stream.guessed_content_category == "image"
+        media_info = stream.media_info
+        local_or_remote = "local" if stream.is_local_file else "remote"
+
+        if stream.is_local_file:
+            fail_if_no_ip(stream.local_ip)
+            server = MediaServer(stream.local_ip, stream.port)
+            if video_url == "-":
+                media_url = server.add_stream(
+                    click.get_binary_stream("stdin"),
+                    stream.guessed_content_type,
+                    "stdin",
+                )
+            else:
+                media_url = server.add_file(
+                    video_url,
+                    stream.guessed_content_type,
+                    faststart=stream.guessed_content_type in MP4_CONTENT_TYPES,
+                    follow=follow,
+                )
+            media_url += "?loaded_from_catt"
+            server.start()
+        elif stream.is_playlist and not (no_playlist and stream.video_id):
+            if stream.playlist_is_empty:
+                cst.kill(idle_only=True)
+                raise CliError("Playlist is empty")
+            if not random_play and cst.playlist_capability and stream.playlist_first_id:
+                playlist_playback = True
+            elif random_play:
+                stream.set_random_playlist_entry()
+            elif block and cst.queue_capability:
+                queue_playback = True
             else:
                 echo_warning("Playlist playback not possible, playing first video")
-                entry = 0
-            stream.set_playlist_entry(entry)
+                stream.set_playlist_entry(0)
+
+        if playlist_playback:
+            click.echo("Casting remote playlist {}...".format(video_url))
+            video_id = stream.video_id or stream.playlist_first_id
+            cst.play_playlist(stream.playlist_id, video_id=video_id)
+        elif queue_playback:
+            click.echo("Casting remote playlist {}...".format(video_url))
+            if volume is not None:
+                cst.volume(volume / 100.0)
+            cst.play_queue(playlist_queue_items(stream))
+            return
+        else:
+            if (
+                not subtitles
+                and not no_subs
+                and stream.is_local_file
+                and video_url != "-"
+            ):
+                found_subtitles = hunt_subtitles(video_url)
+                subtitles = [found_subtitles] if found_subtitles else []
+            if stream.converted_subtitle_tracks and cst.info_type == "url":
+                from .subs_info import SUBTITLE_CACHE_DIR
+                from .subs_info import serve_subtitle_tracks
 
-    if playlist_playback:
-        click.echo("Casting remote playlist {}...".format(video_url))
-        video_id = stream.video_id or stream.playlist_all_ids[0]
-        cst.play_playlist(stream.playlist_id, video_id=video_id)
-    else:
-        if not subtitles and not no_subs and stream.is_local_file:
-            subtitles = hunt_subtitles(video_url)
-        if subtitles:
-            subs = SubsInfo(subtitles, stream.local_ip, stream.port + 1)
-            if subs.local_subs:
                 fail_if_no_ip(stream.local_ip)
-                su_thr = create_server_thread(
-                    subs.file,
-                    subs.local_ip,
-                    subs.port,
-                    single_req=True,
+                if not server:
+                    server = MediaServer(stream.local_ip, stream.port)
+                    server.start()
+                served_tracks = serve_subtitle_tracks(
+                    server,
+                    stream.converted_subtitle_tracks,
+                    cache=SubtitleCache(SUBTITLE_CACHE_DIR),
+                    timing=subs_timing(subs_offset, subs_rate),
+                )
+                media_info = dict(media_info or {})
+                media_info["tracks"] = media_info.get("tracks", []) + served_tracks
+            if subtitles and cst.info_type == "url":
+                from .subs_info import SUBTITLE_CACHE_DIR
+                from .subs_info import SubsInfo
+
+                # Specified subtitles come after any other tracks, the first one is shown.
+                track_id = max(
+                    (
+                        track["trackId"]
+                        for track in (media_info or {}).get("tracks", [])
+                    ),
+                    default=0,
+                )
+                for subtitles_location in subtitles:
+                    subs = SubsInfo(
+                        subtitles_location,
+                        stream.local_ip,
+                        stream.port,
+                        cache=SubtitleCache(SUBTITLE_CACHE_DIR),
+                        timing=subs_timing(subs_offset, subs_rate),
+                    )
+                    subs_url = subs.url
+                    if subs.local_subs:
+                        fail_if_no_ip(stream.local_ip)
+                        if not server:
+                            server = MediaServer(stream.local_ip, stream.port)
+                            server.start()
+                        subs_url = subs.serve(server)
+                    track_id += 1
+                    subtitle_tracks.append(
+                        make_subtitle_track(
+                            track_id,
+                            subs_url,
+                            name=Path(urlparse(subtitles_location).path).name,
+                        )
+                    )
+
+            click.echo("Casting {} file {}...".format(local_or_remote, video_url))
+            click.echo(
+                '{} "{}" on "{}"...'.format(
+                    "Showing" if media_is_image else "Playing",
+                    title or stream.video_title,
+                    cst.cc_name,
                 )
-
-        click.echo("Casting {} file {}...".format(local_or_remote, video_url))
-        click.echo(
-            '{} "{}" on "{}"...'.format(
-                "Showing" if media_is_image else "Playing",
-                title or stream.video_title,
-                cst.cc_name,
-            )
-        )
-        if volume is not None:
-            cst.volume(volume / 100.0)
-
-        if cst.info_type == "url":
-            cst.play_media_url(
-                stream.video_url,
-                title=title or stream.video_title,
-                content_type=stream.guessed_content_type,
-                subtitles=subs.url if subs else None,
-                thumb=stream.video_thumbnail,
-                current_time=seek_to,
-                stream_type=getattr(stream, "stream_type", None),
-                media_info=getattr(stream, "media_info", None),
             )
-        elif cst.info_type == "id":
-            cst.play_media_id(stream.video_id, current_time=seek_to)
-        else:
-            raise ValueError("Invalid or undefined info type")
-
-    if stream.is_local_file or (subs is not None and subs.local_subs):
-        click.echo("Serving local file(s).")
-    if not media_is_image and (stream.is_local_file or block):
-        if not cst.wait_for(["PLAYING"], timeout=WAIT_PLAY_TIMEOUT):
-            raise CliError("Playback of {} file has failed".format(local_or_remote))
-        cst.wait_for(["UNKNOWN", "IDLE"])
-    elif (stream.is_local_file and media_is_image) or subs:
-        while (st_thr and st_thr.is_alive()) or (su_thr and su_thr.is_alive()):
-            time.sleep(1)
+            if volume is not None:
+                cst.volume(volume / 100.0)
+
+            if cst.info_type == "url":
+                cst.play_media_url(
+                    media_url or stream.video_url,
+                    title=title or stream.video_title,
+                    content_type=stream.guessed_content_type,
+                    subtitle_tracks=subtitle_tracks,
+                    thumb=stream.video_thumbnail,
+                    current_time=seek_to,
+                    stream_type=getattr(stream, "stream_type", None),
+                    media_info=media_info,
+                )
+            elif cst.info_type == "id":
+                cst.play_media_id(stream.video_id, current_time=seek_to)
+            else:
+                raise ValueError("Invalid or undefined info type")
+
+        if server:
+            click.echo("Serving local file(s).")
+        # Whatever is served is needed for as long as the media plays, as the device
+        # may request it again (after seeking, switching subtitles or retiming them).
+        if media_is_image and server:
+            server.connection_handled.wait()
+        elif not media_is_image and (server or block):
+            if not cst.wait_for(["PLAYING"], timeout=WAIT_PLAY_TIMEOUT):
+                raise CliError("Playback of {} file has failed".format(local_or_remote))
+            cst.wait_for_playback_end()
+    finally:
+        # Also when interrupted, so that nothing (like the copy of stdin) is left behind.
+        if server:
+            server.stop()
 
 
 @cli.command(short_help="List and toggle captions (does not work in the YouTube app).")
 @click.argument("track_id", required=False, type=int)
 @click.option("-n", "--off", is_flag=True, help="Hides all subtitles")
 @click.option("-l", "--list", "list_subs", is_flag=True, help="Lists all subtitles")
+@click.option(
+    "-o",
+    "--offset",
+    type=float,
+    metavar="SECONDS",
+    help="Shift the subtitles served by catt by SECONDS, relative to their original "
+    "timing (reloads the media at its current position).",
+)
+@click.option(
+    "-r",
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    metavar="RATE",
+    help="Multiply the timestamps of the subtitles served by catt by RATE "
+    "(reloads the media at its current position).",
+)
 @click.pass_obj
-def subs(settings, track_id, off, list_subs):
-    if not off and not track_id and not list_subs:
+def subs(settings, track_id, off, list_subs, offset, rate):
+    if not off and not track_id and not list_subs and offset is None and rate is None:
         click.echo("Try 'catt subs --help' for help.")
         return
+    if offset is not None or rate is not None:
+        cst = setup_cast(
+            settings["selected_device"],
+            discovery_timeout=settings["discovery_timeout"],
+            action="retime_subtitles",
+            prep="control",
+        )
+        cst.retime_subtitles(offset=offset, rate=rate)
     if off:
         cst = setup_cast(
-            settings["selected_device"], action="disable_subtitle", prep="control"
+            settings["selected_device"],
+            discovery_timeout=settings["discovery_timeout"],
+            action="disable_subtitle",
+            prep="control",
         )
         cst.disable_subtitle()
     if list_subs:
-        cst = setup_cast(settings["selected_device"], prep="info")
+        cst = setup_cast(
+            settings["selected_device"],
+            discovery_timeout=settings["discovery_timeout"],
+            prep="info",
+        )
         for track in cst.info["subtitle_tracks"]:
             if track.get("type") == "TEXT":
                 trackId = track["trackId"]
@@ -380,7 +648,10 @@ def subs(settings, track_id, off, list_subs):
                 click.echo(f"{trackId}\t{name}")
     if track_id:
         cst = setup_cast(
-            settings["selected_device"], action="enable_subtitle", prep="control"
+            settings["selected_device"],
+            discovery_timeout=settings["discovery_timeout"],
+            action="enable_subtitle",
+            prep="control",
         )
         cst.enable_subtitle(track_id)
 
@@ -391,6 +662,7 @@ def subs(settings, track_id, off, list_subs):
 def cast_site(settings, url):
     cst = setup_cast(
         settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
         controller="dashcast",
         action="load_url",
         prep="app",
@@ -410,7 +682,11 @@ def cast_site(settings, url):
 @click.pass_obj
 def add(settings, video_url, play_next):
     cst, stream = setup_cast(
-        settings["selected_device"], video_url=video_url, action="add", prep="control"
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        video_url=video_url,
+        action="add",
+        prep="control",
     )
     if cst.name != stream.extractor or not (
         stream.is_remote_file or stream.is_playlist_with_active_entry
@@ -429,6 +705,7 @@ def add(settings, video_url, play_next):
 def remove(settings, video_url):
     cst, stream = setup_cast(
         settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
         video_url=video_url,
         action="remove",
         prep="control",
@@ -442,28 +719,48 @@ def remove(settings, video_url):
 @cli.command(short_help="Clear the queue (YouTube only).")
 @click.pass_obj
 def clear(settings):
-    cst = setup_cast(settings["selected_device"], action="clear", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="clear",
+        prep="control",
+    )
     cst.clear()
 
 
 @cli.command(short_help="Pause a video.")
 @click.pass_obj
 def pause(settings):
-    cst = setup_cast(settings["selected_device"], action="pause", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="pause",
+        prep="control",
+    )
     cst.pause()
 
 
 @cli.command(short_help="Resume a video after it has been paused.")
 @click.pass_obj
 def play(settings):
-    cst = setup_cast(settings["selected_device"], action="play", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="play",
+        prep="control",
+    )
     cst.play()
 
 
 @cli.command("play_toggle", short_help="Toggle between playing and paused state.")
 @click.pass_obj
 def play_toggle(settings):
-    cst = setup_cast(settings["selected_device"], action="play_toggle", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="play_toggle",
+        prep="control",
+    )
     cst.play_toggle()
 
 
@@ -477,7 +774,9 @@ def play_toggle(settings):
 )
 @click.pass_obj
 def stop(settings, force):
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     cst.kill(force=force)
 
 
@@ -487,7 +786,12 @@ def stop(settings, force):
 )
 @click.pass_obj
 def rewind(settings, timedesc):
-    cst = setup_cast(settings["selected_device"], action="rewind", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="rewind",
+        prep="control",
+    )
     cst.rewind(timedesc)
 
 
@@ -497,7 +801,12 @@ def rewind(settings, timedesc):
 )
 @click.pass_obj
 def ffwd(settings, timedesc):
-    cst = setup_cast(settings["selected_device"], action="ffwd", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="ffwd",
+        prep="control",
+    )
     cst.ffwd(timedesc)
 
 
@@ -505,14 +814,24 @@ def ffwd(settings, timedesc):
 @click.argument("timedesc", type=CATT_TIME, metavar="TIME")
 @click.pass_obj
 def seek(settings, timedesc):
-    cst = setup_cast(settings["selected_device"], action="seek", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="seek",
+        prep="control",
+    )
     cst.seek(timedesc)
 
 
 @cli.command(short_help="Skip to end of content.")
 @click.pass_obj
 def skip(settings):
-    cst = setup_cast(settings["selected_device"], action="skip", prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        action="skip",
+        prep="control",
+    )
     cst.skip()
 
 
@@ -520,7 +839,9 @@ def skip(settings):
 @click.argument("level", type=click.IntRange(0, 100), metavar="LVL")
 @click.pass_obj
 def volume(settings, level):
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     cst.volume(level / 100.0)
 
 
@@ -530,7 +851,9 @@ def volume(settings, level):
 )
 @click.pass_obj
 def volumeup(settings, delta):
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     cst.volumeup(delta / 100.0)
 
 
@@ -540,7 +863,9 @@ def volumeup(settings, delta):
 )
 @click.pass_obj
 def volumedown(settings, delta):
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     cst.volumedown(delta / 100.0)
 
 
@@ -548,14 +873,20 @@ def volumedown(settings, delta):
 @click.argument("muted", type=click.BOOL, required=False, default=True, metavar="MUTED")
 @click.pass_obj
 def volumemute(settings, muted):
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     cst.volumemute(muted)
 
 
 @cli.command(short_help="Show some information about the currently-playing video.")
 @click.pass_obj
 def status(settings):
-    cst = setup_cast(settings["selected_device"], prep="info")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        prep="info",
+    )
     echo_status(cst.cast_info)
 
 
@@ -564,7 +895,11 @@ def status(settings):
 @click.pass_obj
 def info(settings, json_output):
     try:
-        cst = setup_cast(settings["selected_device"], prep="info")
+        cst = setup_cast(
+            settings["selected_device"],
+            discovery_timeout=settings["discovery_timeout"],
+            prep="info",
+        )
     except CastError:
         if json_output:
             info = {}
@@ -584,23 +919,26 @@ def info(settings, json_output):
     short_help="Scan the local network and show all Chromecasts and their IPs."
 )
 @click.option("-j", "--json-output", is_flag=True, help="Output scan result as json.")
-def scan(json_output):
+@click.pass_obj
+def scan(settings, json_output):
     if not json_output:
         click.echo("Scanning Chromecasts...")
-    devices = get_cast_infos()
+    casts = get_casts_with_latency(discovery_timeout=settings["discovery_timeout"])
+    devices = [cast.cast_info for cast, _ in casts]
 
     if json_output:
         echo_json(
             {
-                d.friendly_name: {
-                    "host": d.host,
-                    "port": d.port,
-                    "uuid": d.uuid,
-                    "model_name": d.model_name,
-                    "friendly_name": d.friendly_name,
-                    "manufacturer": d.manufacturer,
+                cast.cast_info.friendly_name: {
+                    "host": cast.cast_info.host,
+                    "port": cast.cast_info.port,
+                    "uuid": cast.cast_info.uuid,
+                    "model_name": cast.cast_info.model_name,
+                    "friendly_name": cast.cast_info.friendly_name,
+                    "manufacturer": cast.cast_info.manufacturer,
+                    "connect_latency": round(latency, 3),
                 }
-                for d in devices
+                for cast, latency in casts
             }
         )
     else:
@@ -618,7 +956,11 @@ def scan(json_output):
 )
 @click.pass_obj
 def save(settings, path):
-    cst = setup_cast(settings["selected_device"], prep="control")
+    cst = setup_cast(
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        prep="control",
+    )
     if not cst.save_capability or cst.is_streaming_local_file:
         raise CliError("Saving state of this kind of content is not supported")
     elif cst.save_capability == "partial":
@@ -645,7 +987,9 @@ def save(settings, path):
 def restore(settings, path):
     if not path and not STATE_PATH.is_file():
         raise CliError("Save file in config dir has not been created")
-    cst = setup_cast(settings["selected_device"])
+    cst = setup_cast(
+        settings["selected_device"], discovery_timeout=settings["discovery_timeout"]
+    )
     state = CastState(path or STATE_PATH, StateMode.READ)
     try:
         data = state.get_data(cst.cc_name if not path else None)
@@ -657,11 +1001,32 @@ def restore(settings, path):
     echo_status(data["data"])
     click.echo("Restoring...")
     cst = setup_cast(
-        settings["selected_device"], prep="app", controller=data["controller"]
+        settings["selected_device"],
+        discovery_timeout=settings["discovery_timeout"],
+        prep="app",
+        controller=data["controller"],
     )
     cst.restore(data["data"])
 
 
+@cli.command(
+    short_help="Keep devices connected in the background, to speed up other commands."
+)
+def daemon():
+    """
+    Keep discovering devices and stay connected to them, so that commands
+    which control playback (like pause, volume and status) can be run
+    without connecting to the device first. While the daemon is running,
+    catt hands these commands over to it automatically.
+    """
+
+    click.echo("Running the catt daemon, press Ctrl+C to stop...")
+    try:
+        CattDaemon(cli, get_config_as_dict).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
 @cli.command("write_config", short_help='DEPRECATED: Please use "set_default".')
 def write_config():
     raise CliError('DEPRECATED: Please use "set_default"')
@@ -731,7 +1096,10 @@ def get_device_from_settings(settings):
     if is_ip:
         found = cast_ip_exists(device_desc)
     else:
-        found = device_desc in [d.friendly_name for d in get_cast_infos()]
+        found = device_desc in [
+            d.friendly_name
+            for d in get_cast_infos(discovery_timeout=settings["discovery_timeout"])
+        ]
     if not found:
         msg = "No device found at {}" if is_ip else 'Specified device "{}" not found'
         raise CliError(msg.format(device_desc))
@@ -772,6 +1140,9 @@ def get_config_as_dict():
 
 def main():
     try:
+        exit_code = run_in_daemon(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
         return cli(obj=get_config_as_dict())
     except CattUserError as err:
         sys.exit("Error: {}.".format(str(err)))
@@ -1,9 +1,18 @@
+import itertools
 import json
+import queue
 import threading
+import time
 from enum import Enum
 from pathlib import Path
 from typing import Any
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
 from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlparse
+from urllib.parse import urlsplit
 
 import pychromecast
 from pychromecast.config import APP_BACKDROP as BACKDROP_APP_ID
@@ -16,20 +25,49 @@ from pychromecast.controllers.dashcast import (
 from pychromecast.controllers.media import (
     MediaStatusListener as PyChromecastMediaStatusListener,
 )
+from pychromecast.controllers.media import TYPE_LOAD
+from pychromecast.controllers.media import TYPE_QUEUE_INSERT
 from pychromecast.controllers.youtube import YouTubeController
+from pychromecast.error import RequestFailed
+from pychromecast.error import RequestTimeout
+from pychromecast.response_handler import WaitResponse
 
+from .cache import FileCache
+from .discovery import DISCOVERY_TIMEOUT
 from .discovery import get_cast
 from .error import AppSelectionError
 from .error import CastError
 from .error import ControllerError
 from .error import ListenerError
 from .error import StateFileError
-from .stream_info import StreamInfo
+from .util import CattStore
 from .util import echo_warning
+from .util import run_in_thread
 
 GOOGLE_MEDIA_NAMESPACE = "urn:x-cast:com.google.cast.media"
 VALID_STATE_EVENTS = ["UNKNOWN", "IDLE", "BUFFERING", "PLAYING", "PAUSED"]
 CLOUD_APP_ID = "38579375"
+# Media from these hosts is played with the YouTube app (on devices that support it).
+YOUTUBE_HOSTS = ["youtube.com", "youtu.be", "youtube-nocookie.com"]
+TYPE_QUEUE_LOAD = "QUEUE_LOAD"
+# Number of items that are queued on the device after the one that is playing.
+QUEUE_LOOKAHEAD = 2
+# Seconds before the end of a queue item, that the device starts loading the next one.
+QUEUE_PRELOAD_TIME = 20
+QUEUE_REQUEST_TIMEOUT = 10
+# Seconds that a device is given to load media (and answer the request to do so).
+LOAD_REQUEST_TIMEOUT = 30
+# Seconds without a status change, after which the status of a playing queue is requested.
+QUEUE_STATUS_INTERVAL = 30
+# The style pychromecast gives subtitles, for subtitle tracks that catt adds itself.
+SUBTITLE_TRACK_STYLE = {
+    "backgroundColor": "#FFFFFF00",
+    "edgeType": "OUTLINE",
+    "edgeColor": "#000000FF",
+}
+# Seconds that media which was interrupted is given to start playing again,
+# when it was reloaded (as it is to change the timing of its subtitles).
+RELOAD_TIMEOUT = 10
 
 
 class App:
@@ -98,6 +136,78 @@ def get_controller(cast, app, action=None, prep=None) -> "CastController":
     return controller(cast, app, prep=prep)
 
 
+def looks_like_youtube(video_url: str) -> bool:
+    hostname = urlparse(video_url).hostname or ""
+    return any(
+        hostname == host or hostname.endswith("." + host) for host in YOUTUBE_HOSTS
+    )
+
+
+def make_subtitle_track(
+    track_id: int,
+    url: str,
+    name: str = "Subtitles",
+    language: Optional[str] = None,
+    content_type: str = "text/vtt",
+) -> dict:
+    track = {
+        "trackId": track_id,
+        "trackContentId": url,
+        "trackContentType": content_type,
+        "type": "TEXT",
+        "subtype": "SUBTITLES",
+        "name": name,
+    }
+    if language:
+        track["language"] = language
+    return track
+
+
+def make_queue_item(
+    url: str,
+    content_type: Optional[str] = None,
+    title: Optional[str] = None,
+    thumb: Optional[str] = None,
+    subtitles: Optional[str] = None,
+    stream_type: Optional[str] = None,
+    media_info: Optional[dict] = None,
+) -> dict:
+    """Build an item for a media queue, like pychromecast builds media for a LOAD message."""
+
+    media = {
+        "contentId": url,
+        "contentType": content_type or "video/mp4",
+        "streamType": stream_type or "BUFFERED",
+        "metadata": {"metadataType": 0},
+        **(media_info or {}),
+    }
+    if title:
+        media["metadata"]["title"] = title
+    if thumb:
+        media["metadata"]["images"] = [{"url": thumb}]
+
+    item = {
+        "media": media,
+        "autoplay": True,
+        "startTime": 0,
+        "preloadTime": QUEUE_PRELOAD_TIME,
+    }
+    if subtitles:
+        media["tracks"] = [make_subtitle_track(1, subtitles, language="en-US")]
+        item["activeTrackIds"] = [1]
+    return item
+
+
+def launch_app(cast: pychromecast.Chromecast, app: App) -> None:
+    """Start an app on the device, and wait until it is ready."""
+
+    listener = CastStatusListener(app.id, cast.app_id)
+    cast.register_status_listener(listener)
+    if not listener.app_ready.is_set():
+        cast.start_app(app.id)
+        listener.app_ready.wait()
+
+
 def setup_cast(
     device_desc,
     video_url=None,
@@ -106,20 +216,66 @@ def setup_cast(
     action=None,
     prep=None,
     stream_type=None,
+    discovery_timeout=DISCOVERY_TIMEOUT,
+    timings=None,
 ):
-    cast = get_cast(device_desc)
-    cast_type = cast.cast_type
-    app_id = cast.app_id
-    stream = (
-        StreamInfo(
+    """
+    Connect to a device, extract info about the requested media (if any),
+    and return a controller with the right app for it.
+
+    Discovery and extraction run concurrently, and when preparing an app on an idle device,
+    the app that the media most likely needs is launched while extraction is still running.
+
+    :param timings: Optional dict, that gets filled with the durations of the stages in seconds.
+    :type timings: dict
+    """
+
+    timings = {} if timings is None else timings
+    setup_start = time.monotonic()
+
+    def timed(stage, func, *args, **kwargs):
+        stage_start = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] = time.monotonic() - stage_start
+
+    stream_future = None
+    if video_url:
+        # Importing yt-dlp takes a while, so we only do it for commands that need it.
+        from .stream_info import EXTRACTION_CACHE_DIR
+        from .stream_info import StreamInfo
+
+        stream_future = run_in_thread(
+            timed,
+            "extraction",
+            StreamInfo,
             video_url,
-            cast_info=cast.cast_info,
             ytdl_options=ytdl_options,
             stream_type=stream_type,
+            cache=FileCache(EXTRACTION_CACHE_DIR),
         )
-        if video_url
-        else None
-    )
+
+    cast = timed("discovery", get_cast, device_desc, discovery_timeout)
+    cast_type = cast.cast_type
+    app_id = cast.app_id
+
+    launch_future = None
+    # A wrong guess would stop whatever is playing before extraction has even finished
+    # (or failed), so apps are only launched early on devices that are idle.
+    idle = not app_id or app_id == BACKDROP_APP_ID
+    if prep == "app" and video_url and idle:
+        if controller:
+            likely_app = get_app(controller, cast_type, strict=True)
+        elif looks_like_youtube(video_url):
+            likely_app = get_app("youtube", cast_type)
+        else:
+            likely_app = DEFAULT_APP
+        launch_future = run_in_thread(timed, "app_launch", launch_app, cast, likely_app)
+
+    stream = stream_future.result() if stream_future else None
+    if stream:
+        stream.set_cast_info(cast.cast_info)
 
     if controller:
         app = get_app(controller, cast_type, strict=True)
@@ -128,49 +284,21 @@ def setup_cast(
         app = get_app(stream.extractor, cast_type, show_warning=True)
 
     elif prep == "control":
-        if not app_id or app_id == BACKDROP_APP_ID:
+        if idle:
             raise CastError("Chromecast is inactive")
         app = get_app(app_id, cast_type)
 
     else:
         app = get_app("default")
 
+    if launch_future:
+        # If the guess was wrong, the right app is launched by the controller.
+        launch_future.result()
     cast_controller = get_controller(cast, app, action=action, prep=prep)
+    timings["setup"] = time.monotonic() - setup_start
     return (cast_controller, stream) if stream else cast_controller
 
 
-class CattStore:
-    def __init__(self, store_path):
-        self.store_path = store_path
-
-    def _create_store_dir(self):
-        try:
-            self.store_path.parent.mkdir()
-        except FileExistsError:
-            pass
-
-    def _read_store(self):
-        with self.store_path.open() as store:
-            return json.load(store)
-
-    def _write_store(self, data):
-        with self.store_path.open("w") as store:
-            json.dump(data, store)
-
-    def get_data(self, *args):
-        raise NotImplementedError
-
-    def set_data(self, *args) -> None:
-        raise NotImplementedError
-
-    def clear(self):
-        try:
-            self.store_path.unlink()
-            self.store_path.parent.rmdir()
-        except FileNotFoundError:
-            pass
-
-
 class StateMode(Enum):
     READ = 1
     CONF = 2
@@ -285,6 +413,35 @@ class SimpleListener(PyChromecastMediaStatusListener):
         self._status_received.wait()
 
 
+class QueueStatus(NamedTuple):
+    content_id: Optional[str]
+    player_state: Optional[str]
+    idle_reason: Optional[str]
+
+
+class QueueStatusListener(PyChromecastMediaStatusListener):
+    """Records every media status, so that no transition between queue items is missed."""
+
+    def __init__(self):
+        self._statuses: "queue.Queue[QueueStatus]" = queue.Queue()
+        self.load_failed_error_code: Optional[int] = None
+
+    def new_media_status(self, status):
+        self._statuses.put(
+            QueueStatus(status.content_id, status.player_state, status.idle_reason)
+        )
+
+    def load_media_failed(self, queue_item_id: int, error_code: int) -> None:
+        self.load_failed_error_code = error_code
+        self._statuses.put(QueueStatus(None, None, None))
+
+    def next_status(self, timeout=None) -> Optional[QueueStatus]:
+        try:
+            return self._statuses.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
 class CastController:
     def __init__(
         self, cast: pychromecast.Chromecast, app: App, prep: Optional[str] = None
@@ -294,6 +451,7 @@ class CastController:
         self.info_type = None
         self.save_capability = None
         self.playlist_capability = None
+        self.queue_capability = None
 
         self._cast_listener = CastStatusListener(app.id, self._cast.app_id)
         self._cast.register_status_listener(self._cast_listener)
@@ -525,6 +683,148 @@ class MediaControllerMixin:
     def disable_subtitle(self) -> None:
         self._cast.media_controller.disable_subtitle()
 
+    def retime_subtitles(
+        self, offset: Optional[float] = None, rate: Optional[float] = None
+    ) -> None:
+        """
+        Change the timing of the subtitle tracks that are served by catt, by loading
+        the media again (at its current position) with the tracks pointing at urls
+        that carry the new timing. The server that serves them picks it up from there.
+        The offset or rate that isn't given is kept as it is.
+        """
+
+        from .subs_info import SubtitleTiming
+
+        status = self._cast.media_controller.status
+        tracks, retimed = [], False
+        for track in status.subtitle_tracks:
+            url = urlsplit(track.get("trackContentId", ""))
+            params = dict(parse_qsl(url.query))
+            if track.get("type") == "TEXT" and "offset" in params:
+                timing = SubtitleTiming.from_params(params)
+                timing = SubtitleTiming(
+                    timing.offset if offset is None else offset,
+                    timing.rate if rate is None else rate,
+                )
+                retimed_url = url._replace(query=timing.query).geturl()
+                track = {**track, "trackContentId": retimed_url}
+                retimed = True
+            tracks.append(track)
+        if not retimed:
+            raise CastError("No subtitles served by catt are loaded")
+
+        media_info = {
+            "contentId": status.content_id,
+            "contentType": status.content_type,
+            "streamType": status.stream_type,
+            "metadata": status.media_metadata,
+            "tracks": tracks,
+        }
+        msg = {
+            "type": TYPE_LOAD,
+            "media": media_info,
+            "currentTime": status.adjusted_current_time,
+            "autoplay": status.player_state != "PAUSED",
+            "activeTrackIds": status.current_subtitle_tracks,
+        }
+        self._cast.media_controller.send_message(msg, inc_session_id=True)
+
+
+class MediaQueueMixin:
+    _cast: pychromecast.Chromecast = None
+
+    def play_queue(self, items: Iterator[dict], lookahead: int = QUEUE_LOOKAHEAD):
+        """
+        Play media back to back, as a queue on the device, and block until it has played out.
+
+        The device loads the next item before the current one ends, so there is no gap
+        between them. Items (as built by make_queue_item) are taken from the iterator
+        only when they are about to be queued, which is lookahead items ahead of the
+        item that is playing.
+
+        :param items: The items to play.
+        :type items: Iterator[dict]
+        :param lookahead: Number of items to keep queued after the one that is playing.
+        :type lookahead: int
+        """
+
+        listener = QueueStatusListener()
+        self._cast.media_controller.register_status_listener(listener)
+        # Content ids of the queued items. Statuses tell us which one is playing.
+        queued: List[str] = []
+        current = 0
+        exhausted = False
+
+        while True:
+            missing = current + lookahead + 1 - len(queued)
+            if missing > 0 and not exhausted:
+                new_items = list(itertools.islice(items, missing))
+                exhausted = len(new_items) < missing
+                if new_items and current >= len(queued):
+                    self._send_queue_message(
+                        {
+                            "type": TYPE_QUEUE_LOAD,
+                            "items": new_items,
+                            "startIndex": 0,
+                            "repeatMode": "REPEAT_OFF",
+                        },
+                        "queue load",
+                    )
+                elif new_items:
+                    status = self._cast.media_controller.status
+                    self._send_queue_message(
+                        {
+                            "type": TYPE_QUEUE_INSERT,
+                            "mediaSessionId": status.media_session_id,
+                            "items": new_items,
+                        },
+                        "queue insert",
+                    )
+                queued.extend(item["media"]["contentId"] for item in new_items)
+            if current >= len(queued):
+                return
+
+            queue_status = listener.next_status(timeout=QUEUE_STATUS_INTERVAL)
+            if queue_status is None:
+                # Statuses are only sent on changes, so we ask for one now and then,
+                # which also tells us if the connection has gone away.
+                try:
+                    self._cast.media_controller.update_status()
+                except pychromecast.error.PyChromecastError:
+                    raise CastError("Lost connection to the Chromecast")
+                continue
+            if listener.load_failed_error_code is not None:
+                raise CastError(
+                    "Chromecast failed to load media "
+                    f"(error code {listener.load_failed_error_code})"
+                )
+            if queue_status.content_id not in queued[current:]:
+                if queue_status.player_state == "UNKNOWN":
+                    # The app has gone away.
+                    return
+                # A status of media from before the queue was loaded.
+                continue
+            current = queued.index(queue_status.content_id, current)
+            if queue_status.player_state != "IDLE":
+                continue
+            elif queue_status.idle_reason in ["CANCELLED", "INTERRUPTED", "ERROR"]:
+                # Playback was stopped, or something else was cast.
+                return
+            elif queue_status.idle_reason == "FINISHED" and current == len(queued) - 1:
+                # The last queued item has finished. If there are more items,
+                # we couldn't keep up and the queue needs to be loaded again.
+                current = len(queued)
+
+    def _send_queue_message(self, msg: dict, request: str) -> None:
+        response = WaitResponse(QUEUE_REQUEST_TIMEOUT, request)
+        try:
+            self._cast.media_controller.send_message(
+                msg, inc_session_id=True, callback_function=response.callback
+            )
+            response.wait_response()
+        except (RequestTimeout, RequestFailed):
+            raise CastError("Chromecast did not accept the media queue")
+
 
 class PlaybackBaseMixin:
     _cast = None  # type: pychromecast.Chromecast
@@ -558,14 +858,36 @@ class PlaybackBaseMixin:
         except pychromecast.error.UnsupportedNamespace:
             raise CastError("Chromecast app operation was interrupted")
 
+    def wait_for_playback_end(self) -> None:
+        """
+        Block until the current media has stopped playing. Media that is interrupted
+        by a reload of itself (see retime_subtitles) is still considered to be playing.
+        """
+
+        content_id = self._cast.media_controller.status.content_id
+        while True:
+            self.wait_for(["UNKNOWN", "IDLE"])
+            status = self._cast.media_controller.status
+            if status.idle_reason != "INTERRUPTED":
+                return
+            reloaded = self.wait_for(
+                ["BUFFERING", "PLAYING", "PAUSED"], timeout=RELOAD_TIMEOUT
+            )
+            status = self._cast.media_controller.status
+            if not reloaded or status.content_id != content_id:
+                return
+
     def restore(self, data):
         raise NotImplementedError
 
 
-class DefaultCastController(CastController, MediaControllerMixin, PlaybackBaseMixin):
+class DefaultCastController(
+    CastController, MediaControllerMixin, MediaQueueMixin, PlaybackBaseMixin
+):
     def __init__(self, cast, app, prep=None):
         super(DefaultCastController, self).__init__(cast, app, prep=prep)
         self.info_type = "url"
+        self.queue_capability = "complete"
         self.save_capability = (
             "complete"
             if (self._is_seekable and self._cast.app_id == DEFAULT_APP.id)
@@ -573,7 +895,20 @@ class DefaultCastController(CastController, MediaControllerMixin, PlaybackBaseMi
         )
 
     def play_media_url(self, video_url, **kwargs):
+        """
+        :param subtitles: Url of a single subtitles file, which is shown.
+        :param subtitle_tracks: Subtitle tracks (see make_subtitle_track) to add to
+                                those in media_info, of which the first is shown.
+        """
+
         content_type = kwargs.get("content_type") or "video/mp4"
+        media_info = kwargs.get("media_info")
+        subtitle_tracks = kwargs.get("subtitle_tracks")
+        if subtitle_tracks:
+            media_info = dict(media_info or {})
+            media_info["tracks"] = media_info.get("tracks", []) + subtitle_tracks
+            media_info.setdefault("textTrackStyle", SUBTITLE_TRACK_STYLE)
+        loaded = WaitResponse(LOAD_REQUEST_TIMEOUT, "load media")
         self._controller.play_media(
             video_url,
             content_type,
@@ -582,9 +917,18 @@ class DefaultCastController(CastController, MediaControllerMixin, PlaybackBaseMi
             thumb=kwargs.get("thumb"),
             subtitles=kwargs.get("subtitles"),
             stream_type=kwargs.get("stream_type"),
-            media_info=kwargs.get("media_info"),
+            media_info=media_info,
+            callback_function=loaded.callback,
         )
         self._controller.block_until_active()
+        if subtitle_tracks:
+            # pychromecast only activates a track that is passed as "subtitles",
+            # so the first track is activated once the media (session) is loaded.
+            try:
+                loaded.wait_response()
+                self._controller.enable_subtitle(subtitle_tracks[0]["trackId"])
+            except pychromecast.error.PyChromecastError:
+                raise CastError("Chromecast failed to load media with subtitles")
 
     def restore(self, data):
         self.play_media_url(
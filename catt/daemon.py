@@ -0,0 +1,220 @@
+"""
+A long-running process that keeps discovery running and devices connected,
+and runs catt commands on behalf of the cli, which connects to it over a Unix socket.
+
+The cli sends the arguments of a command as a line of JSON, and gets back its
+exit code and output. Only commands that control what is already playing are
+run by the daemon, everything else still runs in the cli process.
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import click
+
+from . import discovery
+from .error import CattUserError
+from .error import CliError
+
+DAEMON_SOCKET_PATH = Path(
+    os.environ.get("XDG_RUNTIME_DIR") or click.get_app_dir("catt"), "catt.sock"
+)
+# Commands that don't depend on the working directory or stdin, and don't keep running.
+DAEMON_COMMANDS = [
+    "clear",
+    "ffwd",
+    "info",
+    "pause",
+    "play",
+    "play_toggle",
+    "rewind",
+    "seek",
+    "skip",
+    "status",
+    "stop",
+    "subs",
+    "volume",
+    "volumedown",
+    "volumemute",
+    "volumeup",
+]
+# Global options that take a value, which we need to skip to find the command.
+VALUE_OPTIONS = ["-d", "--device", "--discovery-timeout"]
+CLIENT_TIMEOUT = 120
+
+
+def get_command_name(args: List[str]) -> Optional[str]:
+    """Return the name of the command in a list of cli arguments."""
+
+    arg_iter = iter(args)
+    for arg in arg_iter:
+        if arg in VALUE_OPTIONS:
+            next(arg_iter, None)
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+def run_in_daemon(
+    args: List[str], socket_path: Path = DAEMON_SOCKET_PATH
+) -> Optional[int]:
+    """
+    Run a command in the daemon, if it is running and supports the command.
+
+    :param args: cli arguments.
+    :type args: List[str]
+    :returns: Exit code of the command, or None if it should be run locally.
+    :rtype: int
+    """
+
+    if get_command_name(args) not in DAEMON_COMMANDS or not hasattr(socket, "AF_UNIX"):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        # Either there is no daemon, or it has gone away and left its socket behind.
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as stream:
+        try:
+            stream.write(json.dumps({"args": args}).encode() + b"\n")
+            stream.flush()
+            response = json.loads(stream.readline())
+        except socket.timeout:
+            raise CliError("The catt daemon did not respond in time")
+        except (OSError, ValueError):
+            raise CliError("Lost connection to the catt daemon")
+
+    if not response.get("handled"):
+        return None
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["exit_code"]
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            args = [str(arg) for arg in request["args"]]
+        except (ValueError, KeyError, TypeError):
+            return
+        response = self.server.catt_daemon.run_command(args)  # type: ignore
+        try:
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+        except OSError:
+            pass
+
+
+class CattDaemon:
+    """
+    Runs catt commands, with the devices they need kept connected between commands.
+
+    :param cli: The click command group to run commands with.
+    :param get_config: Function that returns the config, as passed to the cli.
+    :param socket_path: Path of the Unix socket to listen on.
+    """
+
+    def __init__(
+        self,
+        cli: click.Group,
+        get_config: Callable[[], dict],
+        socket_path: Path = DAEMON_SOCKET_PATH,
+    ) -> None:
+        self.cli = cli
+        self.get_config = get_config
+        self.socket_path = socket_path
+        self.cast_pool = discovery.CastPool()
+        # Output is captured by redirecting the (global) stdout and stderr,
+        # so commands are run one at a time.
+        self._command_lock = threading.Lock()
+
+    def run_command(self, args: List[str]) -> dict:
+        if get_command_name(args) not in DAEMON_COMMANDS:
+            return {"handled": False}
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        exit_code = 0
+        with self._command_lock, redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                self.cli.main(args, prog_name="catt", obj=self.get_config())
+            except SystemExit as exc:
+                if isinstance(exc.code, str):
+                    sys.stderr.write(exc.code + "\n")
+                    exit_code = 1
+                else:
+                    exit_code = exc.code or 0
+            except CattUserError as err:
+                sys.stderr.write("Error: {}.\n".format(str(err)))
+                exit_code = 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                self.cast_pool.reset_listeners()
+
+        return {
+            "handled": True,
+            "exit_code": exit_code,
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+        }
+
+    def _remove_stale_socket(self) -> None:
+        if not self.socket_path.exists():
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError:
+            self.socket_path.unlink()
+        else:
+            raise CliError(
+                "A catt daemon is already running (at {})".format(self.socket_path)
+            )
+        finally:
+            sock.close()
+
+    def serve_forever(self) -> None:
+        if not hasattr(socket, "AF_UNIX"):
+            raise CliError("The catt daemon is not supported on this platform")
+
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._remove_stale_socket()
+        # Only the current user gets to run commands through the socket.
+        old_umask = os.umask(0o077)
+        try:
+            server = socketserver.UnixStreamServer(
+                str(self.socket_path), DaemonRequestHandler
+            )
+        finally:
+            os.umask(old_umask)
+        server.catt_daemon = self  # type: ignore
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        discovery.cast_pool = self.cast_pool
+        self.cast_pool.start()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.socket_path.unlink()
+            discovery.cast_pool = None
+            self.cast_pool.stop()
@@ -1,71 +1,329 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 from typing import Union
+from uuid import UUID
 
+import click
 import pychromecast
+import zeroconf
+from pychromecast.controllers import BaseController
+from pychromecast.error import PyChromecastError
+from pychromecast.models import HostServiceInfo
 
 from .error import CastError
+from .util import CattStore
 from .util import is_ipaddress
 
 DEFAULT_PORT = 8009
+DEVICE_CACHE_PATH = Path(click.get_app_dir("catt"), "devices.json")
+DEVICE_CACHE_TTL = 24 * 60 * 60
+# Cached devices are connected to directly, and we don't want to wait long
+# before falling back to discovery if one has gone away.
+CACHED_CONNECT_TIMEOUT = 2
+DISCOVERY_TIMEOUT = pychromecast.discovery.DISCOVER_TIMEOUT
+# Discovered devices that haven't answered within this time are left out.
+CONNECT_TIMEOUT = 10
 
 
-def get_casts(names: Optional[List[str]] = None) -> List[pychromecast.Chromecast]:
+class DeviceCache(CattStore):
     """
-    Discover all available devices, optionally filtering them with list of specific device names
-    (which will speedup discovery, as pychromecast does this in a non-blocking manner).
+    Persistent cache of the devices found by discovery, so that subsequent
+    lookups can connect to a device directly, instead of browsing with mDNS.
+    """
+
+    def __init__(
+        self, cache_path: Path = DEVICE_CACHE_PATH, ttl: int = DEVICE_CACHE_TTL
+    ) -> None:
+        super(DeviceCache, self).__init__(cache_path)
+        self.ttl = ttl
+
+    def _read_store(self):
+        try:
+            return super(DeviceCache, self)._read_store()
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def get_data(self, cast_desc: str) -> Optional[dict]:  # type: ignore
+        """Return the cached device with the supplied name or uuid, if it is still fresh."""
+
+        now = time.time()
+        for uuid, device in self._read_store().items():
+            if cast_desc in [uuid, device["friendly_name"]]:
+                return device if now - device["cached_at"] < self.ttl else None
+        return None
+
+    def set_data(self, cast_infos: List[pychromecast.CastInfo]) -> None:  # type: ignore
+        data = self._read_store()
+        now = time.time()
+        for cast_info in cast_infos:
+            data[str(cast_info.uuid)] = {
+                "friendly_name": cast_info.friendly_name,
+                "uuid": str(cast_info.uuid),
+                "host": cast_info.host,
+                "port": cast_info.port,
+                "model_name": cast_info.model_name,
+                "manufacturer": cast_info.manufacturer,
+                "cast_type": cast_info.cast_type,
+                "cached_at": now,
+            }
+        self._create_store_dir()
+        self._write_store(data)
+
+    def remove(self, uuid: str) -> None:
+        data = self._read_store()
+        if data.pop(uuid, None):
+            self._write_store(data)
+
+
+def connect_cast(
+    cast: pychromecast.Chromecast, timeout: float = CONNECT_TIMEOUT
+) -> Optional[float]:
+    """
+    Connect to a device, and wait for it to become ready.
+
+    :param cast: Chromecast object.
+    :type cast: pychromecast.Chromecast
+    :param timeout: Seconds to wait for the device.
+    :type timeout: float
+    :returns: Connect latency in seconds, or None if the device didn't answer in time.
+    :rtype: float
+    """
+
+    start = time.monotonic()
+    try:
+        cast.wait(timeout=timeout)
+    except PyChromecastError:
+        cast.disconnect(timeout=0)
+        return None
+    return time.monotonic() - start
+
+
+def get_casts_with_latency(
+    names: Optional[List[str]] = None,
+    timeout: float = CONNECT_TIMEOUT,
+    discovery_timeout: float = DISCOVERY_TIMEOUT,
+) -> List[Tuple[pychromecast.Chromecast, float]]:
+    """
+    Discover all available devices, and connect to them concurrently.
+    Devices that don't answer within the timeout are left out.
 
     :param names: Optional list of device names.
     :type names: List[str]
-    :returns: List of Chromecast objects.
-    :rtype: List[pychromecast.Chromecast]
+    :param timeout: Seconds to wait for each device.
+    :type timeout: float
+    :param discovery_timeout: Seconds to browse for devices.
+    :type discovery_timeout: float
+    :returns: List of (Chromecast object, connect latency in seconds) tuples.
+    :rtype: List[Tuple[pychromecast.Chromecast, float]]
     """
 
     if names:
         cast_infos, browser = pychromecast.discovery.discover_listed_chromecasts(
-            friendly_names=names
+            friendly_names=names, discovery_timeout=discovery_timeout
         )
     else:
-        cast_infos, browser = pychromecast.discovery.discover_chromecasts()
+        cast_infos, browser = pychromecast.discovery.discover_chromecasts(
+            timeout=discovery_timeout
+        )
 
     casts = [
         pychromecast.get_chromecast_from_cast_info(c, browser.zc) for c in cast_infos
     ]
-
-    for cast in casts:
-        cast.wait()
+    if casts:
+        with ThreadPoolExecutor(max_workers=len(casts)) as executor:
+            latencies = list(
+                executor.map(lambda cast: connect_cast(cast, timeout), casts)
+            )
+    else:
+        latencies = []
 
     browser.stop_discovery()
-    casts.sort(key=lambda c: c.cast_info.friendly_name)
-    return casts
+    connected = [
+        (cast, latency)
+        for cast, latency in zip(casts, latencies)
+        if latency is not None
+    ]
+    connected.sort(key=lambda c: c[0].cast_info.friendly_name)
+    try:
+        DeviceCache().set_data([c.cast_info for c, _ in connected])
+    except OSError:
+        # The cache is only an optimization.
+        pass
+    return connected
+
+
+def get_casts(
+    names: Optional[List[str]] = None, discovery_timeout: float = DISCOVERY_TIMEOUT
+) -> List[pychromecast.Chromecast]:
+    """
+    Discover all available devices, optionally filtering them with list of specific device names
+    (which will speedup discovery, as pychromecast does this in a non-blocking manner).
+
+    :param names: Optional list of device names.
+    :type names: List[str]
+    :param discovery_timeout: Seconds to browse for devices.
+    :type discovery_timeout: float
+    :returns: List of Chromecast objects.
+    :rtype: List[pychromecast.Chromecast]
+    """
+
+    return [
+        cast
+        for cast, _ in get_casts_with_latency(
+            names, discovery_timeout=discovery_timeout
+        )
+    ]
 
 
-def get_cast_infos() -> List[pychromecast.CastInfo]:
+def get_cast_infos(
+    discovery_timeout: float = DISCOVERY_TIMEOUT,
+) -> List[pychromecast.CastInfo]:
     """
     Discover all available devices, and collect info from them.
 
+    :param discovery_timeout: Seconds to browse for devices.
+    :type discovery_timeout: float
     :returns: List of CastInfo namedtuples.
     :rtype: List[pychromecast.CastInfo]
     """
 
-    return [c.cast_info for c in get_casts()]
+    return [c.cast_info for c in get_casts(discovery_timeout=discovery_timeout)]
+
+
+def discover_cast_info(
+    cast_desc: Optional[str], discovery_timeout: float = DISCOVERY_TIMEOUT
+) -> Tuple[Optional[pychromecast.CastInfo], pychromecast.discovery.CastBrowser]:
+    """
+    Browse for a specific device, and stop waiting as soon as it has been found.
+    When no device is specified, the first device to respond is picked.
+
+    :param cast_desc: Name or uuid of device, or None for any device.
+    :type cast_desc: str
+    :param discovery_timeout: Seconds to wait for the device.
+    :type discovery_timeout: float
+    :returns: Tuple of the CastInfo of the device (or None if it wasn't found in time),
+              and the browser, which should be stopped when no longer needed.
+    :rtype: Tuple[pychromecast.CastInfo, pychromecast.discovery.CastBrowser]
+    """
+
+    found: List[pychromecast.CastInfo] = []
+    discover_complete = threading.Event()
+
+    def add_callback(uuid: UUID, service: str) -> None:
+        cast_info = browser.devices[uuid]
+        if cast_desc in (None, cast_info.friendly_name, str(uuid)):
+            if not discover_complete.is_set():
+                found.append(cast_info)
+                discover_complete.set()
+
+    browser = pychromecast.discovery.CastBrowser(
+        pychromecast.discovery.SimpleCastListener(add_callback), zeroconf.Zeroconf()
+    )
+    browser.start_discovery()
+    discover_complete.wait(discovery_timeout)
+    return (found[0] if found else None), browser
+
+
+def get_cached_cast(cast_desc: str) -> Optional[pychromecast.Chromecast]:
+    """
+    Connect directly to a device from the device cache, skipping mDNS discovery.
+
+    :param cast_desc: Name or uuid of device.
+    :type cast_desc: str
+    :returns: Chromecast object, or None if the device is not cached, or is not
+              where it used to be.
+    :rtype: pychromecast.Chromecast
+    """
+
+    cache = DeviceCache()
+    try:
+        device = cache.get_data(cast_desc)
+    except OSError:
+        return None
+    if not device:
+        return None
+
+    host, port = device["host"], device["port"]
+    cast_info = pychromecast.CastInfo(
+        {HostServiceInfo(host, port)},
+        UUID(device["uuid"]),
+        device["model_name"],
+        device["friendly_name"],
+        host,
+        port,
+        device["cast_type"],
+        device["manufacturer"],
+    )
+    if device["cast_type"] != "group":
+        # Make sure that the device at the cached address is still the same one.
+        # (This doesn't work for groups, as the device info is that of the leader.)
+        device_info = pychromecast.discovery.get_device_info(
+            host, timeout=CACHED_CONNECT_TIMEOUT
+        )
+        if not device_info or device_info.uuid != cast_info.uuid:
+            try:
+                cache.remove(device["uuid"])
+            except OSError:
+                pass
+            return None
+
+    try:
+        cast = pychromecast.get_chromecast_from_cast_info(
+            cast_info, None, tries=1, timeout=CACHED_CONNECT_TIMEOUT
+        )
+    except PyChromecastError:
+        return None
+    try:
+        cast.wait(timeout=CACHED_CONNECT_TIMEOUT)
+    except PyChromecastError:
+        cast.disconnect(timeout=0)
+        return None
+    return cast
 
 
 def get_cast_with_name(
-    cast_name: Union[str, None],
+    cast_name: Union[str, None], discovery_timeout: float = DISCOVERY_TIMEOUT
 ) -> Optional[pychromecast.Chromecast]:
     """
     Get specific device if supplied name is not None,
-    otherwise the device with the name that has the lowest alphabetical value.
+    otherwise the first device to respond to discovery.
+    Named devices are looked up in the device cache first.
 
-    :param device_name: Name of device.
+    :param device_name: Name or uuid of device.
     :type device_name: str
+    :param discovery_timeout: Seconds to wait for the device to be discovered.
+    :type discovery_timeout: float
     :returns: Chromecast object.
     :rtype: pychromecast.Chromecast
     """
 
-    casts = get_casts([cast_name]) if cast_name else get_casts()
-    return casts[0] if casts else None
+    if cast_name:
+        cast = get_cached_cast(cast_name)
+        if cast:
+            return cast
+
+    cast_info, browser = discover_cast_info(cast_name, discovery_timeout)
+    cast = None
+    if cast_info:
+        cast = pychromecast.get_chromecast_from_cast_info(cast_info, browser.zc)
+        if connect_cast(cast) is None:
+            cast = None
+    browser.stop_discovery()
+
+    if cast:
+        try:
+            DeviceCache().set_data([cast.cast_info])
+        except OSError:
+            pass
+    return cast
 
 
 def get_cast_with_ip(
@@ -110,12 +368,140 @@ def cast_ip_exists(cast_ip: str) -> bool:
     return bool(get_cast_with_ip(cast_ip))
 
 
-def get_cast(cast_desc: Optional[str] = None) -> pychromecast.Chromecast:
+class CastPool:
+    """
+    Keeps discovery running, and devices connected between lookups,
+    for long-running processes like the daemon.
+    """
+
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT) -> None:
+        self.connect_timeout = connect_timeout
+        self._casts: Dict[UUID, pychromecast.Chromecast] = {}
+        self._listener_counts: Dict[UUID, Tuple[int, int]] = {}
+        self._handlers: Dict[UUID, Set[BaseController]] = {}
+        self._lock = threading.Lock()
+        self._devices_changed = threading.Condition()
+        self.browser: Optional[pychromecast.discovery.CastBrowser] = None
+
+    def _notify(self, uuid: UUID, service: str) -> None:
+        with self._devices_changed:
+            self._devices_changed.notify_all()
+
+    def start(self) -> None:
+        self.browser = pychromecast.discovery.CastBrowser(
+            pychromecast.discovery.SimpleCastListener(
+                add_callback=self._notify, update_callback=self._notify
+            ),
+            zeroconf.Zeroconf(),
+        )
+        self.browser.start_discovery()
+
+    def stop(self) -> None:
+        with self._lock:
+            for cast in self._casts.values():
+                cast.disconnect(timeout=0)
+            self._casts.clear()
+        if self.browser:
+            self.browser.stop_discovery()
+            self.browser = None
+
+    def _find_cast_info(
+        self, cast_desc: Optional[str]
+    ) -> Optional[pychromecast.CastInfo]:
+        if not self.browser:
+            return None
+        for cast_info in list(self.browser.devices.values()):
+            if cast_desc in (
+                None,
+                cast_info.friendly_name,
+                str(cast_info.uuid),
+                cast_info.host,
+            ):
+                return cast_info
+        return None
+
+    def get_cast(
+        self, cast_desc: Optional[str], discovery_timeout: float = DISCOVERY_TIMEOUT
+    ) -> Optional[pychromecast.Chromecast]:
+        """
+        Get a connected device, reusing the connection from a previous lookup if possible.
+
+        :param cast_desc: Name, uuid or ip-address of device, or None for any device.
+        :type cast_desc: str
+        :param discovery_timeout: Seconds to wait for the device, if it hasn't been discovered yet.
+        :type discovery_timeout: float
+        :returns: Chromecast object, or None if the device wasn't found.
+        :rtype: pychromecast.Chromecast
+        """
+
+        with self._devices_changed:
+            cast_info = self._devices_changed.wait_for(
+                lambda: self._find_cast_info(cast_desc), timeout=discovery_timeout
+            )
+        if not cast_info:
+            return None
+
+        with self._lock:
+            cast = self._casts.get(cast_info.uuid)
+            if cast and not cast.socket_client.is_connected:
+                cast.disconnect(timeout=0)
+                cast = None
+            if not cast:
+                cast = pychromecast.get_chromecast_from_cast_info(
+                    cast_info, self.browser.zc if self.browser else None
+                )
+                if connect_cast(cast, self.connect_timeout) is None:
+                    return None
+                self._casts[cast_info.uuid] = cast
+                self._listener_counts[cast_info.uuid] = (
+                    len(cast.socket_client.receiver_controller._status_listeners),
+                    len(cast.media_controller._status_listeners),
+                )
+                self._handlers[cast_info.uuid] = self._registered_handlers(cast)
+        return cast
+
+    @staticmethod
+    def _registered_handlers(cast: pychromecast.Chromecast) -> Set[BaseController]:
+        return {
+            handler
+            for handlers in cast.socket_client._handlers.values()
+            for handler in handlers
+        }
+
+    def reset_listeners(self) -> None:
+        """
+        Drop the status listeners and namespace handlers (like the YouTube controller)
+        that have been registered since the devices were connected.
+        """
+
+        # pychromecast has no way to unregister status listeners,
+        # and every controller registers its own.
+        with self._lock:
+            for uuid, cast in self._casts.items():
+                receiver_count, media_count = self._listener_counts[uuid]
+                del cast.socket_client.receiver_controller._status_listeners[
+                    receiver_count:
+                ]
+                del cast.media_controller._status_listeners[media_count:]
+                added = self._registered_handlers(cast) - self._handlers[uuid]
+                for handler in added:
+                    cast.socket_client.unregister_handler(handler)
+
+
+# Set by long-running processes (like the daemon), that keep devices connected between lookups.
+cast_pool: Optional[CastPool] = None
+
+
+def get_cast(
+    cast_desc: Optional[str] = None, discovery_timeout: float = DISCOVERY_TIMEOUT
+) -> pychromecast.Chromecast:
     """
     Attempt to connect with requested device (or any device if none has been specified).
 
     :param device_desc: Can be an ip-address or a name.
     :type device_desc: str
+    :param discovery_timeout: Seconds to wait for the device to be discovered.
+    :type discovery_timeout: float
     :returns: Chromecast object for use in a CastController.
     :rtype: pychromecast.Chromecast
     """
@@ -123,12 +509,17 @@ def get_cast(cast_desc: Optional[str] = None) -> pychromecast.Chromecast:
     cast = None
 
     if cast_desc and is_ipaddress(cast_desc):
-        cast = get_cast_with_ip(cast_desc)
+        if cast_pool:
+            cast = cast_pool.get_cast(cast_desc, discovery_timeout=0)
+        cast = cast or get_cast_with_ip(cast_desc)
         if not cast:
             msg = "No device found at {}".format(cast_desc)
             raise CastError(msg)
     else:
-        cast = get_cast_with_name(cast_desc)
+        if cast_pool:
+            cast = cast_pool.get_cast(cast_desc, discovery_timeout)
+        else:
+            cast = get_cast_with_name(cast_desc, discovery_timeout)
         if not cast:
             msg = (
                 'Specified device "{}" not found'.format(cast_desc)
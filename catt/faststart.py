@@ -0,0 +1,212 @@
+"""
+Virtual "faststart" for mp4 files that have their moov box after the media data.
+
+A Chromecast needs the moov box (the index of the file) before it can start
+playback, so when it comes last, the device first has to seek to the end of
+the file. Instead of rewriting the file on disk, we present a virtual file
+with the moov box moved in front of the media data, and its chunk offsets
+patched accordingly. Ranges of the virtual file are then mapped back onto
+the original file (and the patched moov box, which is kept in memory).
+"""
+
+import io
+import struct
+import threading
+from collections import OrderedDict
+from typing import BinaryIO
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+# Boxes that only hold other boxes, on the way from moov to the chunk offset tables.
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+# The patched moov box is held in memory, so we don't move unreasonably large ones.
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+# Layouts of recently served files are kept, as long as their patched moov boxes
+# take up no more than this in total (the latest one is always kept).
+LAYOUT_CACHE_SIZE = 128 * 1024 * 1024
+LAYOUT_CACHE_ENTRIES = 32
+
+
+class Box(NamedTuple):
+    type: bytes
+    offset: int
+    header_size: int
+    size: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def read_boxes(infile: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """Yield the boxes found between start and end, without descending into them."""
+
+    offset = start
+    while offset + 8 <= end:
+        infile.seek(offset)
+        header = infile.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        if not all(32 <= char < 127 for char in box_type):
+            raise ValueError("Not an mp4 box at {}".format(offset))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", infile.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # The box extends to the end of the file.
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ValueError("Invalid size of box at {}".format(offset))
+        yield Box(box_type, offset, header_size, size)
+        offset += size
+
+
+def patch_chunk_offsets(
+    moov: bytearray, start: int, end: int, shift_from: int, shift_to: int, delta: int
+) -> None:
+    """
+    Add delta to every chunk offset (in the stco/co64 boxes between start and end)
+    that points into [shift_from, shift_to).
+
+    Raises ValueError if a patched offset no longer fits in a 32 bit stco box.
+    """
+
+    for box in read_boxes(io.BytesIO(moov), start, end):
+        if box.type in CONTAINER_BOXES:
+            patch_chunk_offsets(
+                moov,
+                box.offset + box.header_size,
+                box.end,
+                shift_from,
+                shift_to,
+                delta,
+            )
+        elif box.type in (b"stco", b"co64"):
+            entry_format = ">I" if box.type == b"stco" else ">Q"
+            entry_size = struct.calcsize(entry_format)
+            # Skip version and flags.
+            count_offset = box.offset + box.header_size + 4
+            (count,) = struct.unpack_from(">I", moov, count_offset)
+            for entry in range(count):
+                entry_offset = count_offset + 4 + entry * entry_size
+                (chunk_offset,) = struct.unpack_from(entry_format, moov, entry_offset)
+                if shift_from <= chunk_offset < shift_to:
+                    chunk_offset += delta
+                    if box.type == b"stco" and chunk_offset > 0xFFFFFFFF:
+                        raise ValueError("Chunk offset does not fit in stco box")
+                    struct.pack_into(entry_format, moov, entry_offset, chunk_offset)
+
+
+class FaststartLayout(NamedTuple):
+    """
+    A virtual file, where the moov box found at [moov_start, moov_end)
+    of the original file is moved to insert_at (the start of the media data).
+    The file size is unchanged.
+    """
+
+    moov: bytes
+    insert_at: int
+    moov_start: int
+    moov_end: int
+
+    @property
+    def regions(self) -> List[Tuple[int, int, Union[bytes, int]]]:
+        """
+        The (virtual_start, virtual_end, source) regions of the virtual file.
+        The source is either in-memory data, or an offset into the original file.
+        """
+
+        moov_size = self.moov_end - self.moov_start
+        return [
+            (0, self.insert_at, 0),
+            (self.insert_at, self.insert_at + moov_size, self.moov),
+            (self.insert_at + moov_size, self.moov_end, self.insert_at),
+        ]
+
+    def map_range(
+        self, first: int, last: int
+    ) -> Iterator[Union[bytes, Tuple[int, int]]]:
+        """
+        Map an inclusive range of the virtual file onto the original file.
+
+        Yields data from the patched moov box as bytes,
+        and ranges of the original file as inclusive (first, last) tuples.
+        """
+
+        for start, end, source in self.regions:
+            if first >= end or last < start:
+                continue
+            piece_first, piece_last = max(first, start), min(last, end - 1)
+            if isinstance(source, bytes):
+                yield source[piece_first - start : piece_last - start + 1]
+            else:
+                yield (source + piece_first - start, source + piece_last - start)
+        if last >= self.moov_end:
+            # Everything after the original moov box is where it has always been.
+            yield (max(first, self.moov_end), last)
+
+
+def build_layout(infile: BinaryIO, size: int) -> Optional[FaststartLayout]:
+    boxes = list(read_boxes(infile, 0, size))
+    mdat = next((box for box in boxes if box.type == b"mdat"), None)
+    moov = next((box for box in boxes if box.type == b"moov"), None)
+    if not mdat or not moov or moov.offset < mdat.offset:
+        # Nothing to do, the file is either not an mp4 or already "faststart".
+        return None
+    if moov.size > MAX_MOOV_SIZE:
+        return None
+
+    infile.seek(moov.offset)
+    moov_data = bytearray(infile.read(moov.size))
+    patch_chunk_offsets(
+        moov_data, moov.header_size, moov.size, mdat.offset, moov.offset, moov.size
+    )
+    return FaststartLayout(bytes(moov_data), mdat.offset, moov.offset, moov.end)
+
+
+LayoutKey = Tuple[str, int, float]
+_layouts: OrderedDict[LayoutKey, Optional[FaststartLayout]] = OrderedDict()
+_layouts_lock = threading.Lock()
+
+
+def _cached_size() -> int:
+    return sum(len(layout.moov) for layout in _layouts.values() if layout)
+
+
+def get_faststart_layout(
+    path: str, size: int, mtime: float
+) -> Optional[FaststartLayout]:
+    """
+    Parse the box layout of an mp4 file, and return the layout of its
+    virtual "faststart" version, or None if it does not need (or allow) one.
+
+    Layouts are cached per file, size and mtime are part of the cache key
+    so that a modified file is parsed again. The cache is bounded by the total
+    size of the patched moov boxes in it (see LAYOUT_CACHE_SIZE).
+    """
+
+    key = (path, size, mtime)
+    with _layouts_lock:
+        if key in _layouts:
+            _layouts.move_to_end(key)
+            return _layouts[key]
+
+    try:
+        with open(path, "rb") as infile:
+            layout = build_layout(infile, size)
+    except (OSError, ValueError, struct.error):
+        layout = None
+
+    with _layouts_lock:
+        _layouts[key] = layout
+        while len(_layouts) > 1 and (
+            len(_layouts) > LAYOUT_CACHE_ENTRIES or _cached_size() > LAYOUT_CACHE_SIZE
+        ):
+            _layouts.popitem(last=False)
+    return layout
@@ -1,15 +1,67 @@
 import io
+import os
 import re
+import secrets
+import socket
 import socketserver
+import tempfile
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 from http.server import BaseHTTPRequestHandler
 from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import TextIO
 from typing import Tuple
+from urllib.parse import parse_qsl
+from urllib.parse import quote
+from urllib.parse import urlsplit
+
+from .faststart import FaststartLayout
+from .faststart import get_faststart_layout
 from .util import guess_mime
 
-BYTE_RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)?$")
+BYTE_RANGE_RE = re.compile(r"bytes=(.+)$")
+BYTE_RANGE_SPEC_RE = re.compile(r"\s*(\d*)-(\d*)\s*$")
+# Chromecasts routinely open a second range request (seeking, fetching the moov atom
+# at the end of an mp4, switching tracks) while the previous one is still draining.
+MAX_WORKERS = 8
+# Idle keep-alive connections still take up a worker, so they are closed quickly.
+# Once a request has arrived there is no timeout, as the Chromecast stops reading
+# the response for as long as it is paused.
+KEEPALIVE_TIMEOUT = 5
+# Growing files are polled for new data with an exponential backoff,
+# and are considered finished when they haven't grown for FOLLOW_IDLE_TIMEOUT.
+FOLLOW_MIN_DELAY = 0.05
+FOLLOW_MAX_DELAY = 1
+FOLLOW_IDLE_TIMEOUT = 30
+FOLLOW_BUFSIZE = 64 * 1024
+
+MULTIPART_HEADER = (
+    "\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n"
+)
+MULTIPART_END = "\r\n--{}--\r\n"
+
+CORS_HEADERS = [
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Expose-Headers", "Accept-Ranges, Content-Length, Content-Range"),
+]
+CORS_PREFLIGHT_HEADERS = [
+    *CORS_HEADERS,
+    ("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Range"),
+    ("Access-Control-Max-Age", "86400"),
+    ("Allow", "GET, HEAD, OPTIONS"),
+]
 
 
 def copy_byte_range(
@@ -26,111 +78,611 @@ def copy_byte_range(
     if start is not None:
         infile.seek(start)
     while True:
-        to_read = min(bufsize, stop + 1 - infile.tell() if stop else bufsize)
+        to_read = min(
+            bufsize, stop + 1 - infile.tell() if stop is not None else bufsize
+        )
+        if to_read <= 0:
+            break
         buf = infile.read(to_read)
         if not buf:
             break
         outfile.write(buf)
 
 
-def parse_byte_range(byte_range: str) -> Tuple[Optional[int], Optional[int]]:
-    """Returns the two numbers in 'bytes=123-456' or throws ValueError.
+def send_byte_range(
+    infile: io.BufferedIOBase,
+    sock: socket.socket,
+    outfile: io.BufferedIOBase,
+    start: int,
+    stop: int,
+):
+    """Copy a range of infile to sock, without passing the data through Python.
 
-    The last number or both numbers may be None.
+    The kernel moves the data with sendfile(2) where it is available. Otherwise
+    (or if infile is not backed by a real file) we fall back to copy_byte_range,
+    writing to outfile, which must wrap sock.
+    Both start and stop are inclusive.
     """
-    if byte_range.strip() == "":
-        return None, None
+    if stop < start:
+        return
+    if hasattr(os, "sendfile"):
+        try:
+            infile.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+        else:
+            sock.sendfile(infile, offset=start, count=stop - start + 1)
+            return
+    copy_byte_range(infile, outfile, start, stop)
+
 
-    match = BYTE_RANGE_RE.match(byte_range)
+def parse_byte_range(byte_range: str, size: int) -> List[Tuple[int, int]]:
+    """Returns the ranges in 'bytes=123-456, -100' or throws ValueError.
+
+    Open-ended ('123-') and suffix ('-100') ranges are resolved against size,
+    so every returned (first, last) pair is inclusive and within the file.
+    Ranges that start past the end of the file are dropped, which means the
+    result is empty if none of the ranges can be satisfied.
+    """
+    match = BYTE_RANGE_RE.match(byte_range.strip())
     if not match:
         raise ValueError("Invalid byte range {}".format(byte_range))
 
-    first, last = [int(x) if x else None for x in match.groups()]
-    assert first is not None
-    if last and last < first:
-        raise ValueError("Invalid byte range {}".format(byte_range))
-    return first, last
+    ranges = []
+    for spec in match.group(1).split(","):
+        spec_match = BYTE_RANGE_SPEC_RE.match(spec)
+        if not spec_match or spec_match.groups() == ("", ""):
+            raise ValueError("Invalid byte range {}".format(byte_range))
 
+        first, last = [int(x) if x else None for x in spec_match.groups()]
+        if first is None:
+            # Suffix range, the last N bytes of the file.
+            assert last is not None
+            if last == 0:
+                continue
+            first, last = max(size - last, 0), size - 1
+        elif last is None or last >= size:
+            last = size - 1
+        elif last < first:
+            raise ValueError("Invalid byte range {}".format(byte_range))
 
-def serve_file(
-    filename: str,
-    address: str = "",
-    port: int = 45114,
-    content_type=None,
-    single_req=False,
-):
-    class FileHandler(BaseHTTPRequestHandler):
-        def format_size(self, size):
-            for size_unity in ["B", "KB", "MB", "GB", "TB"]:
-                if size < 1024:
-                    return size, size_unity
-                size = size / 1024
-            return size * 1024, size_unity
-
-        def log_message(self, format, *args, **kwargs):
-            size, size_unity = self.format_size(stats.st_size)
-            format += " {} - {:0.2f} {}".format(content_type, size, size_unity)
-            return super(FileHandler, self).log_message(format, *args, **kwargs)
-
-        def do_GET(self):  # noqa
-            if "Range" not in self.headers:
-                first, last = 0, stats.st_size
+        if first < size:
+            ranges.append((first, last))
+    return ranges
+
+
+def format_size(size: float) -> str:
+    for size_unity in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1024 or size_unity == "TB":
+            break
+        size = size / 1024
+    return "{:0.2f} {}".format(size, size_unity)
+
+
+class ServedFile:
+    """A local file registered with a MediaServer."""
+
+    follow = False
+    accepts_ranges = True
+
+    def __init__(self, filename: str, content_type: Optional[str] = None) -> None:
+        self.path = Path(filename)
+        self.content_type = content_type or guess_mime(filename)
+        stats = self.path.stat()
+        self._size = stats.st_size
+        # These are the same for every response, so we only format them once.
+        self.headers = [
+            ("Accept-Ranges", "bytes"),
+            ("Last-Modified", formatdate(stats.st_mtime, usegmt=True)),
+            *CORS_HEADERS,
+        ]
+        self.log_suffix = " {} - {}".format(self.content_type, format_size(self.size))
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def complete_length(self) -> str:
+        """The total size of the file, as it goes in a Content-Range header."""
+        return str(self.size)
+
+    def open(self) -> io.BufferedIOBase:
+        return self.path.open("rb")
+
+    def close(self) -> None:
+        """Called when the file is no longer served."""
+        pass
+
+    def for_query(self, query: str) -> "ServedFile":
+        """The file to serve for a request with the given query string."""
+        return self
+
+    def wait_for_growth(self, size: int) -> bool:
+        """Wait until the file is larger than size, returns False if it never will be."""
+        return False
+
+    def send_byte_range(
+        self,
+        infile: io.BufferedIOBase,
+        sock: socket.socket,
+        outfile: io.BufferedIOBase,
+        first: int,
+        last: Optional[int],
+    ) -> None:
+        assert last is not None
+        send_byte_range(infile, sock, outfile, first, last)
+
+
+class FaststartFile(ServedFile):
+    """
+    An mp4 file with its moov box after the media data, served as if the moov box
+    came first (see the faststart module). The file on disk is left untouched.
+    """
+
+    def __init__(
+        self, filename: str, layout: FaststartLayout, content_type: Optional[str] = None
+    ) -> None:
+        super(FaststartFile, self).__init__(filename, content_type)
+        self.layout = layout
+
+    def send_byte_range(self, infile, sock, outfile, first, last):
+        for piece in self.layout.map_range(first, last):
+            if isinstance(piece, bytes):
+                outfile.write(piece)
             else:
-                try:
-                    first, last = parse_byte_range(self.headers["Range"])
-                except ValueError:
-                    self.send_error(400, "Invalid byte range")
-                    return None
+                send_byte_range(infile, sock, outfile, *piece)
+
+
+class GrowingFile(ServedFile):
+    """
+    A local file that is still being written to, such as a recording in progress.
+
+    Range requests are resolved against the size of the file at the time of
+    the request (waiting for it to grow if the range starts past its end).
+    Requests for the whole file get a chunked response that keeps following
+    the file as it grows, until it is finished, or has not grown for a while.
+    """
+
+    follow = True
+
+    def __init__(
+        self,
+        filename: str,
+        content_type: Optional[str] = None,
+        finished: Optional[threading.Event] = None,
+    ) -> None:
+        super(GrowingFile, self).__init__(filename, content_type)
+        self.finished = finished or threading.Event()
+        self.headers = [("Accept-Ranges", "bytes"), *CORS_HEADERS]
+        self.log_suffix = " {} - growing".format(self.content_type)
+
+    @property
+    def size(self) -> int:
+        return self.path.stat().st_size
+
+    @property
+    def complete_length(self) -> str:
+        return "*"
+
+    def wait_for_growth(self, size):
+        # The standard library has no portable way of watching a file,
+        # so we poll with an exponential backoff.
+        delay = FOLLOW_MIN_DELAY
+        deadline = time.monotonic() + FOLLOW_IDLE_TIMEOUT
+        while True:
+            # Check this before the size, so that the final write isn't missed.
+            finished = self.finished.is_set()
+            if self.size > size:
+                return True
+            if finished or time.monotonic() > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, FOLLOW_MAX_DELAY)
+
+    def send_byte_range(self, infile, sock, outfile, first, last):
+        if last is not None:
+            super(GrowingFile, self).send_byte_range(infile, sock, outfile, first, last)
+            return
+
+        # Follow the file with a chunked response, until it stops growing.
+        infile.seek(first)
+        while True:
+            data = infile.read(FOLLOW_BUFSIZE)
+            if data:
+                outfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            elif not self.wait_for_growth(infile.tell()):
+                break
+        outfile.write(b"0\r\n\r\n")
+
+
+class SpooledStream(GrowingFile):
+    """
+    A stream that can only be read once (such as stdin), copied to a temporary
+    file as it arrives, so that it can be served (and seeked in) as a growing file.
+    """
+
+    def __init__(
+        self, stream: io.BufferedReader, content_type: Optional[str] = None
+    ) -> None:
+        spool = tempfile.NamedTemporaryFile(prefix="catt-", delete=False)
+        super(SpooledStream, self).__init__(spool.name, content_type)
+        threading.Thread(target=self._spool, args=(stream, spool), daemon=True).start()
+
+    def _spool(self, stream, spool):
+        with spool:
+            while True:
+                data = stream.read1(FOLLOW_BUFSIZE)
+                if not data:
+                    break
+                spool.write(data)
+                spool.flush()
+        self.finished.set()
+
+    def close(self):
+        self.path.unlink(missing_ok=True)
+
 
-            if last is None or last >= stats.st_size:
-                last = stats.st_size - 1
-            response_length = last - first + 1
+class ConvertedFile(ServedFile):
+    """
+    A text file (such as subtitles) that is converted as it is served, without the
+    result ever being written out. The size of the result isn't known up front,
+    so it is sent with a chunked response, and range requests get the whole file.
+
+    :param open_source: Function that opens the source as a text stream.
+    :param convert: Function that converts lines of the source into pieces of the result.
+    :param adjust: Function that adjusts the result (as pieces) according to the query
+                   parameters of a request, if there are any.
+    """
+
+    follow = True
+    accepts_ranges = False
+
+    def __init__(
+        self,
+        open_source: Callable[[], TextIO],
+        convert: Callable[[Iterable[str]], Iterator[str]],
+        content_type: str,
+        adjust: Optional[
+            Callable[[Iterator[str], Dict[str, str]], Iterator[str]]
+        ] = None,
+    ) -> None:
+        self._open_source = open_source
+        self._convert = convert
+        self._adjust = adjust
+        self.content_type = content_type
+        self.headers = [*CORS_HEADERS]
+        self.log_suffix = " {} - converted".format(self.content_type)
+
+    @property
+    def size(self) -> int:
+        return 0
+
+    @property
+    def complete_length(self) -> str:
+        return "*"
+
+    def open(self):
+        return self._open_source()
+
+    def for_query(self, query: str) -> ServedFile:
+        params = dict(parse_qsl(query))
+        if not self._adjust or not params:
+            return self
+        adjust, convert = self._adjust, self._convert
+        return ConvertedFile(
+            self._open_source,
+            lambda lines: adjust(convert(lines), params),
+            self.content_type,
+        )
+
+    def send_byte_range(self, infile, sock, outfile, first, last):
+        pieces: List[bytes] = []
+        pending = 0
+        for text in self._convert(infile):
+            data = text.encode()
+            pieces.append(data)
+            pending += len(data)
+            if pending >= FOLLOW_BUFSIZE:
+                outfile.write(b"%x\r\n%s\r\n" % (pending, b"".join(pieces)))
+                pieces, pending = [], 0
+        if pending:
+            outfile.write(b"%x\r\n%s\r\n" % (pending, b"".join(pieces)))
+        outfile.write(b"0\r\n\r\n")
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    # Persistent connections spare the Chromecast a new TCP handshake per seek.
+    protocol_version = "HTTP/1.1"
+    server: "MediaServer"
+    served_file: Optional[ServedFile] = None
+    idle = False
+
+    def handle_one_request(self):
+        self.idle = True
+        self.served_file = None
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        super(MediaRequestHandler, self).handle_one_request()
+
+    def parse_request(self):
+        # The request line has arrived.
+        self.idle = False
+        self.connection.settimeout(None)
+        return super(MediaRequestHandler, self).parse_request()
 
+    def log_error(self, format, *args):
+        # Idle connections timing out is expected, and not worth a message.
+        if not self.idle:
+            super(MediaRequestHandler, self).log_error(format, *args)
+
+    def log_message(self, format, *args, **kwargs):
+        if self.served_file:
+            format += self.served_file.log_suffix
+        return super(MediaRequestHandler, self).log_message(format, *args, **kwargs)
+
+    def send_head(self) -> Optional[Sequence[Tuple[bytes, int, Optional[int]]]]:
+        """
+        Send the response headers, and return the parts of the body to send.
+
+        Each part is a multipart header to write, followed by the (inclusive)
+        range of the file that makes up its body. A range without an end means
+        that the file should be followed for as long as it grows.
+        """
+        path, query = urlsplit(self.path)[2:4]
+        served_file = self.server.get_file(path)
+        if not served_file:
+            self.send_error(404, "File not found")
+            return None
+        self.served_file = served_file.for_query(query)
+
+        content_type, size = self.served_file.content_type, self.served_file.size
+        complete_length = self.served_file.complete_length
+        if "Range" not in self.headers or not self.served_file.accepts_ranges:
+            ranges = None
+        else:
             try:
-                if "Range" not in self.headers:
-                    self.send_response(200)
-                else:
-                    self.send_response(206)
-                    self.send_header(
-                        "Content-Range",
-                        "bytes {}-{}/{}".format(first, last, stats.st_size),
-                    )
+                ranges = parse_byte_range(self.headers["Range"], size)
+                while not ranges and self.served_file.wait_for_growth(size):
+                    size = self.served_file.size
+                    ranges = parse_byte_range(self.headers["Range"], size)
+            except ValueError:
+                self.send_error(400, "Invalid byte range")
+                return None
+            if not ranges:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
 
-                self.send_header("Accept-Ranges", "bytes")
-                self.send_header("Content-type", content_type)
-                self.send_header("Content-Length", str(response_length))
-                self.send_header("Access-Control-Allow-Origin", "*")
-                self.send_header(
-                    "Last-Modified",
-                    time.strftime(
-                        "%a %d %b %Y %H:%M:%S GMT", time.localtime(stats.st_mtime)
-                    ),
+        if ranges is None and self.served_file.follow:
+            self.send_response(200)
+            for header in self.served_file.headers:
+                self.send_header(*header)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            return [(b"", 0, None)]
+        elif ranges is None:
+            self.send_response(200)
+            parts = [(b"", 0, size - 1)]
+            response_type = content_type
+        elif len(ranges) == 1:
+            first, last = ranges[0]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(first, last, complete_length)
+            )
+            parts = [(b"", first, last)]
+            response_type = content_type
+        else:
+            # Several ranges are served as one multipart/byteranges response,
+            # so that eg. the header and the index of a file take one request.
+            boundary = secrets.token_hex(16)
+            parts = [
+                (
+                    MULTIPART_HEADER.format(
+                        boundary, content_type, first, last, complete_length
+                    ).encode(),
+                    first,
+                    last,
                 )
-                self.end_headers()
+                for first, last in ranges
+            ]
+            parts.append((MULTIPART_END.format(boundary).encode(), 0, -1))
+            self.send_response(206)
+            response_type = "multipart/byteranges; boundary={}".format(boundary)
 
-                mediafile = open(str(mediapath), "rb")
-                copy_byte_range(mediafile, self.wfile, first, last)
-            except ConnectionResetError:
-                # This is supposed to happen when the Chromecast seeks or stops.
-                pass
-            except BrokenPipeError:
-                # This is normal when the Chromecast closes a range request after
-                # seeking, track-switching, or reaching EOF.  Silently ignore it.
-                pass
-            except:  # noqa
-                traceback.print_exc()
+        for header in self.served_file.headers:
+            self.send_header(*header)
+        self.send_header("Content-Type", response_type)
+        self.send_header(
+            "Content-Length",
+            str(sum(len(header) + last - first + 1 for header, first, last in parts)),
+        )
+        self.end_headers()
+        return parts
+
+    def do_HEAD(self):  # noqa
+        self.send_head()
 
-            mediafile.close()
+    def do_GET(self):  # noqa
+        try:
+            parts = self.send_head()
+            if parts is None:
+                return
+            assert self.served_file is not None
+            with self.served_file.open() as mediafile:
+                for header, first, last in parts:
+                    self.wfile.write(header)
+                    self.served_file.send_byte_range(
+                        mediafile, self.connection, self.wfile, first, last
+                    )
+        except (ConnectionResetError, BrokenPipeError, TimeoutError):
+            # This is normal when the Chromecast closes a range request after
+            # seeking, track-switching, stopping, or reaching EOF.
+            # Silently ignore it, but don't try to reuse the connection.
+            self.close_connection = True
+        except:  # noqa
+            self.close_connection = True
+            traceback.print_exc()
+
+    def do_OPTIONS(self):  # noqa
+        # CORS preflight.
+        self.send_response(204)
+        for header in CORS_PREFLIGHT_HEADERS:
+            self.send_header(*header)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
 
-    if content_type is None:
-        content_type = guess_mime(filename)
 
-    mediapath = Path(filename)
-    stats = mediapath.stat()
+class MediaServer(socketserver.TCPServer):
+    """
+    Long-lived http server that serves any number of local files (videos,
+    subtitles, artwork...) under opaque paths, on a single port.
 
-    httpd = socketserver.TCPServer((address, port), FileHandler)
-    if single_req:
-        httpd.handle_request()
-    else:
-        httpd.serve_forever()
-    httpd.server_close()
+    Files can be added and removed while the server is running.
+    Connections are handed to a bounded pool of worker threads, so that
+    overlapping range requests from the Chromecast are served in parallel.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(
+        self, address: str = "", port: int = 0, max_workers: int = MAX_WORKERS
+    ) -> None:
+        self._files: Dict[str, ServedFile] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="catt-http"
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._connections: Set[socket.socket] = set()
+        # Set whenever a connection has been handled.
+        self.connection_handled = threading.Event()
+        super(MediaServer, self).__init__((address, port), MediaRequestHandler)
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def add_file(
+        self,
+        filename: str,
+        content_type: Optional[str] = None,
+        faststart: bool = False,
+        follow: bool = False,
+    ) -> str:
+        """
+        Start serving a local file, and return the url it is served under.
+
+        :param faststart: If the file is an mp4 file with its moov box at the end,
+                          serve it as if the moov box came first.
+        :param follow: The file is still being written to, keep serving new data
+                       as it arrives.
+        """
+
+        if follow:
+            return self._add(GrowingFile(filename, content_type), Path(filename).name)
+
+        served_file = ServedFile(filename, content_type)
+        if faststart:
+            stats = served_file.path.stat()
+            layout = get_faststart_layout(
+                str(served_file.path.resolve()), stats.st_size, stats.st_mtime
+            )
+            if layout:
+                served_file = FaststartFile(filename, layout, content_type)
+        return self._add(served_file, Path(filename).name)
+
+    def add_stream(
+        self,
+        stream: io.BufferedReader,
+        content_type: Optional[str] = None,
+        name: str = "stream",
+    ) -> str:
+        """
+        Start serving a stream that can only be read once, such as stdin,
+        and return the url it is served under.
+        """
+
+        return self._add(SpooledStream(stream, content_type), name)
+
+    def add_converted(
+        self,
+        open_source: Callable[[], TextIO],
+        convert: Callable[[Iterable[str]], Iterator[str]],
+        content_type: str,
+        name: str,
+        adjust: Optional[
+            Callable[[Iterator[str], Dict[str, str]], Iterator[str]]
+        ] = None,
+    ) -> str:
+        """
+        Start serving a text file that is converted whenever it is requested,
+        and return the url it is served under.
+
+        :param adjust: Function that adjusts the converted file according to the
+                       query parameters of a request (see ConvertedFile).
+        """
+
+        served_file = ConvertedFile(open_source, convert, content_type, adjust=adjust)
+        return self._add(served_file, name)
+
+    def _add(self, served_file: ServedFile, name: str) -> str:
+        path = "/{}/{}".format(secrets.token_urlsafe(8), quote(name))
+        self._files[path] = served_file
+        return self.url + path
+
+    def remove_file(self, url: str) -> None:
+        """Stop serving the file that was served under url."""
+
+        served_file = self._files.pop(urlsplit(url).path, None)
+        if served_file:
+            served_file.close()
+
+    def get_file(self, path: str) -> Optional[ServedFile]:
+        return self._files.get(path)
+
+    def start(self) -> threading.Thread:
+        """
+        Serve in a background thread, until stop is called.
+
+        :returns: The serving thread, which is alive for as long as the server is.
+        """
+
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        # Waiting for the serving loop to end would block forever if it never started.
+        if self._thread:
+            self.shutdown()
+        self.server_close()
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        self._connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self._connections.discard(request)
+            self.shutdown_request(request)
+            self.connection_handled.set()
+
+    def server_close(self):
+        super(MediaServer, self).server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Responses have no timeout, so a paused Chromecast would otherwise keep
+        # the workers (and with them the process) around after we are done.
+        for request in list(self._connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for served_file in self._files.values():
+            served_file.close()
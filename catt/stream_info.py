@@ -1,11 +1,31 @@
+import itertools
+import json
 import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 
 import yt_dlp
 
+from .cache import FileCache
 from .error import ExtractionError
 from .error import FormatError
 from .error import PlaylistError
+from .subs_info import CONVERTERS
+from .util import get_cache_dir
 from .util import get_local_ip
 from .util import guess_mime
 
@@ -32,7 +52,216 @@ STANDARD_FORMAT = BEST_MAX_2K + MAX_50FPS + TWITCH_NO_60FPS + BANDCAMP_NO_AIFF_A
 
 DEFAULT_YTDL_OPTS = {"quiet": True, "no_warnings": True}
 
-SUBTITLE_PRIORITY = {"vtt": 30, "ttml": 20, "srt": 10}
+SUBTITLE_PRIORITY = {"vtt": 30, "ttml": 20, "dfxp": 20, "srt": 10}
+
+# Number of recent playlist entries kept in memory, for playlists that can only be iterated.
+ENTRY_WINDOW = 50
+
+EXTRACTION_CACHE_DIR = Path(get_cache_dir(), "extraction")
+# Extracted info is kept for this long, unless its media urls expire sooner.
+EXTRACTION_CACHE_TTL = 60 * 60
+# Cached media urls need to stay valid for the duration of the media, plus this margin.
+EXPIRY_MARGIN = 10 * 60
+# Number of upcoming playlist entries that are resolved ahead of time, when prefetching.
+PREFETCH_COUNT = 3
+PREFETCH_WORKERS = 2
+# Signed media urls often carry their expiry time, like "...&expire=1700000000&..."
+# or (on YouTube, for manifests) ".../expire/1700000000/...".
+EXPIRE_RE = re.compile(r"[?&/]expires?[=/](\d{9,11})(?:[&/]|$)", re.IGNORECASE)
+
+
+def get_url_expiry(info: dict) -> Optional[float]:
+    """Return the earliest expiry time of the media urls in an info dict, if any."""
+
+    urls = [info.get("url"), info.get("manifest_url")]
+    for fmt in info.get("formats") or []:
+        urls.extend([fmt.get("url"), fmt.get("manifest_url")])
+    expiry_times = [
+        int(match.group(1))
+        for url in urls
+        if isinstance(url, str)
+        for match in [EXPIRE_RE.search(url)]
+        if match
+    ]
+    return min(expiry_times) if expiry_times else None
+
+
+def get_info_expiry(info: dict) -> Optional[float]:
+    """
+    Return the time after which the media urls in an info dict can no longer be
+    relied on to last for the duration of the media, if they expire at all.
+    """
+
+    url_expiry = get_url_expiry(info)
+    if not url_expiry:
+        return None
+    return url_expiry - (info.get("duration") or 0) - EXPIRY_MARGIN
+
+
+class EntryPrefetcher:
+    """
+    Resolves playlist entries into info dicts ahead of time, in a bounded number of
+    (daemon) threads. Work for entries that are no longer wanted is cancelled, unless
+    it has already started, in which case its result is simply dropped.
+
+    :param resolve: Function that resolves an entry (pre-info) into an info dict.
+    :type resolve: Callable[[dict], dict]
+    :param workers: Maximum number of entries that are resolved at the same time.
+    :type workers: int
+    """
+
+    def __init__(
+        self, resolve: Callable[[dict], dict], workers: int = PREFETCH_WORKERS
+    ) -> None:
+        self._resolve = resolve
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._futures: Dict[int, Future] = {}
+        self._pending: Deque[Tuple[Future, dict]] = deque()
+        self._running = 0
+
+    def prefetch(self, entries: Dict[int, dict]) -> None:
+        """
+        Resolve entries in the background, and cancel the work for any other entries.
+
+        :param entries: The entries to resolve, by their index in the playlist.
+        :type entries: Dict[int, dict]
+        """
+
+        with self._lock:
+            for index in list(self._futures):
+                if index not in entries:
+                    self._futures.pop(index).cancel()
+            for index, entry in entries.items():
+                if index not in self._futures:
+                    future: Future = Future()
+                    self._futures[index] = future
+                    self._pending.append((future, entry))
+            while self._running < min(self._workers, len(self._pending)):
+                self._running += 1
+                threading.Thread(target=self._work, daemon=True).start()
+
+    def cancel(self) -> None:
+        self.prefetch({})
+
+    def pop(self, index: int) -> Optional[dict]:
+        """
+        Return the info of a prefetched entry (waiting for it, if it is being resolved),
+        or None if the entry was not prefetched, failed to resolve or has expired.
+        """
+
+        with self._lock:
+            future = self._futures.pop(index, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            info = future.result()
+        except Exception:
+            return None
+        expiry = get_info_expiry(info)
+        if expiry is not None and expiry <= time.time():
+            return None
+        return info
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running -= 1
+                    return
+                future, entry = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._resolve(entry))
+            except Exception as exc:
+                future.set_exception(exc)
+
+
+class PlaylistEntries:
+    """
+    The entries of a playlist, fetched from the extractor only as far as they are needed.
+
+    yt-dlp hands out playlist entries as a list, as a PagedList (which can fetch single
+    pages, like the "playlist_items" option does), or as an iterator. Iterators are
+    consumed lazily, keeping a window of recent entries in memory, and are started over
+    (with the restart function) when an entry from before the window is needed.
+
+    :param entries: The "entries" of a playlist pre-info.
+    :param restart: Function that returns the entries again, from the start.
+    :param count: Number of entries, if known up front.
+    :param window: Number of recent entries to keep, when iterating.
+    """
+
+    def __init__(
+        self,
+        entries: Iterable[dict],
+        restart: Optional[Callable[[], Iterable[dict]]] = None,
+        count: Optional[int] = None,
+        window: int = ENTRY_WINDOW,
+    ) -> None:
+        self._entries = entries
+        self._restart = restart
+        self._count = len(entries) if isinstance(entries, (list, tuple)) else count
+        self._iterator: Optional[Iterator[dict]] = None
+        self._position = 0
+        self._window: Deque[Tuple[int, dict]] = deque(maxlen=window)
+        if not isinstance(entries, (list, tuple, yt_dlp.utils.PagedList)):
+            self._iterator = iter(entries)
+
+    @property
+    def count(self) -> Optional[int]:
+        """The number of entries, if it is known without fetching all of them."""
+
+        return self._count
+
+    def __getitem__(self, index: int) -> dict:
+        if isinstance(self._entries, (list, tuple)):
+            return self._entries[index]
+        if index < 0:
+            raise IndexError("Negative playlist indexes are not supported")
+        if isinstance(self._entries, yt_dlp.utils.PagedList):
+            page = self._entries.getslice(index, index + 1)
+            if not page:
+                raise IndexError("Playlist index out of range")
+            return page[0]
+
+        for entry_index, entry in self._window:
+            if entry_index == index:
+                return entry
+        if index < self._position:
+            if not self._restart:
+                raise IndexError("Playlist entry is no longer available")
+            self._iterator = iter(self._restart())
+            self._position = 0
+            self._window.clear()
+        assert self._iterator is not None
+        while self._position <= index:
+            try:
+                entry = next(self._iterator)
+            except StopIteration:
+                self._count = self._position
+                raise IndexError("Playlist index out of range")
+            self._window.append((self._position, entry))
+            self._position += 1
+        return entry
+
+    def __iter__(self) -> Iterator[dict]:
+        index = 0
+        while True:
+            try:
+                entry = self[index]
+            except IndexError:
+                return
+            yield entry
+            index += 1
+
+    def __bool__(self) -> bool:
+        try:
+            self[0]
+        except IndexError:
+            return False
+        return True
 
 
 class StreamInfo:
@@ -43,21 +272,39 @@ class StreamInfo:
         ytdl_options=None,
         throw_ytdl_dl_errs=False,
         stream_type=None,
+        cache: Optional[FileCache] = None,
     ):
         self._throw_ytdl_dl_errs = throw_ytdl_dl_errs
         self.stream_type = stream_type
-        self.local_ip = get_local_ip(cast_info.host) if cast_info else None
-        self.port = random.randrange(45000, 47000) if cast_info else None
-        self.media_info = None
+        self.local_ip = None
+        self.port = None
+        self.media_info: Optional[dict] = None
+        self.converted_subtitle_tracks: List[dict] = []
+        self._format_option = None
+        self._prefetcher: Optional[EntryPrefetcher] = None
+        self._prefetch_count = 0
 
         if "://" in video_url:
-            self._ydl = yt_dlp.YoutubeDL(
-                dict(ytdl_options) if ytdl_options else DEFAULT_YTDL_OPTS
+            # YoutubeDL keeps (and we later modify) the options dict, so it gets a copy.
+            options = dict(ytdl_options or DEFAULT_YTDL_OPTS)
+            self._ydl = yt_dlp.YoutubeDL(options)
+            self._cache = cache
+            # The format is applied to the info after extraction, so it isn't part of the key.
+            self._cache_key = json.dumps(
+                [video_url, {k: v for k, v in options.items() if k != "format"}],
+                sort_keys=True,
+                default=str,
             )
-            self._preinfo = self._get_stream_preinfo(video_url)
-            # Some playlist urls needs to be re-processed (such as youtube channel urls).
-            if self._preinfo.get("ie_key"):
-                self._preinfo = self._get_stream_preinfo(self._preinfo["url"])
+            cached = cache.get(self._cache_key) if cache else None
+            self._playlist_url = video_url
+            if cached:
+                self._preinfo = cached["preinfo"]
+            else:
+                self._preinfo = self._get_stream_preinfo(video_url)
+                # Some playlist urls needs to be re-processed (such as youtube channel urls).
+                if self._preinfo.get("ie_key"):
+                    self._playlist_url = self._preinfo["url"]
+                    self._preinfo = self._get_stream_preinfo(self._playlist_url)
             self.is_local_file = False
             if self.stream_type is None and "duration" in self._preinfo:
                 if self._preinfo["duration"] is None:
@@ -82,63 +329,87 @@ class StreamInfo:
                     best.setdefault("ext", "vtt")
                     # Add a blank name if there is none:
                     best.setdefault("name", "")
-                    # Only add the subtitle if compatible
-                    # (subtitles with zero priority are discarded)
-                    if SUBTITLE_PRIORITY.get(best["ext"], 0) > 0:
-                        self.media_info["tracks"].append(
-                            {
-                                "trackId": i,
-                                "trackContentId": best["url"],
-                                "language": lang,
-                                "subtype": "SUBTITLES",
-                                "type": "TEXT",
-                                "trackContentType": guess_mime(
-                                    "subtitles." + best["ext"]
-                                ),
-                                "name": f"[{lang}] " + best["name"],
-                            }
-                        )
-
-            model = (
-                (cast_info.manufacturer, cast_info.model_name) if cast_info else None
-            )
-            cast_type = cast_info.cast_type if cast_info else None
+                    track = {
+                        "trackId": i,
+                        "trackContentId": best["url"],
+                        "language": lang,
+                        "subtype": "SUBTITLES",
+                        "type": "TEXT",
+                        "trackContentType": guess_mime("subtitles." + best["ext"]),
+                        "name": f"[{lang}] " + best["name"],
+                    }
+                    # Subtitles that the device can't show are converted to WebVTT,
+                    # and served locally (see serve_subtitle_tracks).
+                    # Incompatible subtitles that can't be converted are discarded.
+                    if track["trackContentType"] in CONVERTERS:
+                        self.converted_subtitle_tracks.append(track)
+                    elif SUBTITLE_PRIORITY.get(best["ext"], 0) > 0:
+                        self.media_info["tracks"].append(track)
+
             if "format" in self._ydl.params:
                 # We pop the "format" item, as it will make get_stream_info fail,
                 # if it holds an invalid value.
-                self._best_format = self._ydl.params.pop("format")
-            elif cast_type and cast_type in AUDIO_DEVICE_TYPES:
-                self._best_format = AUDIO_FORMAT
-            elif model and model in ULTRA_MODELS:
-                self._best_format = ULTRA_FORMAT
-            else:
-                self._best_format = STANDARD_FORMAT
+                self._format_option = self._ydl.params.pop("format")
 
             if self.is_playlist:
-                self._entries = list(self._preinfo["entries"])
-                # There appears to be no way to extract both a YouTube video id,
-                # and ditto playlist id in one go (in the case of an url containing both),
-                # so we set the "noplaylist" option and then fetch preinfo again.
-                self._ydl.params.update({"noplaylist": True})
-                vpreinfo = self._get_stream_preinfo(video_url)
-                self._info = (
-                    self._get_stream_info(vpreinfo)
-                    if "entries" not in vpreinfo
-                    else None
+                self._entries = PlaylistEntries(
+                    self._preinfo["entries"],
+                    restart=self._extract_entries,
+                    count=self._preinfo.get("playlist_count"),
                 )
+                # Entries are processed with the "noplaylist" option set, so that entry urls
+                # which contain both a video id and a playlist id resolve to the video.
+                self._ydl.params.update({"noplaylist": True})
+                # The active entry (the video in an url containing both a video id
+                # and a playlist id) is looked up, and processed, when it is needed.
+                self._video_url = video_url
+                self._entry = None
+                self._entry_resolved = False
+                self._info = None
+            elif cached:
+                self._info = cached["info"]
             else:
                 self._info = self._get_stream_info(self._preinfo)
+                self._cache_info()
         else:
             self._local_file = video_url
             self.is_local_file = True
 
+        self.set_cast_info(cast_info)
+
+    def set_cast_info(self, cast_info):
+        """
+        Set the device that the stream is going to be cast to,
+        which decides the local ip and port to serve local files on,
+        and the best format of remote streams.
+
+        Extraction does not depend on the device, so StreamInfo objects can be
+        created while the device is still being discovered.
+        """
+
+        self.local_ip = get_local_ip(cast_info.host) if cast_info else None
+        self.port = random.randrange(45000, 47000) if cast_info else None
+        if self.is_local_file:
+            return
+
+        model = (cast_info.manufacturer, cast_info.model_name) if cast_info else None
+        cast_type = cast_info.cast_type if cast_info else None
+        if self._format_option:
+            self._best_format = self._format_option
+        elif cast_type and cast_type in AUDIO_DEVICE_TYPES:
+            self._best_format = AUDIO_FORMAT
+        elif model and model in ULTRA_MODELS:
+            self._best_format = ULTRA_FORMAT
+        else:
+            self._best_format = STANDARD_FORMAT
+
     @property
     def is_remote_file(self):
         return not self.is_local_file and not self.is_playlist
 
     @property
     def _is_direct_link(self):
-        return self.is_remote_file and self._info.get("direct")
+        return self.is_remote_file and self._get_info().get("direct")
 
     @property
     def is_playlist(self):
@@ -146,7 +417,7 @@ class StreamInfo:
 
     @property
     def is_playlist_with_active_entry(self):
-        return self.is_playlist and self._info
+        return self.is_playlist and self._get_active_entry() is not None
 
     @property
     def extractor(self):
@@ -161,7 +432,7 @@ class StreamInfo:
         elif self._is_direct_link:
             return Path(self._preinfo["webpage_url_basename"]).stem
         elif self.is_remote_file or self.is_playlist_with_active_entry:
-            return self._info["title"]
+            return self._get_info()["title"]
         else:
             return None
 
@@ -170,22 +441,25 @@ class StreamInfo:
         if self.is_local_file:
             return "http://{}:{}/?loaded_from_catt".format(self.local_ip, self.port)
         elif self.is_remote_file or self.is_playlist_with_active_entry:
-            return self._get_stream_url(self._info)
+            return self._get_stream_url(self._get_info())
         else:
             return None
 
     @property
     def video_id(self):
-        return (
-            self._info["id"]
-            if self.is_remote_file or self.is_playlist_with_active_entry
-            else None
-        )
+        if self.is_remote_file:
+            return self._info["id"]
+        elif self.is_playlist_with_active_entry:
+            # Playing the playlist with the YouTube app only needs the id,
+            # so we avoid processing the entry if we can.
+            return self._get_active_entry().get("id") or self._get_info()["id"]
+        else:
+            return None
 
     @property
     def video_thumbnail(self):
         return (
-            self._info.get("thumbnail")
+            self._get_info().get("thumbnail")
             if self.is_remote_file or self.is_playlist_with_active_entry
             else None
         )
@@ -195,7 +469,7 @@ class StreamInfo:
         if self.is_local_file:
             return guess_mime(Path(self._local_file).name)
         elif self._is_direct_link:
-            return guess_mime(self._info["webpage_url_basename"])
+            return guess_mime(self._get_info()["webpage_url_basename"])
         else:
             return None
 
@@ -206,12 +480,18 @@ class StreamInfo:
 
     @property
     def playlist_length(self):
-        return len(self._entries) if self.is_playlist else None
+        """The number of entries in the playlist, if it is known without fetching all of them."""
+
+        return self._entries.count if self.is_playlist else None
+
+    @property
+    def playlist_is_empty(self):
+        return self.is_playlist and not self._entries
 
     @property
-    def playlist_all_ids(self):
-        if self.is_playlist and self._entries and self._entries[0].get("id"):
-            return [entry["id"] for entry in self._entries]
+    def playlist_first_id(self):
+        if self.is_playlist and self._entries:
+            return self._entries[0].get("id")
         else:
             return None
 
@@ -224,19 +504,145 @@ class StreamInfo:
         return self._preinfo["id"] if self.is_playlist else None
 
     def set_playlist_entry(self, number):
-        if self.is_playlist:
-            # Some playlist entries needs to be re-processed.
-            if self._entries[number].get("ie_key"):
-                entry = self._get_stream_preinfo(self._entries[number]["url"])
-            else:
-                entry = self._entries[number]
-            self._info = self._get_stream_info(entry)
+        if not self.is_playlist:
+            raise PlaylistError("Called on non-playlist")
+
+        entry = self._entries[number]
+        info = self._prefetcher.pop(number) if self._prefetcher else None
+        if info:
+            self._entry = entry
+            self._entry_resolved = True
+            self._info = info
         else:
+            self._set_entry(entry)
+        if self._prefetcher:
+            self._prefetch_entries(number + 1)
+
+    def start_prefetching(self, count=PREFETCH_COUNT):
+        """
+        From now on, whenever a playlist entry is set, resolve the next count entries
+        in the background, so that moving on to them doesn't wait for extraction.
+
+        :param count: Number of upcoming entries to resolve.
+        :type count: int
+        """
+
+        if not self.is_playlist:
+            raise PlaylistError("Called on non-playlist")
+        # YoutubeDL objects are not thread-safe, so every entry gets its own.
+        options = dict(self._ydl.params)
+        self._prefetch_count = count
+        self._prefetcher = EntryPrefetcher(
+            lambda entry: self._resolve_entry(entry, yt_dlp.YoutubeDL(options))
+        )
+
+    def stop_prefetching(self):
+        if self._prefetcher:
+            self._prefetcher.cancel()
+            self._prefetcher = None
+
+    def _prefetch_entries(self, start):
+        entries = {}
+        for index in range(start, start + self._prefetch_count):
+            try:
+                entries[index] = self._entries[index]
+            except IndexError:
+                break
+        self._prefetcher.prefetch(entries)
+
+    def set_random_playlist_entry(self):
+        """
+        Pick a random playlist entry. When the number of entries is known,
+        only the picked entry is fetched. Otherwise, the playlist is streamed
+        through once, while picking an entry with reservoir sampling.
+        """
+
+        if not self.is_playlist:
             raise PlaylistError("Called on non-playlist")
+        if self._entries.count is not None:
+            self.set_playlist_entry(random.randrange(self._entries.count))
+            return
+
+        picked = None
+        for index, entry in enumerate(self._entries):
+            if random.randrange(index + 1) == 0:
+                picked = entry
+        if picked is None:
+            raise PlaylistError("Playlist is empty")
+        self._set_entry(picked)
+
+    def _set_entry(self, entry):
+        self._entry = entry
+        self._entry_resolved = True
+        self._info = None
+        self._get_info()
+
+    def _get_info(self):
+        if self._info is None and self.is_playlist and self._get_active_entry():
+            self._info = self._resolve_entry(self._get_active_entry())
+        return self._info
+
+    def _resolve_entry(self, entry, ydl=None):
+        # Some playlist entries needs to be re-processed.
+        if entry.get("ie_key"):
+            entry = self._get_stream_preinfo(entry["url"], ydl)
+        return self._get_stream_info(entry, ydl)
+
+    def _get_active_entry(self):
+        if not self._entry_resolved:
+            self._entry = self._find_active_entry()
+            self._entry_resolved = True
+        return self._entry
+
+    def _find_active_entry(self):
+        """
+        Find the pre-info of the video in an url containing both a video id and a playlist id.
+
+        That video is usually among the first entries of the playlist, with its id in the url
+        (like in "watch?v=<video id>&list=<playlist id>"), so we look for it there first.
+        Only if it isn't found, the url is extracted again, with the "noplaylist" option set.
+        """
+
+        url = urlsplit(self._video_url)
+        url_ids = {segment for segment in url.path.split("/") if segment}
+        url_ids.update(v for values in parse_qs(url.query).values() for v in values)
+        url_ids.discard(self.playlist_id)
+        for entry in itertools.islice(self._entries, ENTRY_WINDOW):
+            if entry.get("id") in url_ids:
+                return entry
+
+        vpreinfo = self._get_stream_preinfo(self._video_url)
+        return vpreinfo if "entries" not in vpreinfo else None
+
+    def _extract_entries(self):
+        """Extract the entries of the playlist again, from the start."""
+
+        noplaylist = self._ydl.params.get("noplaylist")
+        self._ydl.params["noplaylist"] = False
+        try:
+            return self._get_stream_preinfo(self._playlist_url)["entries"]
+        finally:
+            self._ydl.params["noplaylist"] = noplaylist
+
+    def _cache_info(self):
+        if not self._cache:
+            return
+        expires = time.time() + EXTRACTION_CACHE_TTL
+        info_expiry = get_info_expiry(self._info)
+        if info_expiry:
+            expires = min(expires, info_expiry)
+        self._cache.set(
+            self._cache_key,
+            {
+                "preinfo": self._ydl.sanitize_info(self._preinfo),
+                "info": self._ydl.sanitize_info(self._info),
+            },
+            expires,
+        )
 
-    def _get_stream_preinfo(self, video_url):
+    def _get_stream_preinfo(self, video_url, ydl=None):
         try:
-            return self._ydl.extract_info(video_url, process=False)
+            return (ydl or self._ydl).extract_info(video_url, process=False)
         except yt_dlp.utils.DownloadError:
             # We sometimes get CI failures when testing with YouTube videos,
             # as YouTube throttles our connections intermittently. We evaluated
@@ -250,9 +656,9 @@ class StreamInfo:
             else:
                 raise ExtractionError("Remote resource not found")
 
-    def _get_stream_info(self, preinfo):
+    def _get_stream_info(self, preinfo, ydl=None):
         try:
-            return self._ydl.process_ie_result(preinfo, download=False)
+            return (ydl or self._ydl).process_ie_result(preinfo, download=False)
         except (yt_dlp.utils.ExtractorError, yt_dlp.utils.DownloadError):
             raise ExtractionError("yt-dlp extractor failed")
 
@@ -1,17 +1,466 @@
+import codecs
+import hashlib
+import io
 import re
+import threading
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+from xml.etree import ElementTree
 
 import requests
 
+from .cache import SubtitleCache
 from .error import SubtitlesError
-from .util import create_temp_file
+from .util import get_cache_dir
 from .util import guess_mime
 
+# The encoding of a subtitles file is detected from this much of its start.
+ENCODING_SNIFF_SIZE = 64 * 1024
+FALLBACK_ENCODING = "iso-8859-15"
+# TTML is parsed in pieces of this size, as it may well be a single, very long, line.
+TTML_CHUNK_SIZE = 64 * 1024
+TTML_TIME_RE = re.compile(
+    r"^(?:(\d+):(\d{2}):(\d{2})(?:(\.\d+)|:(\d+)(?:\.\d+)?)?"
+    r"|(\d+(?:\.\d+)?)(h|ms|m|s|f|t))$"
+)
+TTML_ORIGIN_RE = re.compile(r"^\s*([\d.]+)%\s+([\d.]+)%\s*$")
+TTML_ALIGNMENT = {"left": "start", "start": "start", "center": "center"}
+TTML_ALIGNMENT.update({"right": "end", "end": "end"})
+WHITESPACE_RE = re.compile(r"\s+")
+WEBVTT_TIMING_RE = re.compile(
+    r"^((?:\d+:)?\d{2}:\d{2}\.\d{3})([ \t]+-->[ \t]+)((?:\d+:)?\d{2}:\d{2}\.\d{3})"
+)
+SUBTITLE_CACHE_DIR = Path(get_cache_dir(), "subtitles")
+# Part of the digest of every conversion, to be bumped when a converter's output changes.
+CONVERSION_VERSION = 1
+# Sources are hashed, and cached results are read, in pieces of this size.
+CACHE_READ_SIZE = 64 * 1024
+SUBTITLE_FETCH_WORKERS = 4
+SUBTITLE_FETCH_TIMEOUT = 10
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def detect_encoding(prefix: bytes, final: bool = True) -> str:
+    """
+    Detect the encoding of a text file from its first bytes.
+
+    A BOM decides the encoding. Otherwise the file is taken to be utf-8 if the
+    prefix decodes as such, and iso-8859-15 if it doesn't.
+
+    :param final: Whether the prefix is the whole file. If not,
+                  it may end in the middle of a character.
+    """
+
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=final)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return "utf-8"
+
+
+def open_subtitles(filename: str) -> TextIO:
+    """
+    Open a local subtitles file as text, with its encoding detected
+    and its line endings (LF, CRLF or CR) translated to LF.
+    """
+
+    try:
+        with open(filename, "rb") as subsfile:
+            prefix = subsfile.read(ENCODING_SNIFF_SIZE)
+        # Only the prefix is checked, so a stray invalid byte further down
+        # shouldn't make the whole file unusable.
+        return open(
+            filename,
+            "r",
+            encoding=detect_encoding(prefix, len(prefix) < ENCODING_SNIFF_SIZE),
+            errors="replace",
+        )
+    except OSError:
+        raise SubtitlesError("Could not read subtitles file {}".format(filename))
+
+
+def read_chunks(filename: str) -> Iterator[bytes]:
+    try:
+        with open(filename, "rb") as subsfile:
+            yield from iter(lambda: subsfile.read(CACHE_READ_SIZE), b"")
+    except OSError:
+        raise SubtitlesError("Could not read subtitles file {}".format(filename))
+
+
+def conversion_digest(
+    source: Iterable[bytes], converter: Callable, options: str = ""
+) -> str:
+    """
+    Return a digest of the source of some subtitles and of the way they are converted,
+    under which the converted subtitles are kept in a SubtitleCache.
+
+    :param source: The source subtitles, in pieces.
+    :param converter: Function that converts the subtitles.
+    :param options: Any options of the conversion.
+    """
+
+    digest = hashlib.sha256(
+        "{}:{}:{}\n".format(CONVERSION_VERSION, converter.__name__, options).encode()
+    )
+    for chunk in source:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convert_with_cache(
+    cache: SubtitleCache,
+    digest: str,
+    converter: Callable[[Iterable[str]], Iterator[str]],
+    lines: Iterable[str],
+) -> Iterator[str]:
+    """
+    Take converted subtitles from the cache if they are there (they may have been
+    evicted since they were last looked up), or convert them and store the result.
+    """
+
+    cached = cache.get(digest)
+    try:
+        cached_file = cached.open(encoding="utf-8") if cached else None
+    except OSError:
+        cached_file = None
+    if cached_file:
+        with cached_file:
+            yield from iter(lambda: cached_file.read(CACHE_READ_SIZE), "")
+    else:
+        yield from cache.store(digest, converter(lines))
+
+
+def cached_converter(
+    cache: SubtitleCache, converter: Callable[[Iterable[str]], Iterator[str]]
+) -> Callable[[TextIO], Iterator[str]]:
+    """
+    Wrap a converter of in-memory subtitles, so that its results are taken from
+    the cache when they are there, and stored in it when they are not.
+    """
+
+    def convert(source: TextIO) -> Iterator[str]:
+        text = source.read()
+        digest = conversion_digest([text.encode()], converter)
+        return convert_with_cache(cache, digest, converter, io.StringIO(text))
+
+    return convert
+
+
+def convert_srt_to_webvtt(lines: Iterable[str]) -> Iterator[str]:
+    """Convert the lines of a SubRip file to WebVTT, one line at a time."""
+
+    yield "WEBVTT\n\n"
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if " --> " in line:
+            line = line.replace(",", ".")
+        yield line + "\n"
+
+
+@lru_cache(maxsize=256)
+def _local_name(tag: str) -> str:
+    # TTML comes with several namespaces (the current one, and those of DFXP drafts),
+    # so elements and attributes are matched by their local name.
+    return tag.rsplit("}", 1)[-1]
+
+
+def _local_attributes(elem: ElementTree.Element) -> Dict[str, str]:
+    return {_local_name(key): value for key, value in elem.attrib.items()}
+
+
+def _escape_cue_text(text: str) -> str:
+    text = WHITESPACE_RE.sub(" ", text)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def format_webvtt_time(seconds: float) -> str:
+    millis = int(round(max(seconds, 0) * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(hours, minutes, *divmod(millis, 1000))
+
+
+class TTMLConverter:
+    """
+    Converts TTML (and DFXP) subtitles to WebVTT as the document is parsed, one
+    paragraph at a time. Paragraphs are dropped from the tree once they are converted,
+    so memory use doesn't grow with the size of the document.
+
+    Timing (including that of enclosing divs, and frame and tick based times),
+    bold, italics and underline, and the position and alignment of regions are kept.
+    Other styling is dropped.
+    """
+
+    def __init__(self) -> None:
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))  # type: ignore
+        self._frame_rate = 30.0
+        self._tick_rate = 1.0
+        self._styles: Dict[str, Dict[str, str]] = {}
+        self._regions: Dict[str, Dict[str, str]] = {}
+        # The open elements, with the time offset and region they pass on to their content.
+        self._open: List[Tuple[ElementTree.Element, float, Optional[str]]] = []
+
+    def convert(self, source: Iterable[str]) -> Iterator[str]:
+        yield "WEBVTT\n\n"
+        read = getattr(source, "read", None)
+        chunks = iter(lambda: read(TTML_CHUNK_SIZE), "") if read else source
+        try:
+            for data in chunks:
+                self._parser.feed(data)
+                yield from self._read_cues()
+            self._parser.close()
+            yield from self._read_cues()
+        except ElementTree.ParseError:
+            # Everything up to the error has been sent already, which is the best we can do.
+            return
+
+    def parse_time(self, value: Optional[str]) -> Optional[float]:
+        match = TTML_TIME_RE.match(value.strip()) if value else None
+        if not match:
+            return None
+        hours, minutes, seconds, fraction, frames, count, metric = match.groups()
+        if count is None:
+            time_seconds = float(hours) * 3600 + int(minutes) * 60 + int(seconds)
+            if fraction:
+                time_seconds += float(fraction)
+            elif frames:
+                time_seconds += int(frames) / self._frame_rate
+            return time_seconds
+        divisors = {"h": 1 / 3600, "m": 1 / 60, "s": 1, "ms": 1000}
+        divisors.update({"f": self._frame_rate, "t": self._tick_rate})
+        return float(count) / divisors[metric]
+
+    def _read_cues(self) -> Iterator[str]:
+        for event, elem in self._parser.read_events():  # type: ignore
+            cue = self._handle_event(event, elem)  # type: ignore
+            if cue:
+                yield cue
+
+    def _handle_event(self, event: str, elem: ElementTree.Element) -> Optional[str]:
+        name = _local_name(elem.tag)
+        if event == "start":
+            self._start(name, elem)
+            return None
+
+        self._open.pop()
+        attributes = _local_attributes(elem)
+        if name == "style" and "id" in attributes:
+            self._styles[attributes["id"]] = self._style_of(elem)
+        elif name == "region" and "id" in attributes:
+            self._regions[attributes["id"]] = self._style_of(elem)
+        elif name == "p":
+            cue = self._cue(elem)
+            if self._open:
+                self._open[-1][0].remove(elem)
+            return cue
+        return None
+
+    def _start(self, name: str, elem: ElementTree.Element) -> None:
+        attributes = _local_attributes(elem)
+        offset, region = self._open[-1][1:] if self._open else (0.0, None)
+        if name == "tt":
+            self._frame_rate = float(attributes.get("frameRate") or self._frame_rate)
+            self._tick_rate = float(attributes.get("tickRate") or self._tick_rate)
+        elif name in ["body", "div"]:
+            offset += self.parse_time(attributes.get("begin")) or 0
+        self._open.append((elem, offset, attributes.get("region", region)))
+
+    def _style_of(self, elem: ElementTree.Element) -> Dict[str, str]:
+        """The styling attributes of an element, including those of the styles it refers to."""
+
+        style: Dict[str, str] = {}
+        inline_style: Dict[str, str] = {}
+        for key, value in elem.attrib.items():
+            if "#styling" in key:
+                inline_style[_local_name(key)] = value
+            elif key == "style":
+                for style_id in value.split():
+                    style.update(self._styles.get(style_id, {}))
+        style.update(inline_style)
+        return style
+
+    def _text(self, elem: ElementTree.Element) -> str:
+        """The text of an element as cue text, with its bold, italics and underline."""
+
+        style = self._style_of(elem)
+        tags = [
+            tag
+            for tag, enabled in [
+                ("b", style.get("fontWeight") == "bold"),
+                ("i", style.get("fontStyle") in ["italic", "oblique"]),
+                ("u", "underline" in style.get("textDecoration", "")),
+            ]
+            if enabled
+        ]
+        parts = ["<{}>".format(tag) for tag in tags]
+        parts.append(_escape_cue_text(elem.text or ""))
+        for child in elem:
+            parts.append("\n" if _local_name(child.tag) == "br" else self._text(child))
+            parts.append(_escape_cue_text(child.tail or ""))
+        parts.extend("</{}>".format(tag) for tag in reversed(tags))
+        return "".join(parts)
+
+    def _cue(self, elem: ElementTree.Element) -> Optional[str]:
+        attributes = _local_attributes(elem)
+        offset, region = self._open[-1][1:] if self._open else (0.0, None)
+        begin = self.parse_time(attributes.get("begin"))
+        end = self.parse_time(attributes.get("end"))
+        duration = self.parse_time(attributes.get("dur"))
+        if begin is None or (end is None and duration is None):
+            return None
+        end = end if end is not None else begin + duration  # type: ignore
+
+        lines = [line.strip() for line in self._text(elem).split("\n")]
+        text = "\n".join(line for line in lines if line)
+        if not text:
+            return None
+
+        return "{} --> {}{}\n{}\n\n".format(
+            format_webvtt_time(offset + begin),
+            format_webvtt_time(offset + end),
+            self._cue_settings(attributes.get("region", region), elem),
+            text,
+        )
+
+    def _cue_settings(self, region_id: Optional[str], elem) -> str:
+        style = dict(self._regions.get(region_id, {})) if region_id else {}
+        style.update(self._style_of(elem))
+        settings = []
+        origin = TTML_ORIGIN_RE.match(style.get("origin", ""))
+        if origin:
+            settings.append("position:{}%".format(origin.group(1)))
+            settings.append("line:{}%".format(origin.group(2)))
+        elif style.get("displayAlign") == "before":
+            settings.append("line:0")
+        if style.get("textAlign") in TTML_ALIGNMENT:
+            settings.append("align:{}".format(TTML_ALIGNMENT[style["textAlign"]]))
+        return "".join(" " + setting for setting in settings)
+
+
+def convert_ttml_to_webvtt(lines: Iterable[str]) -> Iterator[str]:
+    """Convert a TTML (or DFXP) document to WebVTT, as it is read."""
+
+    return TTMLConverter().convert(lines)
+
+
+def parse_webvtt_time(value: str) -> float:
+    *hours, minutes, seconds = value.split(":")
+    return int(hours[0] if hours else 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class SubtitleTiming(NamedTuple):
+    """
+    A correction of the timing of subtitles: every timestamp is multiplied by rate
+    (to make up for a different frame rate), and then shifted by offset seconds.
+
+    Subtitles served by catt carry their timing in the query of their url,
+    so it can be changed by loading them again under another url.
+    """
+
+    offset: float = 0.0
+    rate: float = 1.0
+
+    @classmethod
+    def from_params(cls, params: Dict[str, str]) -> "SubtitleTiming":
+        try:
+            timing = cls(float(params.get("offset", 0)), float(params.get("rate", 1)))
+        except ValueError:
+            return cls()
+        return timing if timing.rate > 0 else cls()
+
+    @property
+    def query(self) -> str:
+        return urlencode({"offset": str(self.offset), "rate": str(self.rate)})
+
+    def apply(self, seconds: float) -> float:
+        return seconds * self.rate + self.offset
+
+
+def retime_webvtt(pieces: Iterable[str], timing: SubtitleTiming) -> Iterator[str]:
+    """
+    Rewrite the cue timings of WebVTT subtitles (which may come in pieces of any size)
+    in one pass. Cues that would end before the start of the media are dropped,
+    identifier and all, so each block is held back until its blank line is seen.
+    """
+
+    def retime(line: str) -> Tuple[str, bool]:
+        match = WEBVTT_TIMING_RE.match(line) if "-->" in line else None
+        if not match:
+            return line, False
+        start = timing.apply(parse_webvtt_time(match.group(1)))
+        end = timing.apply(parse_webvtt_time(match.group(3)))
+        retimed = "".join(
+            [
+                format_webvtt_time(start),
+                match.group(2),
+                format_webvtt_time(end),
+                line[match.end() :],
+            ]
+        )
+        return retimed, end <= 0
+
+    pending = ""
+    block: List[str] = []
+    dropping = False
+    for piece in pieces:
+        *lines, pending = (pending + piece).split("\n")
+        result = []
+        for line in lines:
+            line, ends_before_start = retime(line)
+            dropping = dropping or ends_before_start
+            block.append(line + "\n")
+            if not line.strip():
+                if not dropping:
+                    result.extend(block)
+                block, dropping = [], False
+        if result:
+            yield "".join(result)
+    if pending:
+        line, ends_before_start = retime(pending)
+        block.append(line)
+        dropping = dropping or ends_before_start
+    if block and not dropping:
+        yield "".join(block)
+
+
+def retime_subtitles(pieces: Iterator[str], params: Dict[str, str]) -> Iterator[str]:
+    """Apply the timing in the query parameters of a request to served subtitles."""
+
+    timing = SubtitleTiming.from_params(params)
+    return pieces if timing == SubtitleTiming() else retime_webvtt(pieces, timing)
+
+
+# Converters to WebVTT, by the MIME type of the subtitles they convert.
+CONVERTERS = {
+    "application/x-subrip": convert_srt_to_webvtt,
+    "application/ttml+xml": convert_ttml_to_webvtt,
+}
+
 
 class SubsInfo:
     """
     This class facilitates fetching/reading a remote/local subtitles file,
-    converting it to webvtt if needed, and then exposing a path to a tempfile
-    holding the subtitles, ready to be served.
+    and serving it (converted to webvtt if needed) from a MediaServer.
     An url to the (expected to be) served file is also exposed.
 
     This class accepts the following input:
@@ -23,39 +472,55 @@ class SubsInfo:
 
     Three variables are defined after the subtitles file is retrieved:
         - mimetype: a string with the MIME type of the subtitles.
-        - local_subs: a Boolean that is True if the subtitles file is in this
-          computer, False otherwise.
+        - local_subs: a Boolean that is True if the subtitles need to be served
+          from this computer, False otherwise.
         - file: a variable representing the subtitles file itself.
 
-    For local subtitle files, _read_subs() returns a blank MIME type.
-    local_subs is then set to True, and the MIME type is inferred from the file
-    extension. Then, after checking the value of local_subs, CATT will start a
-    web server in this computer so that ChromeCast can fetch the subtitles.
+    For local subtitle files, the MIME type is inferred from the file extension.
+    Then, after checking the value of local_subs, CATT will start a web server
+    in this computer so that ChromeCast can fetch the subtitles.
     Only devices in the same network can access this file.
 
-    Subtitle files in SubRip format (.SRT application/x-subrip) will be
-    converted locally to WebVTT format. This converted file will be served to
-    the ChromeCast, and treated like any local file.
+    Subtitle files in SubRip format (.SRT application/x-subrip) are converted
+    to WebVTT format while they are served, one line at a time, so that neither
+    the file nor the converted result is ever held in memory as a whole.
+
+    With a SubtitleCache, converted subtitles are kept, and served as they are
+    whenever the same subtitles are cast again.
+
+    Subtitles that are served locally can have their timing corrected (see
+    SubtitleTiming), which makes even remote WebVTT subtitles be served locally.
 
     If the subtitle file is remote and doesn't need to be converted, subs_url
     will be the original url, local_subs will be False, and the MIME type will
     be retrieved directly from the web server.
     """
 
-    def __init__(self, subs_url: str, local_ip: str, port: int) -> None:
+    def __init__(
+        self,
+        subs_url: str,
+        local_ip: str,
+        port: int,
+        cache: Optional[SubtitleCache] = None,
+        timing: Optional[SubtitleTiming] = None,
+    ) -> None:
         self._subs_url = subs_url
+        self._cache = cache
+        self.timing = timing or SubtitleTiming()
         self.local_ip = local_ip
         self.port = port
-        subs, self.mimetype = self._read_subs(subs_url)
-        if self.mimetype == "":
-            self.local_subs = True
-            self.mimetype = guess_mime(subs_url)
-        else:
+        self._remote_text: Optional[str] = None
+        if "://" in subs_url:
+            self._remote_text, self.mimetype = self._fetch_remote_subs(subs_url)
             self.local_subs = False
+        else:
+            self.mimetype = guess_mime(subs_url)
+            self.local_subs = True
         self.file = self._subs_url
-        if "application/x-subrip" in self.mimetype:
-            subs = self._convert_srt_to_webvtt(subs)
-            self.file = create_temp_file(subs)
+        self._converter: Optional[Callable[[Iterable[str]], Iterator[str]]] = next(
+            (conv for mime, conv in CONVERTERS.items() if mime in self.mimetype), None
+        )
+        if self._converter or self.timing != SubtitleTiming():
             self.local_subs = True
 
     @property
@@ -65,43 +530,123 @@ class SubsInfo:
         else:
             return self._subs_url
 
-    def _read_subs(self, subs_url: str) -> tuple[str, str]:
+    def serve(self, server) -> str:
         """
-        Returns:
-            - a str with the url where have ChromeCast will fetch the file from
-            - a bool that is True if the file will be pulled from a web server on
-            this computer, and False otherwise
+        Serve the subtitles from a MediaServer (converting them on the fly, if needed),
+        and return the url they are served under. The url carries their timing.
         """
-        if "://" in subs_url:
-            return self._fetch_remote_subs(subs_url)
-        else:
-            return self._read_local_subs(subs_url)
-
-    def _convert_srt_to_webvtt(self, content: str) -> str:
-        content = re.sub(
-            r"^(.*? \-\-\> .*?)$",
-            lambda m: m.group(1).replace(",", "."),
-            content,
-            flags=re.MULTILINE,
-        )
-        return "WEBVTT\n\n" + content
-
-    def _read_local_subs(self, filename: str) -> tuple[str, str]:
-        for possible_encoding in ["utf-8", "iso-8859-15"]:
-            try:
-                with open(filename, "r", encoding=possible_encoding) as srtfile:
-                    content = srtfile.read()
-                    return content, ""
-            except UnicodeDecodeError:
-                pass
-        raise SubtitlesError(
-            "Could not find the proper encoding of {}. Please convert it to utf-8".format(
-                filename
-            )
+
+        converter = self._converter
+        cache = self._cache
+        name = Path(urlparse(self._subs_url).path).stem + ".vtt"
+        text = self._remote_text
+
+        def open_text() -> TextIO:
+            return io.StringIO(text or "")
+
+        def open_file() -> TextIO:
+            return open_subtitles(self.file)
+
+        def convert(lines: Iterable[str]) -> Iterator[str]:
+            if not converter:
+                return iter(lines)
+            if not cache:
+                return converter(lines)
+            # The cache is consulted on every request.
+            return convert_with_cache(cache, digest, converter, lines)
+
+        if converter and cache:
+            source = [text.encode()] if text is not None else read_chunks(self.file)
+            digest = conversion_digest(source, converter)
+        url = server.add_converted(
+            open_text if text is not None else open_file,
+            convert,
+            "text/vtt",
+            name,
+            adjust=retime_subtitles,
         )
+        return "{}?{}".format(url, self.timing.query)
 
     def _fetch_remote_subs(self, url: str) -> tuple[str, str]:
         response = requests.get(url)
         if not response:
             raise SubtitlesError("Remote subtitles file not found")
         return response.text, response.headers["content-type"]
+
+
+class SubtitleFetcher:
+    """
+    Fetches remote subtitle files over one pooled HTTP session, in a bounded number
+    of threads, and keeps the results by url, so each file is only fetched once.
+
+    :param workers: Maximum number of files that are fetched at the same time.
+    :type workers: int
+    """
+
+    def __init__(self, workers: int = SUBTITLE_FETCH_WORKERS) -> None:
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="catt-subs"
+        )
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+
+    def fetch(self, url: str) -> Future:
+        """Start fetching a file (if that hasn't been done yet), return a future for its text."""
+
+        with self._lock:
+            if url not in self._futures:
+                self._futures[url] = self._executor.submit(self._get, url)
+            return self._futures[url]
+
+    def open(self, url: str) -> TextIO:
+        try:
+            return io.StringIO(self.fetch(url).result())
+        except requests.RequestException:
+            raise SubtitlesError("Remote subtitles file could not be fetched")
+
+    def _get(self, url: str) -> str:
+        response = self._session.get(url, timeout=SUBTITLE_FETCH_TIMEOUT)
+        response.raise_for_status()
+        return response.text
+
+
+def serve_subtitle_tracks(
+    server,
+    tracks: List[dict],
+    fetcher: Optional[SubtitleFetcher] = None,
+    cache: Optional[SubtitleCache] = None,
+    timing: Optional[SubtitleTiming] = None,
+) -> List[dict]:
+    """
+    Serve remote subtitle tracks (as found by StreamInfo) converted to WebVTT,
+    and return the tracks, pointing at where they are served.
+
+    The files are fetched in the background right away, and converted whenever the
+    device requests them, so this doesn't hold up the start of playback.
+    With a SubtitleCache, earlier conversions of the same files are reused.
+    The tracks are served with the given timing.
+    """
+
+    fetcher = fetcher or SubtitleFetcher()
+    timing = timing or SubtitleTiming()
+    served_tracks = []
+    for track in tracks:
+        url = track["trackContentId"]
+        fetcher.fetch(url)
+        converter = CONVERTERS[track["trackContentType"]]
+        served_url = server.add_converted(
+            lambda url=url: fetcher.open(url),
+            cached_converter(cache, converter) if cache else converter,
+            "text/vtt",
+            "{}.vtt".format(track["language"]),
+            adjust=retime_subtitles,
+        )
+        served_tracks.append(
+            {
+                **track,
+                "trackContentId": "{}?{}".format(served_url, timing.query),
+                "trackContentType": "text/vtt",
+            }
+        )
+    return served_tracks
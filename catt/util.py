@@ -1,14 +1,67 @@
+import glob
 import ipaddress
 import json
+import os
+import re
 import socket
-import tempfile
+import sys
+import threading
 import time
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
 
 import click
 import ifaddr
 
 
+class CattStore:
+    def __init__(self, store_path):
+        self.store_path = store_path
+
+    def _create_store_dir(self):
+        try:
+            self.store_path.parent.mkdir()
+        except FileExistsError:
+            pass
+
+    def _read_store(self):
+        with self.store_path.open() as store:
+            return json.load(store)
+
+    def _write_store(self, data):
+        with self.store_path.open("w") as store:
+            json.dump(data, store)
+
+    def get_data(self, *args):
+        raise NotImplementedError
+
+    def set_data(self, *args) -> None:
+        raise NotImplementedError
+
+    def clear(self):
+        try:
+            self.store_path.unlink()
+            self.store_path.parent.rmdir()
+        except FileNotFoundError:
+            pass
+
+
+def get_cache_dir() -> Path:
+    """Return the platform's conventional directory for catt's cached data."""
+
+    if sys.platform == "win32":
+        return Path(os.environ.get("LOCALAPPDATA") or Path.home(), "catt", "Cache")
+    elif sys.platform == "darwin":
+        return Path(Path.home(), "Library", "Caches", "catt")
+    else:
+        return Path(
+            os.environ.get("XDG_CACHE_HOME") or Path(Path.home(), ".cache"), "catt"
+        )
+
+
 def echo_warning(msg):
     click.secho("Warning: ", fg="red", nl=False, err=True)
     click.echo("{}.".format(msg), err=True)
@@ -54,54 +107,131 @@ def echo_status(status):
     click.echo("Volume muted: {}".format(status["volume_muted"]))
 
 
+# source: https://developers.google.com/cast/docs/media
+MIME_TYPES = {
+    ".aac": "audio/aac",
+    ".flac": "audio/flac",
+    ".m4a": "audio/mp4",
+    ".mp3": "audio/mp3",
+    ".mpa": "audio/mpeg",
+    ".mp4": "video/mp4",
+    ".oga": "audio/ogg",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".wav": "audio/wav",
+    ".webm": "video/webm",
+    ".mkv": "video/x-matroska",
+    ".bmp": "image/bmp",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".png": "image/png",
+    ".webp": "image/web",
+    ".srt": "application/x-subrip",
+    ".ttml": "application/ttml+xml",
+    ".dfxp": "application/ttml+xml",
+    ".vtt": "text/vtt",
+}
+SUBTITLE_EXTENSIONS = (".vtt", ".srt", ".ttml", ".dfxp")
+GLOB_CHARS_RE = re.compile(r"[*?[]")
+NUMBERS_RE = re.compile(r"(\d+)")
+
+
 def guess_mime(path):
-    # source: https://developers.google.com/cast/docs/media
     extension = Path(path).suffix.lower()
-    extensions = {
-        ".aac": "audio/aac",
-        ".flac": "audio/flac",
-        ".m4a": "audio/mp4",
-        ".mp3": "audio/mp3",
-        ".mpa": "audio/mpeg",
-        ".mp4": "video/mp4",
-        ".oga": "audio/ogg",
-        ".ogg": "audio/ogg",
-        ".opus": "audio/ogg",
-        ".wav": "audio/wav",
-        ".webm": "video/webm",
-        ".mkv": "video/x-matroska",
-        ".bmp": "image/bmp",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".gif": "image/gif",
-        ".png": "image/png",
-        ".webp": "image/web",
-        ".srt": "application/x-subrip",
-        ".ttml": "application/ttml+xml",
-        ".vtt": "text/vtt",
-    }
-    return extensions.get(extension, "video/mp4")
+    return MIME_TYPES.get(extension, "video/mp4")
+
+
+def is_playable_media(path: Path) -> bool:
+    """Whether a file is audio or video that can be played (as opposed to eg. an image)."""
+
+    mime = MIME_TYPES.get(path.suffix.lower(), "")
+    return mime.startswith(("audio/", "video/"))
+
+
+def natural_sort_key(path: Path) -> list:
+    """Sort key that puts "Episode 2" before "Episode 10"."""
+
+    return [
+        int(part) if part.isdigit() else part.lower()
+        for part in NUMBERS_RE.split(str(path))
+    ]
+
+
+def find_media_files(path_or_pattern: str) -> List[Path]:
+    """
+    Return the audio and video files in a directory, or matching a glob pattern,
+    in natural sort order.
+    """
+
+    if Path(path_or_pattern).is_dir():
+        candidates = list(Path(path_or_pattern).iterdir())
+    elif GLOB_CHARS_RE.search(path_or_pattern):
+        candidates = [Path(match) for match in glob.glob(path_or_pattern)]
+    else:
+        return []
+    return sorted(
+        (path for path in candidates if path.is_file() and is_playable_media(path)),
+        key=natural_sort_key,
+    )
+
+
+class SubtitleIndex:
+    """
+    The subtitle files found next to local media files, where each directory
+    is only listed once, no matter how many media files are looked up in it.
+    """
+
+    def __init__(self) -> None:
+        self._directories: Dict[Path, List[Path]] = {}
+
+    def _subtitle_files(self, directory: Path) -> List[Path]:
+        if directory not in self._directories:
+            self._directories[directory] = sorted(
+                entry_path
+                for entry_path in directory.iterdir()
+                if entry_path.suffix.lower() in SUBTITLE_EXTENSIONS
+                and not entry_path.is_dir()
+            )
+        return self._directories[directory]
+
+    def find(self, video) -> Optional[str]:
+        """Return the subtitles whose name starts with the name of the video, if any."""
+
+        video_path = Path(video)
+        video_path_stem_lower = video_path.stem.lower()
+        for entry_path in self._subtitle_files(video_path.parent):
+            if entry_path.stem.lower().startswith(video_path_stem_lower):
+                return str(entry_path.resolve())
+        return None
 
 
 def hunt_subtitles(video):
     """Searches for subtitles in the current folder"""
 
-    video_path = Path(video)
-    video_path_stem_lower = video_path.stem.lower()
-    for entry_path in video_path.parent.iterdir():
-        if entry_path.is_dir():
-            continue
-        if entry_path.stem.lower().startswith(
-            video_path_stem_lower
-        ) and entry_path.suffix.lower() in [".vtt", ".srt", ".ttml"]:
-            return str(entry_path.resolve())
-    return None
-
-
-def create_temp_file(content):
-    with tempfile.NamedTemporaryFile(mode="w+b", suffix=".vtt", delete=False) as tfile:
-        tfile.write(content.encode())
-        return tfile.name
+    return SubtitleIndex().find(video)
+
+
+def run_in_thread(func, *args, **kwargs) -> Future:
+    """
+    Run a function in a daemon thread, and return a future for its result.
+
+    Unlike with an executor, an exiting process does not wait for the thread,
+    so work that turns out to be unneeded (because of an error elsewhere) can be abandoned.
+    """
+
+    future: Future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
 
 
 def human_time(seconds: int):
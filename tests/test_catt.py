@@ -1,20 +1,73 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import concurrent.futures
+import http.client
+import io
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlsplit
 
 import click
 import click.testing
+import pychromecast
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
 from yt_dlp.utils import DownloadError
 
+from catt.cache import FileCache
+from catt.cache import SubtitleCache
+from catt.cli import cli
 from catt.cli import YTDL_OPT
+from catt.controllers import DefaultCastController
+from catt.controllers import get_app
+from catt.controllers import looks_like_youtube
+from catt.controllers import make_queue_item
+from catt.controllers import make_subtitle_track
+from catt.controllers import MediaControllerMixin
+from catt.controllers import MediaQueueMixin
 from catt.controllers import MediaStatusListener
 from catt.controllers import PlaybackBaseMixin
+from catt.controllers import setup_cast
 from catt.controllers import SimpleListener
+from catt.controllers import YoutubeCastController
+from catt.daemon import CattDaemon
+from catt.daemon import get_command_name
+from catt.daemon import run_in_daemon
+from catt.discovery import CastPool
+from catt.discovery import connect_cast
+from catt.discovery import DeviceCache
 from catt.error import CastError
+from catt.faststart import get_faststart_layout
+from catt.faststart import read_boxes
+from catt.http_server import copy_byte_range
+from catt.http_server import MediaServer
+from catt.http_server import parse_byte_range
+from catt.http_server import send_byte_range
+from catt.stream_info import EntryPrefetcher
+from catt.stream_info import get_url_expiry
+from catt.stream_info import PlaylistEntries
 from catt.stream_info import StreamInfo
+from catt.subs_info import convert_srt_to_webvtt
+from catt.subs_info import convert_ttml_to_webvtt
+from catt.subs_info import detect_encoding
+from catt.subs_info import open_subtitles
+from catt.subs_info import retime_webvtt
+from catt.subs_info import serve_subtitle_tracks
+from catt.subs_info import SubsInfo
+from catt.subs_info import SubtitleTiming
+from catt.util import find_media_files
 from catt.util import guess_mime
+from catt.util import SubtitleIndex
 
 
 def ignore_tmr_failure(func):
@@ -103,6 +156,211 @@ class TestGuessMime(unittest.TestCase):
         self.assertEqual(guess_mime("movie.mp4"), "video/mp4")
 
 
+class TestSubtitleConversion(unittest.TestCase):
+    def test_detect_encoding(self):
+        self.assertEqual(detect_encoding(b"\xef\xbb\xbf1\n"), "utf-8-sig")
+        self.assertEqual(detect_encoding(b"\xff\xfe1\x00"), "utf-16")
+        self.assertEqual(detect_encoding("Café".encode()), "utf-8")
+        # A prefix that ends in the middle of a character is still utf-8.
+        self.assertEqual(detect_encoding("Café".encode()[:-1], final=False), "utf-8")
+        self.assertEqual(detect_encoding("Café".encode("latin-1")), "iso-8859-15")
+
+    def test_bom_and_crlf(self):
+        with tempfile.NamedTemporaryFile(suffix=".srt") as tfile:
+            tfile.write(b"\xef\xbb\xbf1\r\n00:00:01,000 --> 00:00:02,000\r\nHi\r\n")
+            tfile.flush()
+            with open_subtitles(tfile.name) as subsfile:
+                result = "".join(convert_srt_to_webvtt(subsfile))
+        self.assertEqual(result, "WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.000\nHi\n")
+
+    def test_lines_are_converted_lazily(self):
+        lines = ("{}\n".format(i) for i in range(10**9))
+        converted = convert_srt_to_webvtt(lines)
+        self.assertEqual(
+            [next(converted) for _ in range(3)], ["WEBVTT\n\n", "0\n", "1\n"]
+        )
+
+    def test_ttml_timing_styles_and_position(self):
+        ttml = (
+            '<tt xmlns="http://www.w3.org/ns/ttml" ttp:tickRate="10000000"'
+            ' xmlns:tts="http://www.w3.org/ns/ttml#styling"'
+            ' xmlns:ttp="http://www.w3.org/ns/ttml#parameter">'
+            '<head><styling><style xml:id="it" tts:fontStyle="italic"/></styling>'
+            '<layout><region xml:id="top" tts:origin="10% 5%" tts:textAlign="center"/>'
+            "</layout></head>"
+            '<body><div begin="00:00:10.000">'
+            '<p begin="0s" end="20000000t" region="top">Hi <span style="it">you</span>'
+            '<br/>&amp; <span tts:fontWeight="bold">me</span></p>'
+            '<p begin="00:00:02:15" dur="1.5s" style="it">Bye</p>'
+            "</div></body></tt>"
+        )
+        # Fed in tiny pieces, as a large document would be.
+        pieces = [ttml[i : i + 7] for i in range(0, len(ttml), 7)]
+        self.assertEqual(
+            "".join(convert_ttml_to_webvtt(pieces)),
+            "WEBVTT\n\n"
+            "00:00:10.000 --> 00:00:12.000 position:10% line:5% align:center\n"
+            "Hi <i>you</i>\n&amp; <b>me</b>\n\n"
+            "00:00:12.500 --> 00:00:14.000\n<i>Bye</i>\n\n",
+        )
+
+
+class TestSubtitleTiming(unittest.TestCase):
+    def test_timestamps_are_rewritten_across_pieces(self):
+        vtt = (
+            "WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.000 line:0\nGone\n\n"
+            "2\n01:00.000 --> 01:02.000\nKept\n"
+        )
+        pieces = [vtt[i : i + 5] for i in range(0, len(vtt), 5)]
+        self.assertEqual(
+            "".join(retime_webvtt(pieces, SubtitleTiming(offset=-5, rate=2))),
+            # The first cue would end before the start, so it is dropped.
+            "WEBVTT\n\n2\n00:01:55.000 --> 00:01:59.000\nKept\n",
+        )
+
+    def test_dropped_cues_leave_nothing_behind(self):
+        srt = "".join(
+            "{}\n00:00:0{},000 --> 00:00:0{},500\nCue {}\n\n".format(n, n, n, n)
+            for n in range(1, 4)
+        )
+        vtt = convert_srt_to_webvtt(io.StringIO(srt))
+        self.assertEqual(
+            "".join(retime_webvtt(vtt, SubtitleTiming(offset=-2.5))),
+            "WEBVTT\n\n3\n00:00:00.500 --> 00:00:01.000\nCue 3\n\n",
+        )
+
+    def test_timing_from_params(self):
+        self.assertEqual(
+            SubtitleTiming.from_params({"offset": "-1.5", "rate": "2"}),
+            SubtitleTiming(-1.5, 2),
+        )
+        self.assertEqual(SubtitleTiming.from_params({"rate": "0"}), SubtitleTiming())
+        self.assertEqual(SubtitleTiming.from_params({"offset": "x"}), SubtitleTiming())
+
+
+class _RetimeStatus:
+    content_id = "http://192.168.1.2:8000/abc/video.mp4?loaded_from_catt"
+    content_type = "video/mp4"
+    stream_type = "BUFFERED"
+    media_metadata = {"title": "Video"}
+    adjusted_current_time = 42.0
+    player_state = "PLAYING"
+    current_subtitle_tracks = [1]
+    subtitle_tracks = [
+        {
+            "trackId": 1,
+            "type": "TEXT",
+            "trackContentId": "http://192.168.1.2:8000/def/video.vtt?offset=0.0&rate=2.0",
+        },
+        {"trackId": 2, "type": "TEXT", "trackContentId": "http://example.com/en.vtt"},
+    ]
+
+
+class _RetimeStub(MediaControllerMixin):
+    def __init__(self):
+        self._cast = _FakeCast()
+        self._cast.media_controller = mock.Mock(status=_RetimeStatus())
+
+
+class TestRetimeSubtitles(unittest.TestCase):
+    def test_media_is_reloaded_with_retimed_tracks(self):
+        stub = _RetimeStub()
+        stub.retime_subtitles(offset=-2)
+        ((msg,), kwargs) = stub._cast.media_controller.send_message.call_args
+        self.assertEqual(msg["type"], "LOAD")
+        self.assertEqual(msg["currentTime"], 42.0)
+        self.assertEqual(msg["activeTrackIds"], [1])
+        self.assertEqual(msg["media"]["contentId"], _RetimeStatus.content_id)
+        served, remote = msg["media"]["tracks"]
+        # The rate that wasn't given is kept.
+        self.assertEqual(
+            served["trackContentId"],
+            "http://192.168.1.2:8000/def/video.vtt?offset=-2&rate=2.0",
+        )
+        self.assertEqual(remote["trackContentId"], "http://example.com/en.vtt")
+
+    def test_subtitles_not_served_by_catt_cannot_be_retimed(self):
+        stub = _RetimeStub()
+        stub._cast.media_controller.status.subtitle_tracks = []
+        with self.assertRaises(CastError):
+            stub.retime_subtitles(offset=1)
+
+
+class TestSubtitleTracks(unittest.TestCase):
+    def test_first_added_track_is_shown_once_loaded(self):
+        controller = DefaultCastController.__new__(DefaultCastController)
+        controller._controller = mock.Mock()
+        controller._controller.play_media.side_effect = lambda *args, **kwargs: kwargs[
+            "callback_function"
+        ](True, {})
+        youtube_track = {"trackId": 1, "type": "TEXT", "trackContentId": "en.vtt"}
+        controller.play_media_url(
+            "http://example.com/video.mp4",
+            media_info={"tracks": [youtube_track]},
+            subtitle_tracks=[
+                make_subtitle_track(2, "http://example.com/first.vtt"),
+                make_subtitle_track(3, "http://example.com/second.vtt"),
+            ],
+        )
+        media_info = controller._controller.play_media.call_args[1]["media_info"]
+        self.assertEqual([t["trackId"] for t in media_info["tracks"]], [1, 2, 3])
+        controller._controller.enable_subtitle.assert_called_once_with(2)
+
+
+class TestLocalMediaFiles(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dir = Path(tmpdir.name)
+        for name in ["ep10.mp4", "ep2.mp4", "ep2.srt", "cover.jpg", "notes.txt"]:
+            Path(self.dir, name).touch()
+
+    def test_directory_in_natural_order(self):
+        files = find_media_files(str(self.dir))
+        self.assertEqual([f.name for f in files], ["ep2.mp4", "ep10.mp4"])
+
+    def test_glob(self):
+        files = find_media_files(str(Path(self.dir, "ep1*")))
+        self.assertEqual([f.name for f in files], ["ep10.mp4"])
+        self.assertEqual(find_media_files(str(Path(self.dir, "missing.mp4"))), [])
+
+    def test_subtitle_index_lists_directory_once(self):
+        index = SubtitleIndex()
+        with mock.patch.object(
+            Path, "iterdir", autospec=True, side_effect=Path.iterdir
+        ) as iterdir:
+            self.assertEqual(
+                Path(index.find(Path(self.dir, "ep2.mp4"))).name, "ep2.srt"
+            )
+            self.assertIsNone(index.find(Path(self.dir, "ep10.mp4")))
+        self.assertEqual(iterdir.call_count, 1)
+
+
+class TestCast(unittest.TestCase):
+    def test_interrupted_cast_leaves_nothing_behind(self):
+        stream = mock.Mock(
+            is_local_file=True,
+            local_ip="127.0.0.1",
+            port=0,
+            guessed_content_type="video/mp4",
+            guessed_content_category="video",
+            media_info=None,
+            converted_subtitle_tracks=[],
+        )
+        cst = mock.Mock(info_type="url")
+        cst.play_media_url.side_effect = KeyboardInterrupt
+        spools = set(Path(tempfile.gettempdir()).glob("catt-*"))
+        with mock.patch("catt.cli.setup_cast", return_value=(cst, stream)):
+            result = click.testing.CliRunner().invoke(
+                cli,
+                ["cast", "--follow", "-"],
+                input=b"video",
+                obj={"options": {}, "aliases": {}},
+            )
+        self.assertEqual(result.exit_code, 1)
+        self.assertEqual(set(Path(tempfile.gettempdir()).glob("catt-*")), spools)
+
+
 class TestYtdlOpt(unittest.TestCase):
     def _convert(self, value):
         """Helper to call YTDL_OPT.convert with minimal context."""
@@ -219,6 +477,905 @@ class TestLoadMediaFailed(unittest.TestCase):
             self.assertIn("error code 7", str(ctx.exception))
 
 
+class _FakeQueueStatus:
+    content_id = None
+    player_state = "IDLE"
+    idle_reason = None
+    media_session_id = 1
+
+
+class _FakeQueueMediaController:
+    """Plays queued items one after another, once they are queued."""
+
+    def __init__(self):
+        self.status = _FakeQueueStatus()
+        self.messages = []
+        self.device_items = []
+        self._listener = None
+
+    def register_status_listener(self, listener):
+        self._listener = listener
+
+    def send_message(self, msg, inc_session_id=False, callback_function=None):
+        self.messages.append(msg)
+        self.device_items.extend(item["media"]["contentId"] for item in msg["items"])
+        callback_function(True, {})
+
+    def _set_status(self, content_id, player_state, idle_reason=None):
+        self.status.content_id = content_id
+        self.status.player_state = player_state
+        self.status.idle_reason = idle_reason
+        self._listener.new_media_status(self.status)
+
+    def play(self, count):
+        for index in range(count):
+            while len(self.device_items) <= index:
+                time.sleep(0.01)
+            self._set_status(self.device_items[index], "PLAYING")
+            time.sleep(0.01)
+        self._set_status(self.device_items[-1], "IDLE", "FINISHED")
+
+
+class _QueueStub(MediaQueueMixin):
+    def __init__(self):
+        self._cast = _FakeCast()
+        self._cast.media_controller = _FakeQueueMediaController()
+
+
+class TestMediaQueue(unittest.TestCase):
+    def setUp(self):
+        self.taken = 0
+
+    def _items(self, count):
+        for index in range(count):
+            self.taken += 1
+            yield make_queue_item("http://example.com/{}.mp4".format(index))
+
+    def test_queue_is_topped_up(self):
+        stub = _QueueStub()
+        mc = stub._cast.media_controller
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            future = executor.submit(stub.play_queue, self._items(5), 1)
+            while not mc.messages:
+                time.sleep(0.01)
+            # Only the first item and the one after it are queued at first.
+            self.assertEqual(self.taken, 2)
+            executor.submit(mc.play, 5)
+            future.result(timeout=5)
+
+        self.assertEqual(mc.messages[0]["type"], "QUEUE_LOAD")
+        self.assertEqual(len(mc.messages[0]["items"]), 2)
+        self.assertTrue(all(m["type"] == "QUEUE_INSERT" for m in mc.messages[1:]))
+        self.assertEqual(
+            mc.device_items, ["http://example.com/{}.mp4".format(i) for i in range(5)]
+        )
+
+    def test_stopped_playback_ends_queue(self):
+        stub = _QueueStub()
+        mc = stub._cast.media_controller
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            future = executor.submit(stub.play_queue, self._items(5), 1)
+            while not mc.messages:
+                time.sleep(0.01)
+            mc._set_status(mc.device_items[0], "PLAYING")
+            mc._set_status(mc.device_items[0], "IDLE", "CANCELLED")
+            future.result(timeout=5)
+        self.assertLess(self.taken, 5)
+
+    def test_queue_item(self):
+        item = make_queue_item(
+            "http://example.com/a.mp4", title="A", subtitles="http://example.com/a.vtt"
+        )
+        self.assertEqual(item["media"]["metadata"]["title"], "A")
+        self.assertEqual(item["activeTrackIds"], [1])
+        self.assertGreater(item["preloadTime"], 0)
+
+
+class TestLooksLikeYoutube(unittest.TestCase):
+    def test_youtube_urls(self):
+        self.assertTrue(looks_like_youtube("https://www.youtube.com/watch?v=abc"))
+        self.assertTrue(looks_like_youtube("https://youtu.be/abc"))
+        self.assertTrue(looks_like_youtube("https://music.youtube.com/watch?v=abc"))
+
+    def test_other_urls(self):
+        self.assertFalse(looks_like_youtube("https://vimeo.com/123"))
+        self.assertFalse(looks_like_youtube("https://notyoutube.com/watch?v=abc"))
+        self.assertFalse(looks_like_youtube("./video.mp4"))
+
+
+class TestSetupCast(unittest.TestCase):
+    def _setup_cast(self, app_id):
+        cast = mock.Mock(cast_type="cast", app_id=app_id)
+        with (
+            mock.patch("catt.controllers.get_cast", return_value=cast),
+            mock.patch("catt.stream_info.StreamInfo"),
+            mock.patch("catt.controllers.get_controller"),
+            mock.patch("catt.controllers.launch_app") as launch_app,
+        ):
+            setup_cast("tv", video_url="https://youtu.be/abc", prep="app")
+        return launch_app
+
+    def test_likely_app_is_launched_on_idle_devices(self):
+        self.assertTrue(self._setup_cast(None).called)
+        self.assertTrue(self._setup_cast(pychromecast.config.APP_BACKDROP).called)
+
+    def test_playing_app_is_left_alone_during_extraction(self):
+        self.assertFalse(self._setup_cast(pychromecast.config.APP_DASHCAST).called)
+
+
+class TestSendByteRange(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 1024
+        self.mediafile = tempfile.TemporaryFile()
+        self.mediafile.write(self.data)
+        self.mediafile.flush()
+
+    def tearDown(self):
+        self.mediafile.close()
+
+    def _send(self, infile, start, stop):
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                future = executor.submit(
+                    send_byte_range,
+                    infile,
+                    sender,
+                    sender.makefile("wb", buffering=0),
+                    start,
+                    stop,
+                )
+                received = b""
+                while len(received) < stop - start + 1:
+                    received += receiver.recv(65536)
+                future.result()
+        return received
+
+    def test_sendfile_matches_buffered_copy(self):
+        """The sendfile path sends the same bytes as copy_byte_range."""
+        buffered = io.BytesIO()
+        copy_byte_range(self.mediafile, buffered, 1000, 99999)
+        self.assertEqual(self._send(self.mediafile, 1000, 99999), buffered.getvalue())
+        self.assertEqual(buffered.getvalue(), self.data[1000:100000])
+
+    def test_falls_back_without_fileno(self):
+        """File objects that are not backed by a real file use the buffered copy."""
+        infile = io.BytesIO(self.data)
+        self.assertEqual(self._send(infile, 0, 0), self.data[:1])
+        self.assertEqual(self._send(infile, 5, 70000), self.data[5:70001])
+
+
+class TestParseByteRange(unittest.TestCase):
+    def test_closed_range(self):
+        self.assertEqual(parse_byte_range("bytes=0-499", 1000), [(0, 499)])
+
+    def test_open_ended_range(self):
+        self.assertEqual(parse_byte_range("bytes=500-", 1000), [(500, 999)])
+
+    def test_last_is_clamped_to_size(self):
+        self.assertEqual(parse_byte_range("bytes=500-5000", 1000), [(500, 999)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_byte_range("bytes=-100", 1000), [(900, 999)])
+        self.assertEqual(parse_byte_range("bytes=-5000", 1000), [(0, 999)])
+
+    def test_multiple_ranges(self):
+        self.assertEqual(
+            parse_byte_range("bytes=0-99, 200-, -10", 1000),
+            [(0, 99), (200, 999), (990, 999)],
+        )
+
+    def test_unsatisfiable_ranges_are_dropped(self):
+        self.assertEqual(parse_byte_range("bytes=1000-", 1000), [])
+        self.assertEqual(parse_byte_range("bytes=-0, 0-0", 1000), [(0, 0)])
+
+    def test_invalid_ranges(self):
+        for byte_range in ["", "bytes=", "bytes=-", "bytes=5-1", "items=0-1", "0-1"]:
+            with self.assertRaises(ValueError):
+                parse_byte_range(byte_range, 1000)
+
+
+class TestMediaServer(unittest.TestCase):
+    def setUp(self):
+        self.server = MediaServer("127.0.0.1", 0)
+        self.server.start()
+        self.tempfiles = []
+
+    def tearDown(self):
+        self.server.stop()
+        for tfile in self.tempfiles:
+            tfile.close()
+
+    def _add_file(self, content, suffix):
+        tfile = tempfile.NamedTemporaryFile(suffix=suffix)
+        tfile.write(content)
+        tfile.flush()
+        self.tempfiles.append(tfile)
+        return self.server.add_file(tfile.name)
+
+    def _request(self, conn, url, method="GET", headers=None):
+        path, query = urlsplit(url)[2:4]
+        target = "{}?{}".format(path, query) if query else path
+        conn.request(method, target, headers=headers or {})
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_serves_many_files_on_one_connection(self):
+        """Registered files are routed by path, over one persistent connection."""
+        video_url = self._add_file(b"video" * 1000, ".mp4")
+        subs_url = self._add_file(b"WEBVTT\n\n", ".vtt")
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        response, body = self._request(conn, video_url)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "video/mp4")
+        self.assertEqual(body, b"video" * 1000)
+        response, body = self._request(conn, subs_url, headers={"Range": "bytes=-3"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader("Content-Type"), "text/vtt")
+        self.assertEqual(body, b"T\n\n")
+        conn.close()
+
+    def test_head_sends_no_body(self):
+        url = self._add_file(b"abc", ".mp3")
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        response, body = self._request(conn, url, method="HEAD")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Length"), "3")
+        self.assertEqual(body, b"")
+        conn.close()
+
+    def test_stream_is_followed_until_finished(self):
+        """Streams are served with a chunked response that follows them as they arrive."""
+        read_fd, write_fd = os.pipe()
+        url = self.server.add_stream(open(read_fd, "rb"), "video/mp4")
+        os.write(write_fd, b"first part, ")
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        conn.request("GET", urlsplit(url).path)
+        response = conn.getresponse()
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        self.assertEqual(response.read(12), b"first part, ")
+        os.write(write_fd, b"second part")
+        os.close(write_fd)
+        self.assertEqual(response.read(), b"second part")
+        response, body = self._request(conn, url, headers={"Range": "bytes=6-"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader("Content-Range"), "bytes 6-22/*")
+        self.assertEqual(body, b"part, second part")
+        conn.close()
+
+    def test_srt_is_converted_while_served(self):
+        tfile = tempfile.NamedTemporaryFile(suffix=".srt")
+        tfile.write(b"1\r\n00:00:01,000 --> 00:00:02,500\r\nCaf\xe9\r\n")
+        tfile.flush()
+        self.tempfiles.append(tfile)
+        url = SubsInfo(tfile.name, "127.0.0.1", 0).serve(self.server)
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        # The size of the result isn't known, so ranges are answered with everything.
+        response, body = self._request(conn, url, headers={"Range": "bytes=0-1"})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "text/vtt")
+        self.assertEqual(
+            body.decode(), "WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.500\nCaf\u00e9\n"
+        )
+        conn.close()
+
+    def test_converted_subtitles_are_cached(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        cache = SubtitleCache(Path(tempdir.name))
+        tfile = tempfile.NamedTemporaryFile(suffix=".srt")
+        tfile.write(b"1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+        tfile.flush()
+        self.tempfiles.append(tfile)
+        expected = b"WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.000\nHi\n"
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        first_url = SubsInfo(tfile.name, "127.0.0.1", 0, cache=cache).serve(self.server)
+        self.assertEqual(self._request(conn, first_url)[1], expected)
+
+        # The second time around, the stored result is served without converting.
+        (entry,) = cache.cache_dir.iterdir()
+        entry.write_text("WEBVTT\n\nfrom the cache\n")
+        url = SubsInfo(tfile.name, "127.0.0.1", 0, cache=cache).serve(self.server)
+        self.assertEqual(self._request(conn, url)[1], b"WEBVTT\n\nfrom the cache\n")
+        conn.close()
+
+    def test_evicted_subtitles_are_converted_again(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        cache = SubtitleCache(Path(tempdir.name))
+        tfile = tempfile.NamedTemporaryFile(suffix=".srt")
+        tfile.write(b"1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+        tfile.flush()
+        self.tempfiles.append(tfile)
+        expected = b"WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.000\nHi\n"
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        first_url = SubsInfo(tfile.name, "127.0.0.1", 0, cache=cache).serve(self.server)
+        self.assertEqual(self._request(conn, first_url)[1], expected)
+
+        url = SubsInfo(tfile.name, "127.0.0.1", 0, cache=cache).serve(self.server)
+        # Evicted (eg. by another catt process) before the device gets to it.
+        (entry,) = cache.cache_dir.iterdir()
+        entry.unlink()
+        response, body = self._request(conn, url)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, expected)
+        self.assertTrue(entry.exists())
+        conn.close()
+
+    def test_subtitle_timing_is_taken_from_the_url(self):
+        tfile = tempfile.NamedTemporaryFile(suffix=".srt")
+        tfile.write(b"1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+        tfile.flush()
+        self.tempfiles.append(tfile)
+        timing = SubtitleTiming(offset=1.5)
+        url = SubsInfo(tfile.name, "127.0.0.1", 0, timing=timing).serve(self.server)
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        self.assertEqual(
+            self._request(conn, url)[1],
+            b"WEBVTT\n\n1\n00:00:02.500 --> 00:00:03.500\nHi\n",
+        )
+        retimed_url = url.replace("offset=1.5", "offset=-0.5")
+        self.assertEqual(
+            self._request(conn, retimed_url)[1],
+            b"WEBVTT\n\n1\n00:00:00.500 --> 00:00:01.500\nHi\n",
+        )
+        conn.close()
+
+    def test_remote_subtitle_tracks_are_converted(self):
+        remote_url = self._add_file(b"1\n00:00:01,000 --> 00:00:02,000\nHi\n", ".srt")
+        track = {
+            "trackId": 1,
+            "trackContentId": remote_url,
+            "language": "en",
+            "trackContentType": "application/x-subrip",
+        }
+        (served_track,) = serve_subtitle_tracks(self.server, [track])
+        self.assertEqual(served_track["trackContentType"], "text/vtt")
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        response, body = self._request(conn, served_track["trackContentId"])
+        self.assertEqual(body, b"WEBVTT\n\n1\n00:00:01.000 --> 00:00:02.000\nHi\n")
+        conn.close()
+
+    def test_server_keeps_serving_after_a_request(self):
+        url = self._add_file(b"WEBVTT\n", ".vtt")
+        for _ in range(2):
+            conn = http.client.HTTPConnection(*self.server.server_address)
+            self.assertEqual(self._request(conn, url)[1], b"WEBVTT\n")
+            conn.close()
+        self.assertTrue(self.server.connection_handled.wait(timeout=5))
+
+    def test_idle_connections_free_their_workers(self):
+        server = MediaServer("127.0.0.1", 0, max_workers=2)
+        server.start()
+        self.addCleanup(server.stop)
+        self._add_file(b"abc", ".mp3")
+        url = server.add_file(self.tempfiles[-1].name)
+        with mock.patch("catt.http_server.KEEPALIVE_TIMEOUT", 0.5):
+            idle_conns = [
+                http.client.HTTPConnection(*server.server_address) for _ in range(2)
+            ]
+            for conn in idle_conns:
+                self.assertEqual(self._request(conn, url)[1], b"abc")
+            # Both workers are held by the idle connections, until they time out.
+            conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+            self.assertEqual(self._request(conn, url)[1], b"abc")
+        for conn in [*idle_conns, conn]:
+            conn.close()
+
+    def test_paused_reader_gets_the_whole_response(self):
+        tfile = tempfile.NamedTemporaryFile(suffix=".mp4")
+        tfile.truncate(64 * 1024 * 1024)
+        self.tempfiles.append(tfile)
+        url = self.server.add_file(tfile.name)
+        with mock.patch("catt.http_server.KEEPALIVE_TIMEOUT", 0.2):
+            conn = http.client.HTTPConnection(*self.server.server_address)
+            conn.request("GET", urlsplit(url).path)
+            response = conn.getresponse()
+            # Long enough for a send to time out, if there was a timeout.
+            time.sleep(0.5)
+            self.assertEqual(len(response.read()), 64 * 1024 * 1024)
+        conn.close()
+
+    def test_overlapping_requests_are_served_concurrently(self):
+        tfile = tempfile.NamedTemporaryFile(suffix=".mp4")
+        tfile.truncate(64 * 1024 * 1024)
+        self.tempfiles.append(tfile)
+        video_url = self.server.add_file(tfile.name)
+        subs_url = self._add_file(b"WEBVTT\n", ".vtt")
+        first_conn = http.client.HTTPConnection(*self.server.server_address)
+        first_conn.request(
+            "GET", urlsplit(video_url).path, headers={"Range": "bytes=0-"}
+        )
+        first = first_conn.getresponse()
+        self.assertEqual(first.status, 206)
+        # The body of the first response is far larger than the socket buffers, so
+        # its worker is stuck sending it until it is read.
+        second_conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        self.assertEqual(self._request(second_conn, subs_url)[1], b"WEBVTT\n")
+        self.assertFalse(first.isclosed())
+        self.assertEqual(len(first.read()), 64 * 1024 * 1024)
+        for conn in [first_conn, second_conn]:
+            conn.close()
+
+    def test_removed_and_unknown_files_are_not_found(self):
+        url = self._add_file(b"abc", ".mp3")
+        self.server.remove_file(url)
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        self.assertEqual(self._request(conn, url)[0].status, 404)
+        self.assertEqual(self._request(conn, "/nothing/here.mp4")[0].status, 404)
+        conn.close()
+
+
+def _box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+class TestFaststart(unittest.TestCase):
+    def setUp(self):
+        self.chunks = [b"first chunk", b"second chunk"]
+        ftyp = _box(b"ftyp", b"isom\x00\x00\x02\x00")
+        mdat = _box(b"mdat", b"".join(self.chunks))
+        offsets = [len(ftyp) + 8, len(ftyp) + 8 + len(self.chunks[0])]
+        stco = _box(
+            b"stco", struct.pack(">II", 0, len(offsets)) + struct.pack(">II", *offsets)
+        )
+        moov = _box(
+            b"moov", _box(b"trak", _box(b"mdia", _box(b"minf", _box(b"stbl", stco))))
+        )
+        self.mediafile = tempfile.NamedTemporaryFile(suffix=".mp4")
+        self.mediafile.write(ftyp + mdat + moov)
+        self.mediafile.flush()
+        self.server = MediaServer("127.0.0.1", 0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.mediafile.close()
+
+    def _get(self, url, headers=None):
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        conn.request("GET", urlsplit(url).path, headers=headers or {})
+        body = conn.getresponse().read()
+        conn.close()
+        return body
+
+    def test_moov_is_moved_before_mdat(self):
+        """The moov box is served first, and its chunk offsets still point at the chunks."""
+        body = self._get(self.server.add_file(self.mediafile.name, faststart=True))
+        self.mediafile.seek(0)
+        self.assertEqual(len(body), len(self.mediafile.read()))
+        boxes = list(read_boxes(io.BytesIO(body), 0, len(body)))
+        self.assertEqual([box.type for box in boxes], [b"ftyp", b"moov", b"mdat"])
+        stco_end = boxes[1].end
+        offsets = struct.unpack(">II", body[stco_end - 8 : stco_end])
+        for offset, chunk in zip(offsets, self.chunks):
+            self.assertEqual(body[offset : offset + len(chunk)], chunk)
+
+    def test_ranges_map_onto_virtual_file(self):
+        url = self.server.add_file(self.mediafile.name, faststart=True)
+        body = self._get(url)
+        for first, last in [
+            (0, 5),
+            (10, 30),
+            (20, len(body) - 1),
+            (len(body) - 3, len(body) - 1),
+        ]:
+            self.assertEqual(
+                self._get(url, {"Range": "bytes={}-{}".format(first, last)}),
+                body[first : last + 1],
+            )
+
+    def test_layout_cache_is_bounded_by_size(self):
+        name, size = self.mediafile.name, self.mediafile.seek(0, io.SEEK_END)
+        layout = get_faststart_layout(name, size, 1)
+        self.assertIs(get_faststart_layout(name, size, 1), layout)
+        with mock.patch("catt.faststart.LAYOUT_CACHE_SIZE", len(layout.moov)):
+            get_faststart_layout(name, size, 2)
+        # The first layout no longer fits, so the file is parsed again.
+        self.assertIsNot(get_faststart_layout(name, size, 1), layout)
+
+    def test_disabled_serves_original_file(self):
+        body = self._get(self.server.add_file(self.mediafile.name))
+        self.mediafile.seek(0)
+        self.assertEqual(body, self.mediafile.read())
+
+
+class TestDeviceCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_path = Path(self.tempdir.name, "catt", "devices.json")
+        self.cast_info = pychromecast.CastInfo(
+            set(),
+            uuid.uuid4(),
+            "Chromecast",
+            "Living Room",
+            "192.168.1.10",
+            8009,
+            "cast",
+            "Google Inc.",
+        )
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_lookup_by_name_and_uuid(self):
+        DeviceCache(self.cache_path).set_data([self.cast_info])
+        cache = DeviceCache(self.cache_path)
+        self.assertEqual(cache.get_data("Living Room")["host"], "192.168.1.10")
+        self.assertEqual(
+            cache.get_data(str(self.cast_info.uuid))["friendly_name"], "Living Room"
+        )
+        self.assertIsNone(cache.get_data("Kitchen"))
+
+    def test_stale_and_removed_entries_are_ignored(self):
+        DeviceCache(self.cache_path).set_data([self.cast_info])
+        self.assertIsNone(DeviceCache(self.cache_path, ttl=-1).get_data("Living Room"))
+        cache = DeviceCache(self.cache_path)
+        cache.remove(str(self.cast_info.uuid))
+        self.assertIsNone(cache.get_data("Living Room"))
+
+    def test_missing_cache_is_empty(self):
+        self.assertIsNone(DeviceCache(self.cache_path).get_data("Living Room"))
+
+
+class _ConnectingCast:
+    def __init__(self, answers):
+        self.answers = answers
+        self.disconnected = False
+
+    def wait(self, timeout=None):
+        if not self.answers:
+            raise pychromecast.error.RequestTimeout("wait", timeout)
+
+    def disconnect(self, timeout=None):
+        self.disconnected = True
+
+
+class TestConnectCast(unittest.TestCase):
+    def test_answering_device_reports_latency(self):
+        cast = _ConnectingCast(answers=True)
+        latency = connect_cast(cast, timeout=1)
+        self.assertIsNotNone(latency)
+        self.assertGreaterEqual(latency, 0)
+        self.assertFalse(cast.disconnected)
+
+    def test_silent_device_is_dropped(self):
+        cast = _ConnectingCast(answers=False)
+        self.assertIsNone(connect_cast(cast, timeout=1))
+        self.assertTrue(cast.disconnected)
+
+
+@click.group()
+def _daemon_cli():
+    pass
+
+
+@_daemon_cli.command()
+@click.pass_obj
+def status(settings):
+    click.echo("Status of {}".format(settings["device"]))
+
+
+@_daemon_cli.command()
+def pause():
+    raise CastError("Nothing is currently playing")
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.daemon = CattDaemon(_daemon_cli, lambda: {"device": "Living Room"})
+
+    def test_get_command_name(self):
+        self.assertEqual(get_command_name(["pause"]), "pause")
+        self.assertEqual(get_command_name(["-d", "tv", "volume", "50"]), "volume")
+        self.assertEqual(get_command_name(["--device=tv", "status"]), "status")
+        self.assertIsNone(get_command_name(["--help"]))
+
+    def test_output_and_exit_code_are_captured(self):
+        response = self.daemon.run_command(["status"])
+        self.assertEqual(response["exit_code"], 0)
+        self.assertEqual(response["stdout"], "Status of Living Room\n")
+
+        response = self.daemon.run_command(["pause"])
+        self.assertEqual(response["exit_code"], 1)
+        self.assertEqual(response["stderr"], "Error: Nothing is currently playing.\n")
+
+    def test_other_commands_run_locally(self):
+        self.assertFalse(self.daemon.run_command(["cast", "video.mp4"])["handled"])
+        with tempfile.TemporaryDirectory() as tempdir:
+            socket_path = Path(tempdir, "catt.sock")
+            self.assertIsNone(run_in_daemon(["pause"], socket_path))
+
+
+class TestCastPool(unittest.TestCase):
+    def test_controllers_are_dropped_after_each_command(self):
+        cast_info = pychromecast.CastInfo(
+            set(),
+            uuid.uuid4(),
+            "Chromecast",
+            "Living Room",
+            "127.0.0.1",
+            8009,
+            "cast",
+            "Google Inc.",
+        )
+        pool = CastPool()
+        pool.browser = mock.Mock(devices={cast_info.uuid: cast_info}, zc=None)
+        with mock.patch("catt.discovery.connect_cast", side_effect=lambda c, t: c):
+            cast = pool.get_cast("Living Room", discovery_timeout=0)
+        handlers = pool._registered_handlers(cast)
+
+        for _ in range(3):
+            YoutubeCastController(cast, get_app("youtube", "cast"))
+            self.assertEqual(len(pool._registered_handlers(cast)), len(handlers) + 1)
+            pool.reset_listeners()
+            self.assertEqual(pool._registered_handlers(cast), handlers)
+            self.assertEqual(cast.media_controller._status_listeners, [])
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tempdir.name, "cache")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_get_and_expiry(self):
+        cache = FileCache(self.cache_dir)
+        cache.set("fresh", {"title": "Video"}, time.time() + 60)
+        cache.set("stale", {"title": "Video"}, time.time() - 1)
+        self.assertEqual(cache.get("fresh"), {"title": "Video"})
+        self.assertIsNone(cache.get("stale"))
+        self.assertIsNone(cache.get("missing"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = FileCache(self.cache_dir, max_size=250)
+        expires = time.time() + 60
+        for index, key in enumerate(["first", "second"]):
+            cache.set(key, "x" * 50, expires)
+            # Make sure that the modification times differ.
+            os.utime(cache._entry_path(key), (index, index))
+        cache.get("first")
+        cache.set("third", "x" * 50, expires)
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNotNone(cache.get("third"))
+
+
+class TestSubtitleCache(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.cache = SubtitleCache(Path(tempdir.name, "subs"), max_size=250)
+
+    def test_entries_appear_once_complete(self):
+        pieces = self.cache.store("first", ["WEBVTT\n\n", "x" * 100])
+        self.assertEqual(next(pieces), "WEBVTT\n\n")
+        self.assertIsNone(self.cache.get("first"))
+        pieces.close()
+        self.assertIsNone(self.cache.get("first"))
+        self.assertEqual(list(self.cache.cache_dir.iterdir()), [])
+
+        self.assertEqual(len("".join(self.cache.store("first", ["x" * 100]))), 100)
+        self.assertEqual(self.cache.get("first").read_text(), "x" * 100)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for index, digest in enumerate(["first", "second"]):
+            list(self.cache.store(digest, ["x" * 100]))
+            os.utime(self.cache.get(digest), (index, index))
+        self.cache.get("first")
+        list(self.cache.store("third", ["x" * 100]))
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNotNone(self.cache.get("third"))
+
+
+class TestUrlExpiry(unittest.TestCase):
+    def test_earliest_expiry_is_found(self):
+        info = {
+            "url": "https://example.com/video.mp4",
+            "formats": [
+                {"url": "https://example.com/1.mp4?id=1&expire=1700000500&sig=abc"},
+                {"url": "https://example.com/2.mp4?Expires=1700000000"},
+                {"manifest_url": "https://example.com/api/expire/1700000900/id/1"},
+            ],
+        }
+        self.assertEqual(get_url_expiry(info), 1700000000)
+
+    def test_no_expiry(self):
+        self.assertIsNone(get_url_expiry({"url": "https://example.com/expired.mp4"}))
+
+
+class TestPlaylistEntries(unittest.TestCase):
+    def setUp(self):
+        self.fetched = 0
+
+    def _entries(self, count=100):
+        for index in range(count):
+            self.fetched += 1
+            yield {"id": str(index)}
+
+    def test_entries_are_fetched_as_needed(self):
+        entries = PlaylistEntries(self._entries())
+        self.assertEqual(entries[0]["id"], "0")
+        self.assertEqual(self.fetched, 1)
+        self.assertEqual(entries[9]["id"], "9")
+        self.assertEqual(self.fetched, 10)
+        self.assertIsNone(entries.count)
+
+    def test_only_a_window_is_kept(self):
+        entries = PlaylistEntries(
+            self._entries(), restart=lambda: self._entries(), window=5
+        )
+        self.assertEqual([e["id"] for e in entries][-1], "99")
+        self.assertEqual(entries.count, 100)
+        self.assertEqual(len(entries._window), 5)
+        self.assertEqual(entries[97]["id"], "97")
+        self.assertEqual(self.fetched, 100)
+        # Earlier entries can only be had by starting over.
+        self.assertEqual(entries[3]["id"], "3")
+        self.assertEqual(self.fetched, 104)
+
+    def test_out_of_range_and_empty(self):
+        entries = PlaylistEntries(self._entries(3))
+        with self.assertRaises(IndexError):
+            entries[3]
+        self.assertFalse(PlaylistEntries(self._entries(0)))
+        self.assertEqual(PlaylistEntries([{"id": "0"}]).count, 1)
+
+
+class _FakeVideoIE(InfoExtractor):
+    _VALID_URL = r"https://fake\.test/video/(?P<id>\w+)"
+    requests = 0
+
+    def _real_extract(self, url):
+        _FakeVideoIE.requests += 1
+        video_id = self._match_id(url)
+        return {
+            "id": video_id,
+            "title": "Video " + video_id,
+            "url": "https://fake.test/media/{}.mp4".format(video_id),
+            "ext": "mp4",
+        }
+
+
+class _FakePlaylistIE(InfoExtractor):
+    _VALID_URL = r"https://fake\.test/watch\?v=(?P<id>\w+)&list=(?P<list>\w+)"
+    requests = 0
+
+    def _real_extract(self, url):
+        video_id, list_id = self._match_valid_url(url).group("id", "list")
+        if not self._yes_playlist(list_id, video_id):
+            # Like YouTube, no request is needed to know what the video is.
+            return self.url_result("https://fake.test/video/" + video_id, _FakeVideoIE)
+        _FakePlaylistIE.requests += 1
+        entries = [
+            self.url_result("https://fake.test/video/" + i, _FakeVideoIE, i)
+            for i in ("a", "b", "c")
+        ]
+        return self.playlist_result(entries, list_id, "Playlist " + list_id)
+
+
+class _FakeSubtitlesIE(InfoExtractor):
+    _VALID_URL = r"https://fake\.test/subtitled/(?P<id>\w+)"
+
+    def _real_extract(self, url):
+        return {
+            "id": self._match_id(url),
+            "title": "Subtitled",
+            "url": "https://fake.test/media/subtitled.mp4",
+            "ext": "mp4",
+            "subtitles": {
+                "de": [{"url": "https://fake.test/de.vtt", "ext": "vtt"}],
+                "en": [{"url": "https://fake.test/en.srt", "ext": "srt"}],
+                "fr": [{"url": "https://fake.test/fr.json3", "ext": "json3"}],
+            },
+        }
+
+
+def _add_fake_extractors(ydl):
+    ydl.add_info_extractor(_FakePlaylistIE())
+    ydl.add_info_extractor(_FakeVideoIE())
+    ydl.add_info_extractor(_FakeSubtitlesIE())
+
+
+@mock.patch.object(
+    yt_dlp.YoutubeDL, "add_default_info_extractors", _add_fake_extractors
+)
+class TestMixedUrlExtraction(unittest.TestCase):
+    url = "https://fake.test/watch?v=b&list=PL1"
+
+    def setUp(self):
+        _FakeVideoIE.requests = 0
+        _FakePlaylistIE.requests = 0
+
+    def _requests(self):
+        return _FakePlaylistIE.requests + _FakeVideoIE.requests
+
+    def test_ids_take_one_request(self):
+        stream = StreamInfo(self.url)
+        self.assertEqual(stream.playlist_id, "PL1")
+        self.assertEqual(stream.video_id, "b")
+        self.assertEqual(self._requests(), 1)
+
+    def test_video_url_takes_two_requests(self):
+        stream = StreamInfo(self.url)
+        self.assertEqual(stream.video_title, "Video b")
+        self.assertEqual(stream.video_url, "https://fake.test/media/b.mp4")
+        self.assertEqual(self._requests(), 2)
+
+    def test_video_missing_from_playlist(self):
+        stream = StreamInfo("https://fake.test/watch?v=z&list=PL1")
+        self.assertEqual(stream.video_id, "z")
+        self.assertEqual(stream.video_url, "https://fake.test/media/z.mp4")
+        self.assertEqual(self._requests(), 2)
+
+    def test_subtitle_tracks(self):
+        stream = StreamInfo("https://fake.test/subtitled/x")
+        self.assertEqual([t["language"] for t in stream.media_info["tracks"]], ["de"])
+        self.assertEqual(
+            [t["language"] for t in stream.converted_subtitle_tracks], ["en"]
+        )
+
+    def test_prefetched_entries(self):
+        stream = StreamInfo(self.url)
+        stream.start_prefetching(count=2)
+        stream.set_playlist_entry(0)
+        for future in list(stream._prefetcher._futures.values()):
+            future.result(timeout=5)
+        requests = self._requests()
+        stream.set_playlist_entry(1)
+        self.assertEqual(stream.video_url, "https://fake.test/media/b.mp4")
+        self.assertEqual(self._requests(), requests)
+        stream.stop_prefetching()
+
+
+class TestEntryPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.resolved = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _resolve(self, entry):
+        self.started.set()
+        self.release.wait(5)
+        self.resolved.append(entry["id"])
+        return {"id": entry["id"], "url": entry.get("url")}
+
+    def test_skipped_entries_are_cancelled(self):
+        prefetcher = EntryPrefetcher(self._resolve, workers=1)
+        prefetcher.prefetch({i: {"id": str(i)} for i in range(1, 4)})
+        self.started.wait(5)
+        # The first entry is already being resolved, the others are cancelled.
+        prefetcher.prefetch({7: {"id": "7"}})
+        self.release.set()
+        self.assertEqual(prefetcher.pop(7), {"id": "7", "url": None})
+        self.assertEqual(self.resolved, ["1", "7"])
+        self.assertIsNone(prefetcher.pop(2))
+
+    def test_expired_entries_are_dropped(self):
+        self.release.set()
+        prefetcher = EntryPrefetcher(self._resolve)
+        expires = int(time.time()) + 60
+        url = "https://example.com/video.mp4?expire={}".format(expires)
+        prefetcher.prefetch({1: {"id": "1", "url": url}})
+        self.assertIsNone(prefetcher.pop(1))
+        self.assertEqual(self.resolved, ["1"])
+
+
+class TestImports(unittest.TestCase):
+    def test_cli_does_not_import_extractor(self):
+        """Control commands shouldn't pay for importing yt-dlp."""
+        code = (
+            "import sys, catt.cli; "
+            "print(' '.join(m for m in ('yt_dlp', 'catt.stream_info', 'catt.subs_info') "
+            "if m in sys.modules))"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code], text=True)
+        self.assertEqual(output.strip(), "")
+
+
 if __name__ == "__main__":
     import sys
 